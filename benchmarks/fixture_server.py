@@ -0,0 +1,146 @@
+"""
+Serves the saved BBC Good Food pages in benchmarks/fixtures on a local
+address, using the same paths as the real site, so RecipeScraper can be
+pointed at it with `RecipeScraper(website_url=server.url)`
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+import os
+import re
+import threading
+import time
+
+FIXTURES_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+# (path pattern, fixture file template) tried in order
+ROUTES = [
+    (re.compile(r"^/$"), "index.html"),
+    (re.compile(r"^/search/?$"), "search.html"),
+    (re.compile(r"^/search/recipes/page/(?P<page>\d+)/?$"), "results-page-{page}.html"),
+    (re.compile(r"^/recipes/(?P<recipe>[\w-]+)/?$"), "recipes/{recipe}.html"),
+    (re.compile(r"^/images/[^/]+$"), "images/placeholder.jpg")
+]
+
+
+def resolve_fixture(path: str, fixtures_folder: str = FIXTURES_FOLDER) -> str:
+    """Returns the fixture file served for a URL path
+
+    Parameters
+    ----------
+    path : str
+        The URL path (any query string is ignored)
+    fixtures_folder : str, optional
+        The folder holding the saved pages, by default benchmarks/fixtures
+
+    Returns
+    -------
+    str
+        The fixture file, or None if the site would show its error page
+    """
+    path = urlsplit(path).path
+    for pattern, template in ROUTES:
+        match = pattern.match(path)
+        if match:
+            fixture = os.path.join(fixtures_folder, template.format(**match.groupdict()))
+            return fixture if os.path.isfile(fixture) else None
+    return None
+
+
+class FixtureServer:
+    """
+    A threaded HTTP server for the fixture pages, used as a context manager
+
+    Attributes
+    ----------
+    url : str
+        The base URL of the server e.g. http://127.0.0.1:50123/
+    latency : float
+        Seconds added to every response, to approximate a remote site
+    """
+
+    def __init__(self,
+            port: int = 0,
+            latency: float = 0.0,
+            fixtures_folder: str = FIXTURES_FOLDER):
+        """
+        Parameters
+        ----------
+        port : int, optional
+            The port to listen on, by default any free port
+        latency : float, optional
+            Seconds added to every response, by default 0
+        fixtures_folder : str, optional
+            The folder holding the saved pages, by default benchmarks/fixtures
+        """
+        self.latency = latency
+        self.__fixtures_folder = fixtures_folder
+        self.__requests = 0
+        self.__lock = threading.Lock()
+        self.__httpd = ThreadingHTTPServer(("127.0.0.1", port), self.__handler())
+        self.__thread = None
+        host, port = self.__httpd.server_address[:2]
+        self.url = f"http://{host}:{port}/"
+
+    @property
+    def requests(self) -> int:
+        """Number of requests served"""
+        return self.__requests
+
+    def start(self) -> "FixtureServer":
+        """Starts serving from a background thread"""
+        self.__thread = threading.Thread(
+            target=self.__httpd.serve_forever, name="fixture-server", daemon=True)
+        self.__thread.start()
+        return self
+
+    def stop(self):
+        """Stops the server"""
+        self.__httpd.shutdown()
+        self.__httpd.server_close()
+        if self.__thread is not None:
+            self.__thread.join()
+
+    def __enter__(self) -> "FixtureServer":
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def __count_request(self):
+        with self.__lock:
+            self.__requests += 1
+
+    def __handler(self) -> type:
+        """Returns a request handler class bound to this server"""
+        server = self
+        fixtures_folder = self.__fixtures_folder
+        count_request = self.__count_request
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                count_request()
+                if server.latency > 0:
+                    time.sleep(server.latency)
+                fixture = resolve_fixture(self.path, fixtures_folder)
+                status = 200
+                if fixture is None:
+                    # The site shows an error page (see recipe_constants.ERROR_PAGE_DIV_LOC)
+                    status = 404
+                    fixture = os.path.join(fixtures_folder, "not_found.html")
+                with open(fixture, "rb") as f:
+                    body = f.read()
+                self.send_response(status)
+                self.send_header(
+                    "Content-Type",
+                    "image/jpeg" if fixture.endswith(".jpg") else "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # Keep benchmark output clean
+                pass
+
+        return Handler
@@ -0,0 +1,351 @@
+"""
+Load harness which runs `pipeline.run_pipeline` end to end against the
+mock site (benchmarks.mock_site), sweeping the number of worker
+processes and the batch size (recipe cards per results page, so records
+per JSON file and per database insert).
+Images and JSON files go to a local folder, a moto S3 server, or any S3
+compatible endpoint (e.g. MinIO); records go to Postgres (--db-url)
+or a SQLite file per run. Each worker runs its own search so workers
+do not share items.
+
+Reports recipe pages per second, p50 / p99 latency of recipe pages and
+results pages (from the trace spans of each worker) and the peak RSS of
+the workers including their browsers.
+
+Usage (from the repository root):
+    python -m benchmarks.load --workers 1 2 4 --batch-sizes 12 24 --pages 2
+    python -m benchmarks.load --storage s3 --latency 0.2 --error-rate 0.02 --throttle-rate 0.05
+    python -m benchmarks.load --storage s3 --s3-endpoint http://localhost:9000 --db-url postgresql+psycopg2://...
+"""
+
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import uuid
+
+from benchmarks.run import REPO_FOLDER
+from benchmarks.mock_site import MockSite
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+class _RssSampler:
+    """
+    Samples the total RSS of a set of processes and their descendants
+    (e.g. chromedriver and Chrome) from a background thread, keeping the peak.
+    Without psutil the peak RSS of the largest child process is reported
+    """
+
+    def __init__(self, interval: float = 0.25):
+        self.peak_bytes = 0
+        self.method = "psutil" if psutil is not None else "getrusage"
+        self.__interval = interval
+        self.__pids = []
+        self.__stop = threading.Event()
+        self.__thread = threading.Thread(target=self.__sample, name="rss-sampler", daemon=True)
+
+    def start(self, pids: list):
+        self.__pids = pids
+        self.__thread.start()
+
+    def stop(self) -> int:
+        self.__stop.set()
+        self.__thread.join()
+        if psutil is None:
+            # ru_maxrss is in KiB on Linux
+            self.peak_bytes = 1024 * resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        return self.peak_bytes
+
+    def __sample(self):
+        while psutil is not None and not self.__stop.wait(self.__interval):
+            total = 0
+            for pid in self.__pids:
+                try:
+                    process = psutil.Process(pid)
+                    for member in [process] + process.children(recursive=True):
+                        total += member.memory_info().rss
+                except psutil.Error:
+                    # Finished between listing and reading
+                    continue
+            self.peak_bytes = max(self.peak_bytes, total)
+
+
+def _worker(config: dict):
+    """Runs the pipeline in a worker process, writing a trace of its spans
+
+    Parameters
+    ----------
+    config : dict
+        The worker settings from `run_load`
+    """
+    sys.path.insert(0, os.path.join(REPO_FOLDER, "source"))
+    # Progress bars from every worker are not useful
+    sys.stdout = sys.stderr = open(os.devnull, "w")
+    try:
+        _run_worker(config)
+    except BaseException:
+        # Reported by run_load
+        with open(config["error_file"], "w") as f:
+            f.write(traceback.format_exc())
+        raise
+
+
+def _run_worker(config: dict):
+    """Creates the storages and runs the pipeline for a worker"""
+    if config["s3_endpoint"] is not None:
+        os.environ["AWS_ENDPOINT_URL"] = config["s3_endpoint"]
+    from package.utils import rate_limit
+    from package.utils import tracing
+    from package.storage.db_storage import DBStorage
+    import pipeline
+
+    if config["s3_endpoint"] is None:
+        from package.storage.file_storage import FileStorage
+        data_folder = os.path.join(config["folder"], config["search"])
+        file_store = FileStorage(config["folder"], data_folder, os.path.join(data_folder, "images"))
+    else:
+        from package.storage.s3_storage import S3Storage
+        file_store = S3Storage(
+            None, None, "us-east-1", "load", config["search"], "images",
+            bucket_name=config["bucket"])
+    rate_limit.configure(enabled=config["rate_limit"])
+    tracing.enable_tracing(config["trace"])
+    try:
+        pipeline.run_pipeline(
+            config["search"],
+            config["pages"],
+            file_store,
+            DBStorage(config["db_url"]),
+            website_url=config["site_url"])
+    finally:
+        tracing.disable_tracing()
+
+
+def _percentile(values: list, percent: float) -> float:
+    """Returns a percentile of a list of values (nearest rank), or None if empty"""
+    if len(values) == 0:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(percent / 100 * len(values)))]
+
+
+def _span_durations(trace_files: list) -> dict:
+    """Returns the durations (ms) of each span name in trace files"""
+    durations = {}
+    for trace_file in trace_files:
+        if not os.path.exists(trace_file):
+            continue
+        with open(trace_file) as f:
+            try:
+                events = json.load(f)
+            except ValueError:
+                # Worker killed before closing the trace
+                continue
+        for event in events:
+            if event.get("ph") == "X":
+                durations.setdefault(event["name"], []).append(event["dur"] / 1000)
+    return durations
+
+
+def _start_s3(endpoint: str) -> tuple:
+    """Starts a moto S3 server if there is no endpoint, and creates a bucket
+
+    Returns
+    -------
+    tuple
+        (endpoint URL, bucket name, server or None)
+    """
+    import boto3
+    server = None
+    if endpoint is None:
+        from moto.server import ThreadedMotoServer
+        with socket.socket() as s:
+            # A free port for the server
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+        server = ThreadedMotoServer(ip_address="127.0.0.1", port=port)
+        server.start()
+        endpoint = f"http://127.0.0.1:{port}"
+    for key in ["AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY"]:
+        # Stand-ins accept any credentials
+        os.environ.setdefault(key, "load-test")
+    bucket = f"load-{uuid.uuid4()}"
+    boto3.client("s3", endpoint_url=endpoint, region_name="us-east-1").create_bucket(Bucket=bucket)
+    return endpoint, bucket, server
+
+
+def run_load(
+        workers: int,
+        batch_size: int,
+        pages: int,
+        storage: str = "local",
+        s3_endpoint: str = None,
+        db_url: str = None,
+        site_options: dict = None,
+        rate_limit: bool = True) -> dict:
+    """Runs the pipeline in worker processes against a mock site
+
+    Parameters
+    ----------
+    workers : int
+        Number of worker processes, each running its own search
+    batch_size : int
+        Recipe cards per results page
+    pages : int
+        Results pages scraped by each worker
+    storage : str, optional
+        local or s3, by default local
+    s3_endpoint : str, optional
+        S3 compatible endpoint, by default a moto server
+    db_url : str, optional
+        SQLAlchemy URL of the database, by default a SQLite file for the run
+    site_options : dict, optional
+        MockSite latency, jitter, error_rate and throttle_rate
+    rate_limit : bool, optional
+        Pace the workers' requests with the adaptive rate limiter, by default True
+
+    Returns
+    -------
+    dict
+        The settings, throughput, latency percentiles and peak RSS of the run
+    """
+    moto_server = None
+    bucket = None
+    with tempfile.TemporaryDirectory() as folder, \
+            MockSite(results_per_page=batch_size, **(site_options or {})) as site:
+        if storage == "s3":
+            s3_endpoint, bucket, moto_server = _start_s3(s3_endpoint)
+        else:
+            s3_endpoint = None
+        db_url = db_url or f"sqlite:///{os.path.join(folder, 'load.db')}"
+        run_id = uuid.uuid4().hex[:6]
+        configs = [{
+            "search": f"load {run_id} {n}",
+            "pages": pages,
+            "folder": folder,
+            "site_url": site.url,
+            "s3_endpoint": s3_endpoint,
+            "bucket": bucket,
+            "db_url": db_url,
+            "rate_limit": rate_limit,
+            "trace": os.path.join(folder, f"trace-{n}.json"),
+            "error_file": os.path.join(folder, f"error-{n}.txt")
+        } for n in range(workers)]
+
+        context = multiprocessing.get_context("spawn")
+        processes = [context.Process(target=_worker, args=(config,), name=f"load-worker-{n}")
+            for n, config in enumerate(configs)]
+        sampler = _RssSampler()
+        start = time.perf_counter()
+        for process in processes:
+            process.start()
+        sampler.start([process.pid for process in processes])
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - start
+        peak_rss = sampler.stop()
+        if moto_server is not None:
+            moto_server.stop()
+
+        errors = []
+        for config in configs:
+            if os.path.exists(config["error_file"]):
+                with open(config["error_file"]) as f:
+                    errors.append(f.read().strip().splitlines()[-1])
+        durations = _span_durations([config["trace"] for config in configs])
+        recipes = durations.get("recipe", [])
+        results_pages = durations.get("search_page", [])
+        return {
+            "workers": workers,
+            "batch_size": batch_size,
+            "pages_per_worker": pages,
+            "storage": storage,
+            "rate_limit": rate_limit,
+            "failed_workers": sum(1 for process in processes if process.exitcode != 0),
+            "errors": errors,
+            "seconds": elapsed,
+            "recipe_pages": len(recipes),
+            "recipe_pages_per_sec": len(recipes) / elapsed,
+            "results_pages_per_sec": len(results_pages) / elapsed,
+            "recipe_p50_ms": _percentile(recipes, 50),
+            "recipe_p99_ms": _percentile(recipes, 99),
+            "results_page_p50_ms": _percentile(results_pages, 50),
+            "results_page_p99_ms": _percentile(results_pages, 99),
+            "mean_page_load_ms": statistics.mean(durations["page_load"]) if "page_load" in durations else None,
+            "peak_rss_mb": peak_rss / 2**20,
+            "rss_method": sampler.method,
+            "site": dict(site.stats)
+        }
+
+
+def format_results(rows: list) -> str:
+    """Formats the sweep results as a text table"""
+    def ms(value):
+        return f"{value:>9.1f}" if value is not None else f"{'-':>9}"
+    lines = [f"{'workers':>7} {'batch':>5} {'pages/s':>8} {'p50 ms':>9} {'p99 ms':>9} "
+        f"{'RSS MB':>8} {'failed':>6} {'429s':>5} {'500s':>5}"]
+    for row in rows:
+        lines.append(f"{row['workers']:>7} {row['batch_size']:>5} {row['recipe_pages_per_sec']:>8.2f} "
+            f"{ms(row['recipe_p50_ms'])} {ms(row['recipe_p99_ms'])} {row['peak_rss_mb']:>8.0f} "
+            f"{row['failed_workers']:>6} {row['site']['throttled']:>5} {row['site']['errors']:>5}")
+    return "\n".join(lines)
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Load test the pipeline against a mock site")
+    parser.add_argument('--workers', type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument('--batch-sizes', type=int, nargs="+", default=[24])
+    parser.add_argument('--pages', type=int, default=2,
+        help="Results pages scraped by each worker")
+    parser.add_argument('--storage', choices=["local", "s3"], default="local")
+    parser.add_argument('--s3-endpoint', type=str, default=None,
+        help="S3 compatible endpoint e.g. MinIO, by default a moto server")
+    parser.add_argument('--db-url', type=str, default=None,
+        help="SQLAlchemy URL of a Postgres database, by default a SQLite file per run")
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    parser.add_argument('--no-rate-limit', action='store_true',
+        help="Request as fast as the workers can, without the adaptive rate limiter")
+    parser.add_argument('--output', type=str, default="load_results.json")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_args()
+    site_options = {"latency": args.latency, "jitter": args.jitter,
+        "error_rate": args.error_rate, "throttle_rate": args.throttle_rate}
+    rows = []
+    print(format_results([]), flush=True)
+    for workers in args.workers:
+        for batch_size in args.batch_sizes:
+            rows.append(run_load(workers, batch_size, args.pages, args.storage,
+                args.s3_endpoint, args.db_url, site_options, not args.no_rate_limit))
+            print(format_results(rows[-1:]).splitlines()[-1], flush=True)
+    with open(args.output, "w") as f:
+        json.dump({
+            "metadata": {
+                "time": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpus": os.cpu_count(),
+                "site": site_options
+            },
+            "results": rows
+        }, f, indent=4)
+    print(format_results(rows))
@@ -0,0 +1,248 @@
+"""
+A local mock of the BBC Good Food site which generates search results and
+recipe pages (matching the Locators in recipe_constants) for any search,
+at any scale, with configurable latency, server errors and 429 (Too Many
+Requests) responses, for load testing the pipeline with
+`RecipeScraper(website_url=site.url)`
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from html import escape
+from urllib.parse import parse_qs, urlsplit
+import random
+import re
+import threading
+import time
+
+from benchmarks.fixture_server import FIXTURES_FOLDER
+
+INGREDIENTS = ["chicken thighs", "olive oil", "onion", "garlic cloves", "chopped tomatoes",
+    "double cream", "lemon", "thyme", "smoked paprika", "rice", "peas", "butter",
+    "puff pastry", "chicken stock", "spinach", "parmesan", "soy sauce", "ginger"]
+STEPS = ["Heat the oven to 200C/180C fan/gas 6.", "Fry the onion in the oil until soft.",
+    "Add the garlic and cook for 1 min more.", "Stir in the remaining ingredients and simmer.",
+    "Season and bake until golden.", "Rest for 5 mins before serving."]
+NUTRIENTS = ["kcal", "fat", "saturates", "carbs", "sugars", "fibre", "protein", "salt"]
+
+PAGE = '<!DOCTYPE html>\n<html lang="en">\n<head>\n<meta charset="utf-8">\n<title>{title}</title>\n</head>\n<body>\n{body}</body>\n</html>\n'
+
+
+def recipe_page(recipe_id: str) -> str:
+    """Generates a recipe page; the content is the same for a recipe_id on every request
+
+    Parameters
+    ----------
+    recipe_id : str
+        The recipe ID (last part of the recipe URL)
+
+    Returns
+    -------
+    str
+        The page HTML
+    """
+    rng = random.Random(recipe_id)
+    name = recipe_id.replace("-", " ").capitalize()
+    body = ['<main>\n<div class="post recipe">\n<div class="post-header">\n',
+        f'<h1 class="heading-1">{escape(name)}</h1>\n',
+        '<div class="icon-with-text time-range-list cook-and-prep-time post-header__cook-and-prep-time">\n<ul>\n']
+    for task in ["Prep:", "Cook:"]:
+        body.append(f'<li class="body-copy-small list-item"><span class="body-copy-bold mr-xxs">{task}</span>'
+            f'<span><time>{rng.randint(5, 90)} mins</time></span></li>\n')
+    body.append(f'</ul>\n</div>\n<div class="post-header__image-container"><img class="image__img" '
+        f'src="/images/{recipe_id}.jpg?quality=90&amp;resize=556,505" alt="{escape(name)}"></div>\n</div>\n')
+    body.append('<section class="recipe__ingredients col-12 mt-md col-lg-6">\n<ul class="list">\n')
+    for ingredient in rng.sample(INGREDIENTS, rng.randint(5, 12)):
+        body.append(f'<li class="pb-xxs pt-xxs list-item list-item--separator">{rng.randint(1, 500)}g {ingredient}</li>\n')
+    body.append('</ul>\n</section>\n<section class="recipe__method-steps mb-lg col-12 col-lg-6">\n<ul class="list">\n')
+    for n, step in enumerate(rng.sample(STEPS, rng.randint(3, len(STEPS))), 1):
+        body.append(f'<li class="pb-xs pt-xs list-item"><span class="mb-xxs heading-6">STEP {n}</span>'
+            f'<div class="editor-content"><p>{step}</p></div></li>\n')
+    body.append('</ul>\n</section>\n<table>\n<tbody>\n')
+    for nutrient in NUTRIENTS:
+        body.append(f'<tr class="key-value-blocks__item"><td class="key-value-blocks__key">{nutrient}</td>'
+            f'<td class="key-value-blocks__value">{rng.randint(1, 60)}g</td></tr>\n')
+    body.append('</tbody>\n</table>\n</div>\n</main>\n')
+    return PAGE.format(title=f"{escape(name)} recipe | BBC Good Food", body="".join(body))
+
+
+def results_page(search: str, page_num: int, results_per_page: int, total_results: int) -> str:
+    """Generates a page of search results, or None if past the last page
+
+    Parameters
+    ----------
+    search : str
+        The search words
+    page_num : int
+        The results page number, from 1
+    results_per_page : int
+        Recipe cards per page
+    total_results : int
+        Recipes found by every search
+
+    Returns
+    -------
+    str
+        The page HTML, or None
+    """
+    first = (page_num - 1) * results_per_page
+    if page_num < 1 or first >= total_results:
+        return None
+    slug = re.sub(r"[^\w]+", "-", search.lower()).strip("-") or "recipe"
+    body = ['<main>\n<div class="template-search-universal">\n']
+    for n in range(first, min(first + results_per_page, total_results)):
+        body.append(f'<article><a class="body-copy-small standard-card-new__description" '
+            f'href="/recipes/{slug}-recipe-{n}">{escape(search)} recipe {n}</a></article>\n')
+    body.append('<div class="pagination">\n')
+    last_page = (total_results + results_per_page - 1) // results_per_page
+    for n in sorted({1, page_num, last_page}):
+        body.append(f'<a class="pagination-item" href="/search/recipes/page/{n}/?q={escape(search)}">{n}</a>\n')
+    body.append('</div>\n</div>\n</main>\n')
+    return PAGE.format(title=f"Search results for {escape(search)} | BBC Good Food", body="".join(body))
+
+
+class MockSite:
+    """
+    A threaded HTTP server generating the mock site, used as a context manager
+
+    Attributes
+    ----------
+    url : str
+        The base URL of the site e.g. http://127.0.0.1:50123/
+    stats : dict
+        Counts of requests, server errors and 429 responses
+    """
+
+    def __init__(self,
+            total_results: int = 10000,
+            results_per_page: int = 24,
+            latency: float = 0.0,
+            jitter: float = 0.0,
+            error_rate: float = 0.0,
+            throttle_rate: float = 0.0,
+            seed: int = 0,
+            port: int = 0):
+        """
+        Parameters
+        ----------
+        total_results : int, optional
+            Recipes found by every search, by default 10000
+        results_per_page : int, optional
+            Recipe cards per page of results, by default 24
+        latency : float, optional
+            Seconds added to every response, by default 0
+        jitter : float, optional
+            Up to this many seconds added at random, by default 0
+        error_rate : float, optional
+            Fraction of page requests answered with a 500 error, by default 0
+        throttle_rate : float, optional
+            Fraction of page requests answered with 429 Too Many Requests, by default 0
+        seed : int, optional
+            Seed for the latency and error draws, by default 0
+        port : int, optional
+            The port to listen on, by default any free port
+        """
+        self.total_results = total_results
+        self.results_per_page = results_per_page
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.stats = {"requests": 0, "errors": 0, "throttled": 0}
+        self.__rng = random.Random(seed)
+        self.__lock = threading.Lock()
+        with open(f"{FIXTURES_FOLDER}/images/placeholder.jpg", "rb") as f:
+            self.__image = f.read()
+        self.__httpd = ThreadingHTTPServer(("127.0.0.1", port), self.__handler())
+        self.__thread = None
+        host, port = self.__httpd.server_address[:2]
+        self.url = f"http://{host}:{port}/"
+
+    def start(self) -> "MockSite":
+        """Starts serving from a background thread"""
+        self.__thread = threading.Thread(
+            target=self.__httpd.serve_forever, name="mock-site", daemon=True)
+        self.__thread.start()
+        return self
+
+    def stop(self):
+        """Stops the server"""
+        self.__httpd.shutdown()
+        self.__httpd.server_close()
+        if self.__thread is not None:
+            self.__thread.join()
+
+    def __enter__(self) -> "MockSite":
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def respond(self, path: str) -> tuple:
+        """Returns the response for a request path
+
+        Parameters
+        ----------
+        path : str
+            The request path and query
+
+        Returns
+        -------
+        tuple
+            (status, content type, body, delay in seconds)
+        """
+        parts = urlsplit(path)
+        search = parse_qs(parts.query).get("q", [""])[0]
+        with self.__lock:
+            self.stats["requests"] += 1
+            delay = self.latency + self.__rng.uniform(0, self.jitter)
+            draw = self.__rng.random()
+        if parts.path.startswith("/images/"):
+            return 200, "image/jpeg", self.__image, delay
+        if draw < self.throttle_rate:
+            with self.__lock:
+                self.stats["throttled"] += 1
+            return 429, "text/html; charset=utf-8", PAGE.format(
+                title="Too Many Requests", body="<h1>Too Many Requests</h1>\n").encode(), delay
+        if draw < self.throttle_rate + self.error_rate:
+            with self.__lock:
+                self.stats["errors"] += 1
+            return 500, "text/html; charset=utf-8", PAGE.format(
+                title="Server Error", body="<h1>Server Error</h1>\n").encode(), delay
+
+        page = None
+        if parts.path == "/":
+            page = PAGE.format(title="BBC Good Food", body="<main><h1>BBC Good Food</h1></main>\n")
+        elif parts.path.rstrip("/") == "/search":
+            page = results_page(search, 1, self.results_per_page, self.total_results)
+        elif match := re.match(r"^/search/recipes/page/(\d+)/?$", parts.path):
+            page = results_page(search, int(match.group(1)), self.results_per_page, self.total_results)
+        elif match := re.match(r"^/recipes/([\w-]+)/?$", parts.path):
+            page = recipe_page(match.group(1))
+        if page is None:
+            with open(f"{FIXTURES_FOLDER}/not_found.html", "rb") as f:
+                return 404, "text/html; charset=utf-8", f.read(), delay
+        return 200, "text/html; charset=utf-8", page.encode(), delay
+
+    def __handler(self) -> type:
+        """Returns a request handler class bound to this site"""
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                status, content_type, body, delay = site.respond(self.path)
+                if delay > 0:
+                    time.sleep(delay)
+                self.send_response(status)
+                if status == 429:
+                    self.send_header("Retry-After", "1")
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # Keep harness output clean
+                pass
+
+        return Handler
@@ -0,0 +1,479 @@
+"""
+Offline benchmarks for the pipeline, driven by the saved BBC Good Food
+pages in benchmarks/fixtures (served locally by FixtureServer), so no
+live site is needed and results are comparable between versions.
+
+Usage (from the repository root):
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.run --only serialize file_storage_write --repeat 50
+    python -m benchmarks.run --db-url postgresql+psycopg2://user:pw@localhost:5432/bench
+    python -m benchmarks.run --output new.json --compare baseline.json
+
+Benchmarks whose dependencies (Selenium / Chrome, pandas / SQLAlchemy)
+are not available are reported as skipped
+"""
+
+import argparse
+from contextlib import ExitStack
+import copy
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+REPO_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# recipe_scraper imports the package as `package` (run from source/)
+# and recipe_constants imports it as `source.package`, so both are needed
+for folder in [REPO_FOLDER, os.path.join(REPO_FOLDER, "source")]:
+    if folder not in sys.path:
+        sys.path.insert(0, folder)
+
+from benchmarks.fixture_server import FIXTURES_FOLDER, FixtureServer
+
+# Recipe cards on one page of BBC Good Food search results
+RECORDS_PER_PAGE = 24
+
+# name -> benchmark function, in the order they run
+BENCHMARKS = {}
+
+
+class SkipBenchmark(Exception):
+    """Raised by a benchmark which cannot run here e.g. a missing dependency"""
+
+
+def benchmark(name: str):
+    """Decorator which registers a benchmark function
+
+    Parameters
+    ----------
+    name : str
+        The name results are reported under
+    """
+    def decorator(func):
+        BENCHMARKS[name] = func
+        return func
+    return decorator
+
+
+def measure(func, repeat: int, items: int = 1, warmup: int = 1) -> dict:
+    """Times repeated calls of a function
+
+    Parameters
+    ----------
+    func : callable
+        Called with the run number (0 based, warm up runs are negative)
+    repeat : int
+        Number of timed runs
+    items : int, optional
+        Items processed per run, for throughput, by default 1
+    warmup : int, optional
+        Untimed runs first, by default 1
+
+    Returns
+    -------
+    dict
+        Run count, latency statistics (ms per run) and items per second
+    """
+    for run in range(-warmup, 0):
+        func(run)
+    timings = []
+    for run in range(repeat):
+        start = time.perf_counter()
+        func(run)
+        timings.append(time.perf_counter() - start)
+    return summarise(timings, items)
+
+
+def summarise(timings: list, items: int = 1) -> dict:
+    """Returns statistics of a list of timings
+
+    Parameters
+    ----------
+    timings : list
+        Seconds taken by each run
+    items : int, optional
+        Items processed per run, for throughput, by default 1
+
+    Returns
+    -------
+    dict
+        Run count, latency statistics (ms per run) and items per second
+    """
+    timings = sorted(timings)
+    repeat = len(timings)
+    total = sum(timings)
+    return {
+        "runs": repeat,
+        "items_per_run": items,
+        "mean_ms": 1000 * total / repeat,
+        "p50_ms": 1000 * statistics.median(timings),
+        "p95_ms": 1000 * timings[min(repeat - 1, int(0.95 * repeat))],
+        "min_ms": 1000 * timings[0],
+        "max_ms": 1000 * timings[-1],
+        "items_per_sec": repeat * items / total if total > 0 else None
+    }
+
+
+def load_page_data(records: int = RECORDS_PER_PAGE, prefix: str = "") -> list:
+    """Returns a results page worth of recipe dictionaries, as the scraper
+    produces them, made from the extracted fixture pages
+
+    Parameters
+    ----------
+    records : int, optional
+        Number of records, by default RECORDS_PER_PAGE
+    prefix : str, optional
+        Prefix for the item IDs, to keep them unique between runs
+
+    Returns
+    -------
+    list
+        List of recipe dictionaries
+    """
+    with open(os.path.join(FIXTURES_FOLDER, "page_data.json")) as f:
+        fixtures = json.load(f)
+    page_data = []
+    for n in range(records):
+        page_dict = copy.deepcopy(fixtures[n % len(fixtures)])
+        page_dict["item_id"] = f"{prefix}{page_dict['item_id']}-{n}"
+        page_dict["item_UUID"] = uuid.uuid4()
+        page_data.append(page_dict)
+    return page_data
+
+
+@benchmark("serialize")
+def bench_serialize(context: dict) -> dict:
+    """JSON encoding of one results page of records (Storage._encode_json)"""
+    from source.package.storage.file_storage import FileStorage
+    storage = FileStorage(context["tmp"], os.path.join(context["tmp"], "serialize"),
+        os.path.join(context["tmp"], "serialize", "images"))
+    page_data = load_page_data()
+    return measure(lambda run: storage._encode_json(page_data), context["repeat"], len(page_data))
+
+
+@benchmark("file_storage_write")
+def bench_file_storage_write(context: dict) -> dict:
+    """FileStorage.save_json_file of one results page of records"""
+    from source.package.storage.file_storage import FileStorage
+    storage = FileStorage(context["tmp"], os.path.join(context["tmp"], "plain"),
+        os.path.join(context["tmp"], "plain", "images"))
+    page_data = load_page_data()
+    return measure(
+        lambda run: storage.save_json_file(page_data, storage.data_folder, f"page-{run}"),
+        context["repeat"],
+        len(page_data))
+
+
+@benchmark("file_storage_write_manifest")
+def bench_file_storage_write_manifest(context: dict) -> dict:
+    """FileStorage.save_json_file with a manifest and sharded folders"""
+    from source.package.storage.file_storage import FileStorage
+    from source.package.storage.manifest import Manifest
+    manifest = Manifest(os.path.join(context["tmp"], "manifest.sqlite"))
+    context["cleanup"].callback(manifest.close)
+    storage = FileStorage(context["tmp"], os.path.join(context["tmp"], "sharded"),
+        os.path.join(context["tmp"], "sharded", "images"), manifest, shard_depth=2)
+    page_data = load_page_data()
+    return measure(
+        lambda run: storage.save_json_file(page_data, storage.data_folder, f"page-{run}"),
+        context["repeat"],
+        len(page_data))
+
+
+def _recipe_scraper(context: dict):
+    """Returns a RecipeScraper for the fixture server, started on first use"""
+    if "scraper" not in context:
+        try:
+            from recipe_scraper import RecipeScraper
+        except ImportError as e:
+            raise SkipBenchmark(f"Selenium is not available ({e})")
+        from package.utils import rate_limit
+        # Time the scraper, not the politeness delays
+        rate_limit.configure(enabled=False)
+        server = context["cleanup"].enter_context(FixtureServer(latency=context["latency"]))
+        try:
+            rs = RecipeScraper(website_url=server.url)
+        except Exception as e:
+            raise SkipBenchmark(f"Chrome could not be started ({e.__cause__ or e})")
+        context["cleanup"].callback(rs.quit)
+        context["scraper"] = rs
+        context["server"] = server
+    return context["scraper"]
+
+
+@benchmark("results_page")
+def bench_results_page(context: dict) -> dict:
+    """RecipeScraper.get_urls for a page of search results"""
+    rs = _recipe_scraper(context)
+    return measure(lambda run: rs.get_urls("chicken", 1 + run % 2), context["repeat"])
+
+
+@benchmark("extract")
+def bench_extract(context: dict) -> dict:
+    """RecipeScraper.get_page_data (navigation and extraction) per recipe page,
+    checked against the expected data in fixtures/page_data.json
+    """
+    rs = _recipe_scraper(context)
+    base_url = context["server"].url
+    with open(os.path.join(FIXTURES_FOLDER, "page_data.json")) as f:
+        expected = json.load(f)
+    mismatches = set()
+
+    def extract(run: int):
+        for recipe in expected:
+            page_dict = rs.get_page_data(f"{base_url}recipes/{recipe['item_id']}")
+            page_dict.pop("item_UUID", None)
+            page_dict["image_urls"] = [
+                "/" + url[len(base_url):] if url.startswith(base_url) else url
+                for url in page_dict.get("image_urls", [])]
+            if page_dict != recipe:
+                mismatches.add(recipe["item_id"])
+
+    result = measure(extract, context["repeat"], len(expected))
+    result["mismatches"] = sorted(mismatches)
+    return result
+
+
+def _db_storage(context: dict):
+    """Returns a DBStorage for --db-url, or a SQLite database in the temporary folder"""
+    try:
+        from source.package.storage.db_storage import DBStorage
+    except ImportError as e:
+        raise SkipBenchmark(f"pandas / SQLAlchemy / psycopg2 are not available ({e})")
+    db_url = context["db_url"] or f"sqlite:///{os.path.join(context['tmp'], 'bench.db')}"
+    return DBStorage(db_url)
+
+
+@benchmark("db_insert")
+def bench_db_insert(context: dict) -> dict:
+    """DBStorage.json_to_db of one results page of records, with the
+    arguments used by pipeline.store_data_db
+    """
+    db_storage = _db_storage(context)
+    run_id = uuid.uuid4().hex[:8]
+
+    def insert(run: int):
+        page_data = load_page_data(prefix=f"{run_id}-{run}-")
+        db_storage.json_to_db(
+            page_data,
+            'recipe',
+            ['item_id', 'recipe_name', 'item_UUID', 'image_urls'],
+            [
+                ('ingredients', ['item_id', 'ingredient']),
+                ('method', ['item_id', 'method_step']),
+                ('planning_info', ['item_id', 'prep_stage']),
+                ('nutritional_info', ['item_id', 'nutritional_info'])
+            ],
+            ['item_id'])
+
+    return measure(insert, context["repeat"], RECORDS_PER_PAGE)
+
+
+@benchmark("db_item_exists")
+def bench_db_item_exists(context: dict) -> dict:
+    """DBStorage.item_exists, checked once per recipe URL by the pipeline"""
+    db_storage = _db_storage(context)
+    return measure(
+        lambda run: db_storage.item_exists("recipe", "item_id", f"missing-{run}"),
+        context["repeat"])
+
+
+def import_times(module: str) -> dict:
+    """Imports a module in a fresh interpreter with `python -X importtime`
+
+    Parameters
+    ----------
+    module : str
+        The module e.g. pipeline (imported from source/)
+
+    Returns
+    -------
+    dict
+        Cumulative import time in seconds of every module imported
+
+    Raises
+    ------
+    SkipBenchmark
+        If the module cannot be imported e.g. a dependency is not installed
+    """
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=os.path.join(REPO_FOLDER, "source"), capture_output=True, text=True)
+    if process.returncode != 0:
+        raise SkipBenchmark(f"{module} cannot be imported ({process.stderr.strip().splitlines()[-1]})")
+    times = {}
+    for line in process.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, name = line[len("import time:"):].split("|")
+            if cumulative.strip().isdigit():
+                times[name.strip()] = int(cumulative) / 1e6
+    return times
+
+
+def _startup(module: str):
+    """Creates a benchmark of the time taken to import a module on startup,
+    reporting its slowest imports (as imported by that module)
+    """
+    def bench_startup(context: dict) -> dict:
+        runs = [import_times(module) for _ in range(context["repeat"])]
+        result = summarise([times[module] for times in runs])
+        slowest = sorted(runs[-1].items(), key=lambda item: item[1], reverse=True)
+        result["slowest_imports_ms"] = {
+            name: 1000 * seconds for name, seconds in slowest[1:11]}
+        return result
+    bench_startup.__doc__ = f"Time to import {module} in a new interpreter (python -X importtime)"
+    return bench_startup
+
+
+# Entry point and backend modules, so slow imports on startup are visible
+for _name, _module in [
+        ("startup_pipeline", "pipeline"),
+        ("startup_file_storage", "package.storage.file_storage"),
+        ("startup_s3_storage", "package.storage.s3_storage"),
+        ("startup_db_storage", "package.storage.db_storage")]:
+    benchmark(_name)(_startup(_module))
+del _name, _module
+
+
+def run_benchmarks(
+        names: list = None,
+        repeat: int = 20,
+        db_url: str = None,
+        latency: float = 0.0) -> dict:
+    """Runs benchmarks
+
+    Parameters
+    ----------
+    names : list, optional
+        The benchmarks to run, by default all of them
+    repeat : int, optional
+        Timed runs per benchmark, by default 20
+    db_url : str, optional
+        SQLAlchemy URL of the database to insert into, by default a temporary SQLite file
+    latency : float, optional
+        Seconds added to every fixture server response, by default 0
+
+    Returns
+    -------
+    dict
+        The run metadata, and the results (or skip reason / error) of each benchmark
+    """
+    names = list(BENCHMARKS) if names is None else names
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp, ExitStack() as cleanup:
+        context = {"tmp": tmp, "repeat": repeat, "db_url": db_url,
+            "latency": latency, "cleanup": cleanup}
+        for name in names:
+            try:
+                results[name] = BENCHMARKS[name](context)
+            except SkipBenchmark as e:
+                results[name] = {"skipped": str(e)}
+            except Exception as e:
+                results[name] = {"error": f"{type(e).__name__}: {e.__cause__ or e}"}
+    return {"metadata": _metadata(repeat, db_url, latency), "results": results}
+
+
+def _metadata(repeat: int, db_url: str, latency: float) -> dict:
+    """Describes the code version and machine the benchmarks ran on"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=REPO_FOLDER,
+            capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "time": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": repeat,
+        "database": "sqlite" if db_url is None else db_url.split("://", 1)[0],
+        "latency": latency
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float = 0.2) -> list:
+    """Compares the median latency of each benchmark with a baseline run
+
+    Parameters
+    ----------
+    results : dict
+        Results from `run_benchmarks`
+    baseline : dict
+        Earlier results from `run_benchmarks`
+    threshold : float, optional
+        Relative slow down reported as a regression, by default 0.2 (20%)
+
+    Returns
+    -------
+    list
+        One dictionary per benchmark in both runs with baseline and current
+        p50_ms, the relative change and whether it is a regression
+    """
+    rows = []
+    for name, result in results["results"].items():
+        before = baseline["results"].get(name, {})
+        if "p50_ms" not in result or "p50_ms" not in before:
+            continue
+        change = result["p50_ms"] / before["p50_ms"] - 1 if before["p50_ms"] > 0 else 0.0
+        rows.append({
+            "benchmark": name,
+            "baseline_p50_ms": before["p50_ms"],
+            "p50_ms": result["p50_ms"],
+            "change": change,
+            "regression": change > threshold
+        })
+    return rows
+
+
+def format_results(results: dict) -> str:
+    """Formats benchmark results as a text table"""
+    lines = [f"{'benchmark':<30} {'runs':>5} {'p50 ms':>9} {'p95 ms':>9} {'items/s':>10}"]
+    for name, result in results["results"].items():
+        if "p50_ms" in result:
+            lines.append(f"{name:<30} {result['runs']:>5} {result['p50_ms']:>9.2f} "
+                f"{result['p95_ms']:>9.2f} {result['items_per_sec']:>10.1f}")
+        else:
+            lines.append(f"{name:<30} {result.get('skipped') or result.get('error')}")
+    return "\n".join(lines)
+
+
+def get_args(argv: list = None):
+    parser = argparse.ArgumentParser(description="Run the offline pipeline benchmarks")
+    parser.add_argument('--output', type=str, default="benchmark_results.json",
+        help="File the JSON results are written to")
+    parser.add_argument('--only', nargs="+", choices=list(BENCHMARKS), default=None,
+        help="Benchmarks to run, by default all")
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--db-url', type=str, default=None,
+        help="SQLAlchemy URL of a Postgres database, by default a temporary SQLite file")
+    parser.add_argument('--latency', type=float, default=0.0,
+        help="Seconds added to every fixture server response")
+    parser.add_argument('--compare', type=str, default=None,
+        help="Earlier results file; exits with status 1 if any benchmark regressed")
+    parser.add_argument('--threshold', type=float, default=0.2,
+        help="Relative p50 slow down counted as a regression")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = get_args()
+    results = run_benchmarks(args.only, args.repeat, args.db_url, args.latency)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=4)
+    print(format_results(results))
+    if args.compare is not None:
+        with open(args.compare) as f:
+            rows = compare(results, json.load(f), args.threshold)
+        for row in rows:
+            print(f"{row['benchmark']:<30} {row['baseline_p50_ms']:>9.2f} -> {row['p50_ms']:>9.2f} ms "
+                f"({100 * row['change']:+.1f}%){'  REGRESSION' if row['regression'] else ''}")
+        if any(row["regression"] for row in rows):
+            sys.exit(1)
@@ -1,2 +1,2 @@
 sudo docker pull siobhand/scraper:latest
-sudo docker run -v $HOME/.aws/credentials:/root/.aws/credentials --name scraper --rm siobhand/scraper:latest --search=salmon --pages=1 
+sudo docker run -v $HOME/.aws/credentials:/root/.aws/credentials -p 8000:8000 --name scraper --rm siobhand/scraper:latest --search=salmon --pages=1 
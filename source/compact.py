@@ -0,0 +1,83 @@
+from package.storage.compaction import Compactor
+from package.storage.manifest import Manifest
+import logging
+from package.utils.log_setup import configure_logging
+import os
+import argparse
+
+def get_storage(args: argparse.Namespace, manifest: Manifest):
+    """Initialises the storage holding the raw data for a search
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        The command line arguments
+    manifest : Manifest
+        The manifest indexing the stored records
+
+    Returns
+    -------
+    Storage
+        A FileStorage or S3Storage instance
+    """
+    if args.backend == "aws":
+        from package.storage.s3_storage import S3Storage
+        return S3Storage(
+            os.getenv("AWS_ACCESS_KEY_ID"),
+            os.getenv("AWS_SECRET_ACCESS_KEY"),
+            os.getenv("AWS_REGION"),
+            "raw-data",
+            args.search,
+            "images",
+            manifest,
+            os.getenv("S3_BUCKET"))
+    else:
+        from package.storage.file_storage import FileStorage
+        root_folder = "./raw_data"
+        return FileStorage(
+            root_folder,
+            f"{root_folder}/{args.search}",
+            f"{root_folder}/{args.search}/images",
+            manifest,
+            shard_depth=args.shard_depth)
+
+def get_args():
+    # Get the parameters for running the compaction
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--backend', choices=['local', 'aws'], default='local')
+    parser.add_argument('--search', type=str, default="chicken")
+    parser.add_argument('--manifest', type=str, default=None)
+    parser.add_argument('--journal', type=str, default=None)
+    parser.add_argument('--records-per-file', type=int, default=10000)
+    parser.add_argument('--shard-depth', type=int, default=0,
+        help="Levels of hash prefix directories the local files were saved under")
+    args = parser.parse_args()
+    if args.shard_depth != 0 and args.backend != "local":
+        parser.error("--shard-depth can only be used with --backend local")
+    return args
+
+# Merges the small json files saved for a search into large
+# compressed files. Re-running with the same journal resumes
+# an interrupted compaction
+if __name__ == "__main__":
+    configure_logging('./compact.log')
+    logger = logging.getLogger('compact')
+
+    args = get_args()
+    args.search = args.search.replace(' ', '_')
+    if args.manifest is None:
+        args.manifest = "./raw_data/manifest.sqlite" if args.backend == "local" else "./manifest.sqlite"
+    journal = args.journal or f"./compact-{args.search}.sqlite"
+
+    storage = get_storage(args, Manifest(args.manifest))
+    logger.info(f"Compacting files for search: {args.search}")
+    try:
+        summary = Compactor(
+            storage,
+            storage.data_folder,
+            journal,
+            records_per_file=args.records_per_file).run()
+        logger.info(f"Compacted {summary['sources']} files into {summary['files']} ({summary['records']} records)")
+        os.remove(journal)
+    except RuntimeError as e:
+       logger.exception(f"Exception raised in {__name__}. exception: {str(e)}")
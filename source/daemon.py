@@ -0,0 +1,460 @@
+"""
+Runs the pipeline as a long lived daemon, so a crawl does not pay for
+starting Chrome, dismissing the cookie popup, creating the S3 client and
+resolving the bucket, and connecting to the database before it can load
+its first page. The daemon keeps a pool of started RecipeScrapers (one
+worker thread each), the file storage of each search and one DBStorage
+(a pooled SQLAlchemy engine), and accepts crawl jobs over a local HTTP
+API, on a TCP port or a Unix socket:
+
+    POST /jobs        {"search": "chicken", "pages": 1, "incremental": false,
+                       "resume": false}, returns the job (202)
+    GET  /jobs        the jobs, newest first
+    GET  /jobs/<id>   a job: state (queued, running, done or failed),
+                      recipes scraped, error and times
+    GET  /status      the pool and queue
+"""
+
+from __future__ import annotations
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import os
+import queue
+import signal
+import socketserver
+from collections import deque
+import threading
+import time
+from typing import TYPE_CHECKING, Callable
+import uuid
+from package.utils.logger import log
+from package.utils import metrics
+
+if TYPE_CHECKING:
+    from package.storage.db_storage import DBStorage
+    from package.storage.dead_letter import DeadLetters
+    from package.storage.frontier import Frontier
+
+logger = logging.getLogger("daemon")
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class Job:
+    """
+    A crawl submitted to the daemon
+
+    Attributes
+    ----------
+    id : str
+        The job ID
+    search : str
+        The search words
+    pages : int
+        Results pages to scrape (0 for every page)
+    incremental : bool
+        Only crawl the recipes added since the last incremental crawl
+    resume : bool
+        Continue the crawl recorded in the frontier
+    state : str
+        QUEUED, RUNNING, DONE or FAILED
+    items : int
+        Recipes scraped and saved, once done
+    error : str
+        Why the job failed
+    """
+
+    def __init__(self, search: str, pages: int, incremental: bool = False, resume: bool = False):
+        self.id = uuid.uuid4().hex[:12]
+        self.search = search
+        self.pages = pages
+        self.incremental = incremental
+        self.resume = resume
+        self.state = QUEUED
+        self.items = None
+        self.error = None
+        self.submitted_time = time.time()
+        self.started_time = None
+        self.finished_time = None
+
+    def as_dict(self) -> dict:
+        """Returns the job as a dictionary for the API"""
+        return dict(vars(self))
+
+
+class Daemon:
+    """
+    A pool of warm scrapers running crawl jobs from a queue. Jobs for
+    the same search run one after another (they share its frontier
+    records), on the scraper which ran the first
+
+    Attributes
+    ----------
+    scrapers : int
+        Size of the scraper pool (jobs run at once)
+    """
+
+    def __init__(self,
+            file_store_factory: Callable,
+            db_storage: DBStorage,
+            scrapers: int = 1,
+            website_url: str = None,
+            session_limits: dict = None,
+            frontier: Frontier = None,
+            dead_letters: DeadLetters = None,
+            max_jobs: int = 1000):
+        """
+        Parameters
+        ----------
+        file_store_factory : Callable
+            Returns the Storage for a search (called once per search)
+        db_storage : DBStorage
+            Shared by the jobs
+        scrapers : int, optional
+            Size of the scraper pool, by default 1
+        website_url : str, optional
+            Scrape a copy of the site at another address e.g. a local mock, by default the real site
+        session_limits : dict, optional
+            The scrapers' browser session limits (see RecipeScraper), by default None
+        frontier : Frontier, optional
+            Records the pages and items of each job, so `resume` jobs
+            can continue a crawl, by default None
+        dead_letters : DeadLetters, optional
+            Records the recipes given up on, by default None
+        max_jobs : int, optional
+            Finished jobs kept for the API, by default 1000
+        """
+        if scrapers < 1:
+            raise ValueError(f"scrapers must be at least 1, not {scrapers}")
+        self.scrapers = scrapers
+        self.__file_store_factory = file_store_factory
+        self.__db_storage = db_storage
+        self.__website_url = website_url
+        self.__session_limits = session_limits
+        self.__frontier = frontier
+        self.__dead_letters = dead_letters
+        self.__max_jobs = max_jobs
+        self.__file_stores = {}
+        # Jobs by ID, oldest first
+        self.__jobs = {}
+        self.__lock = threading.Lock()
+        self.__queue = queue.Queue()
+        # Searches with a running job, and the jobs waiting for them
+        self.__waiting = {}
+        self.__threads = []
+        self.__idle = 0
+        self.__started_time = None
+
+    @log(my_logger=logger)
+    def start(self):
+        """Starts the scrapers (each with its own browser) and their worker threads"""
+        # Imported here so the API module loads without Selenium
+        from recipe_scraper import RecipeScraper
+        start = time.perf_counter()
+        try:
+            for n in range(self.scrapers):
+                rs = RecipeScraper(website_url=self.__website_url, session_limits=self.__session_limits)
+                thread = threading.Thread(target=self.__work, args=(rs,), name=f"daemon-scraper-{n}",
+                    daemon=True)
+                self.__threads.append(thread)
+                thread.start()
+        except BaseException:
+            # Quit the scrapers already started, rather than leave their browsers running
+            self.stop()
+            raise
+        self.__started_time = time.time()
+        logger.info(f"Started {self.scrapers} scrapers", extra={"stage": "init",
+            "duration": time.perf_counter() - start})
+
+    def submit(self,
+            search: str,
+            pages: int = 1,
+            incremental: bool = False,
+            resume: bool = False) -> dict:
+        """Queues a crawl
+
+        Parameters
+        ----------
+        search : str
+            The search words
+        pages : int, optional
+            Results pages to scrape (0 for every page), by default 1
+        incremental : bool, optional
+            Only crawl the recipes added since the last incremental crawl, by default False
+        resume : bool, optional
+            Continue the crawl recorded in the frontier, by default False
+
+        Returns
+        -------
+        dict
+            The job
+        """
+        if not isinstance(search, str) or search.strip() == "":
+            raise ValueError("search must be a non-empty string")
+        if not isinstance(pages, int) or isinstance(pages, bool) or pages < 0:
+            raise ValueError("pages must be 0 (every page) or more")
+        if resume and self.__frontier is None:
+            raise ValueError("resume needs the daemon to record a frontier")
+        job = Job(search.strip().replace(' ', '_'), pages, bool(incremental), bool(resume))
+        with self.__lock:
+            self.__jobs[job.id] = job
+            self.__forget_old_jobs()
+        self.__queue.put(job)
+        self.__count_queued()
+        logger.info(f"Queued job {job.id} for search {job.search}",
+            extra={"stage": "daemon", "search": job.search})
+        return job.as_dict()
+
+    def job(self, job_id: str) -> dict:
+        """Returns a job, or None if it is not known
+
+        Parameters
+        ----------
+        job_id : str
+            The job ID
+
+        Returns
+        -------
+        dict
+            The job
+        """
+        with self.__lock:
+            job = self.__jobs.get(job_id)
+            return None if job is None else job.as_dict()
+
+    def jobs(self) -> list[dict]:
+        """Returns the jobs, newest first"""
+        with self.__lock:
+            return [job.as_dict() for job in reversed(self.__jobs.values())]
+
+    def status(self) -> dict:
+        """Returns the size of the pool and queue"""
+        with self.__lock:
+            states = [job.state for job in self.__jobs.values()]
+            idle = self.__idle
+        return {
+            "scrapers": self.scrapers,
+            "idle_scrapers": idle,
+            "queued": states.count(QUEUED),
+            "running": states.count(RUNNING),
+            "done": states.count(DONE),
+            "failed": states.count(FAILED),
+            "uptime_seconds": None if self.__started_time is None else time.time() - self.__started_time
+        }
+
+    def stop(self, timeout: float = None):
+        """Stops the worker threads once the queued jobs are done,
+        and quits the scrapers
+
+        Parameters
+        ----------
+        timeout : float, optional
+            Seconds to wait for each worker, by default until it finishes
+        """
+        for _ in self.__threads:
+            self.__queue.put(None)
+        for thread in self.__threads:
+            thread.join(timeout)
+        self.__threads = []
+
+    def __work(self, rs):
+        """Runs jobs from the queue with one scraper until stopped
+
+        Parameters
+        ----------
+        rs : RecipeScraper
+            This worker's scraper
+        """
+        try:
+            while True:
+                with self.__lock:
+                    self.__idle += 1
+                job = self.__queue.get()
+                with self.__lock:
+                    self.__idle -= 1
+                    if job is not None and job.search in self.__waiting:
+                        # Run by the worker running this search, once it is done
+                        self.__waiting[job.search].append(job)
+                        job = False
+                    elif job is not None:
+                        self.__waiting[job.search] = deque()
+                if job is None:
+                    break
+                self.__count_queued()
+                while job:
+                    self.__run(rs, job)
+                    with self.__lock:
+                        waiting = self.__waiting[job.search]
+                        if len(waiting) > 0:
+                            job = waiting.popleft()
+                        else:
+                            del self.__waiting[job.search]
+                            job = None
+                    self.__count_queued()
+        finally:
+            rs.quit()
+
+    def __run(self, rs, job: Job):
+        """Runs a job
+
+        Parameters
+        ----------
+        rs : RecipeScraper
+            The scraper
+        job : Job
+            The job
+        """
+        import pipeline
+        with self.__lock:
+            job.state = RUNNING
+            job.started_time = time.time()
+        try:
+            items = pipeline.run_pipeline(
+                job.search,
+                job.pages,
+                self.__file_store(job.search),
+                self.__db_storage,
+                frontier=self.__frontier,
+                resume=job.resume,
+                incremental=job.incremental,
+                dead_letters=self.__dead_letters,
+                rs=rs)
+        except Exception as e:
+            with self.__lock:
+                job.error = f"{type(e.__cause__ or e).__name__}: {e.__cause__ or e}"
+                job.state = FAILED
+                job.finished_time = time.time()
+        else:
+            with self.__lock:
+                job.items = items
+                job.state = DONE
+                job.finished_time = time.time()
+        metrics.DAEMON_JOBS.labels(job.state).inc()
+        logger.info(f"Job {job.id} {job.state} after {job.finished_time - job.started_time:.1f}s",
+            extra={"stage": "daemon", "search": job.search,
+                "duration": job.finished_time - job.started_time})
+
+    def __count_queued(self):
+        """Updates the queued jobs metric"""
+        with self.__lock:
+            waiting = sum(len(jobs) for jobs in self.__waiting.values())
+        metrics.DAEMON_QUEUED.set(self.__queue.qsize() + waiting)
+
+    def __file_store(self, search: str):
+        """Returns the file storage of a search, kept for later jobs
+        so its bucket is only resolved once"""
+        with self.__lock:
+            if search not in self.__file_stores:
+                self.__file_stores[search] = self.__file_store_factory(search)
+            return self.__file_stores[search]
+
+    def __forget_old_jobs(self):
+        """Drops the oldest finished jobs beyond `max_jobs`"""
+        finished = [job_id for job_id, job in self.__jobs.items() if job.state in (DONE, FAILED)]
+        for job_id in finished[:max(0, len(finished) - self.__max_jobs)]:
+            del self.__jobs[job_id]
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """HTTP server on a Unix socket"""
+    daemon_threads = True
+
+
+def _handler(daemon: Daemon) -> type:
+    """Returns a request handler class for the daemon's API"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            path = self.path.split('?', 1)[0].rstrip('/')
+            if path == "/status":
+                self.__reply(200, daemon.status())
+            elif path == "/jobs":
+                self.__reply(200, daemon.jobs())
+            elif path.startswith("/jobs/"):
+                job = daemon.job(path.rsplit('/', 1)[-1])
+                if job is None:
+                    self.__reply(404, {"error": "No such job"})
+                else:
+                    self.__reply(200, job)
+            else:
+                self.__reply(404, {"error": "Not found"})
+
+        def do_POST(self):
+            if self.path.split('?', 1)[0].rstrip('/') != "/jobs":
+                self.__reply(404, {"error": "Not found"})
+                return
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                job = daemon.submit(
+                    body.get("search"),
+                    body.get("pages", 1),
+                    body.get("incremental", False),
+                    body.get("resume", False))
+            except (ValueError, AttributeError) as e:
+                self.__reply(400, {"error": str(e)})
+                return
+            self.__reply(202, job)
+
+        def __reply(self, status: int, body):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    return Handler
+
+
+def serve(daemon: Daemon, port: int = None, socket_path: str = None, host: str = "127.0.0.1"):
+    """Starts the daemon and serves its API until interrupted (or sent
+    SIGTERM), then stops the daemon once its queued jobs are done
+
+    Parameters
+    ----------
+    daemon : Daemon
+        The daemon
+    port : int, optional
+        TCP port to listen on (on `host`), by default None
+    socket_path : str, optional
+        Unix socket to listen on instead of a port, by default None
+    host : str, optional
+        Address to listen on with `port`, by default 127.0.0.1
+    """
+    if (port is None) == (socket_path is None):
+        raise ValueError("Give either a port or a socket path")
+    daemon.start()
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            # Left by a daemon which did not shut down
+            os.remove(socket_path)
+        server = _UnixHTTPServer(socket_path, _handler(daemon))
+        address = socket_path
+    else:
+        server = ThreadingHTTPServer((host, port), _handler(daemon))
+        server.daemon_threads = True
+        address = f"http://{host}:{server.server_port}"
+    logger.info(f"Daemon listening on {address}", extra={"stage": "init"})
+    if threading.current_thread() is threading.main_thread():
+        # docker stop: stop serving (from another thread, as
+        # shutdown waits for serve_forever to return)
+        signal.signal(signal.SIGTERM,
+            lambda signum, frame: threading.Thread(target=server.shutdown).start())
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Daemon stopping", extra={"stage": "shutdown"})
+    finally:
+        server.server_close()
+        if socket_path is not None and os.path.exists(socket_path):
+            os.remove(socket_path)
+        daemon.stop()
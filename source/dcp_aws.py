@@ -1,10 +1,26 @@
-from package.storage.s3_storage import S3Storage
+from package.storage.s3_storage import S3Storage, get_s3_client
 from package.storage.db_storage import DBStorage
+from package.storage.manifest import Manifest
+from package.storage.frontier import Frontier
+from package.storage.dead_letter import DeadLetters
+from package.storage.job_queue import JobQueue
 import configparser
 import logging
+from package.utils.log_setup import configure_logging
+from package.utils import http_archive
+from package.utils import metrics
+from package.utils import page_cache
+from package.utils import profiling
+from package.utils import rate_limit
+from package.utils import retry
+from package.utils import tracing
 import pipeline
+import parallel_pipeline
+import distributed_pipeline
+import daemon
 import os
 import argparse
+import functools
 
 def get_db_conn() -> str:
     """Initialises the DBStorage object using settings in config.ini
@@ -24,30 +40,191 @@ def get_db_conn() -> str:
     DATABASE = config.get('RDSStorage', 'database')
     return f"{DATABASE_TYPE}+{DBAPI}://{USER}:{PASSWORD}@{ENDPOINT}:{PORT}/{DATABASE}"
 
+@functools.lru_cache(maxsize=None)
+def get_manifest() -> Manifest:
+    """Opens the local manifest shared by the storage of every search
+
+    Returns
+    -------
+    Manifest
+        The Manifest instance
+    """
+    return Manifest("./manifest.sqlite")
+
+@functools.lru_cache(maxsize=None)
+def get_file_store(search: str) -> S3Storage:
+    """Initialises the S3Storage object for a search using the AWS
+    settings in the environment (module level so worker processes can create one).
+    The storage of a search is created once, and shares the manifest
+    with the other searches, so the bucket's manifest is fetched once
+
+    Parameters
+    ----------
+    search : str
+        The search, used as the S3 folder
+
+    Returns
+    -------
+    S3Storage
+        An S3Storage instance
+    """
+    return S3Storage(
+        os.getenv("AWS_ACCESS_KEY_ID"),
+        os.getenv("AWS_SECRET_ACCESS_KEY"),
+        os.getenv("AWS_REGION"),
+        "raw-data",
+        search,
+        "images",
+        get_manifest(),
+        os.getenv("S3_BUCKET"))
+
+def get_search_terms(args) -> list:
+    """Returns the searches to run: those given with --searches and in the
+    --search-file (ignoring blank lines and # comments), or else --search
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        The command line arguments
+
+    Returns
+    -------
+    list
+        The search terms
+    """
+    search_terms = list(args.searches or [])
+    if args.search_file is not None:
+        with open(args.search_file) as f:
+            search_terms += [line.strip() for line in f
+                if line.strip() and not line.strip().startswith("#")]
+    return search_terms or [args.search]
+
 def get_args():
     # Get the parameters for running the scraper
     parser = argparse.ArgumentParser()
     parser.add_argument('--search', type=str, default="chicken")
+    parser.add_argument('--searches', type=str, nargs="+", default=None,
+        help="Run several searches in one batch, loading each recipe only once")
+    parser.add_argument('--search-file', type=str, default=None,
+        help="Run the searches listed (one per line) in this file in one batch")
     parser.add_argument('--pages', type=int, default=1)
-    return parser.parse_args()
+    parser.add_argument('--metrics-port', type=int, default=8000)
+    parser.add_argument('--profile-locators', action='store_true')
+    parser.add_argument('--workers', type=int, default=1,
+        help="Worker processes (each with its own browser) to split the results pages between")
+    parser.add_argument('--frontier', type=str, default=None,
+        help="SQLite file recording the pages and items processed, so the run can be resumed")
+    parser.add_argument('--resume', action='store_true',
+        help="Continue the last run for the search from the frontier, retrying failed items")
+    parser.add_argument('--incremental', action='store_true',
+        help="Only scrape recipes added since the last incremental run (results listed newest first)")
+    parser.add_argument('--rate', type=float, default=2.0,
+        help="Requests per second to the site to start at (adapted to its response times)")
+    parser.add_argument('--max-rate', type=float, default=10.0,
+        help="Most requests per second to the site")
+    parser.add_argument('--max-concurrency', type=int, default=None,
+        help="Most requests in flight to the site from the daemon's scrapers, by default 8")
+    parser.add_argument('--retries', type=int, default=2,
+        help="Retries of a page load, file or database call after a transient error")
+    parser.add_argument('--dead-letters', type=str, default=None,
+        help="SQLite file recording the recipes which could not be scraped or stored")
+    parser.add_argument('--daemon', action='store_true',
+        help="Keep warm scrapers and storage running and take crawl jobs over a local HTTP API")
+    parser.add_argument('--listen-host', type=str, default="127.0.0.1",
+        help="Address the daemon's API listens on with --listen-port e.g. 0.0.0.0 in a container")
+    daemon_address = parser.add_mutually_exclusive_group()
+    daemon_address.add_argument('--listen-port', type=int, default=8080,
+        help="Port for the daemon's API (on --listen-host)")
+    daemon_address.add_argument('--socket', type=str, default=None,
+        help="Unix socket for the daemon's API instead of a port")
+    parser.add_argument('--scrapers', type=int, default=1,
+        help="Scrapers (browsers) kept warm by the daemon, i.e. jobs run at once")
+    parser.add_argument('--queue', action='store_true',
+        help="Run as a worker sharing the search with other containers through a job queue in the database")
+    parser.add_argument('--queue-db', type=str, default=None,
+        help="SQLAlchemy URL of the job queue database, by default the RDS database")
+    parser.add_argument('--batch-size', type=int, default=10,
+        help="Jobs claimed from the queue at a time")
+    parser.add_argument('--lease-seconds', type=float, default=300,
+        help="Seconds a claimed job is held before another worker can claim it")
+    parser.add_argument('--reset-queue', action='store_true',
+        help="Remove the jobs of the search first, abandoning a run in progress to crawl it again from the start")
+    parser.add_argument('--trace', type=str, default=None,
+        help="Write a Chrome trace event file of the run (open in Perfetto / chrome://tracing)")
+    parser.add_argument('--profile', type=str, default=None,
+        help="Write CPU (pstats, collapsed stacks) and memory profiles of the run to this folder")
+    parser.add_argument('--profile-every', type=int, default=10,
+        help="Results pages between memory snapshots when profiling")
+    archive = parser.add_mutually_exclusive_group()
+    archive.add_argument('--record', type=str, default=None,
+        help="Record the pages and images fetched to this HTTP archive file")
+    archive.add_argument('--replay', type=str, default=None,
+        help="Serve the pages and images from this HTTP archive file instead of the web site")
+    parser.add_argument('--replay-latency', type=float, default=0.0,
+        help="Seconds added to every replayed response")
+    parser.add_argument('--page-cache', type=str, default=None,
+        help="Cache the results and recipe pages loaded in this file, and replay them when cached")
+    parser.add_argument('--cache-ttl', type=float, default=86400.0,
+        help="Seconds a cached page is replayed for")
+    parser.add_argument('--cache-max-mb', type=float, default=512.0,
+        help="Most MB of (compressed) pages cached, the least recently used are evicted")
+    parser.add_argument('--offline', action='store_true',
+        help="Only replay pages from the page cache, loading nothing from the web site")
+    args = parser.parse_args()
+    if args.offline and args.page_cache is None:
+        parser.error("--offline needs a --page-cache")
+    if args.max_concurrency is not None and not args.daemon:
+        # Only the daemon's scrapers make requests at the same time
+        parser.error("--max-concurrency needs --daemon, the pipeline makes one request at a time")
+    if args.resume and args.frontier is None:
+        parser.error("--resume needs the --frontier of the run to continue")
+    batch = args.searches is not None or args.search_file is not None
+    modes = {
+        "--daemon": args.daemon,
+        "--searches/--search-file": batch,
+        "--queue": args.queue,
+        "--workers": args.workers > 1}
+    given = [mode for mode, used in modes.items() if used]
+    if len(given) > 1:
+        parser.error(f"{' and '.join(given)} cannot be used together")
+    # Options a mode would otherwise ignore
+    unsupported = {
+        "--daemon": {
+            "--incremental": args.incremental,
+            "--resume": args.resume,
+            "--profile-locators": args.profile_locators},
+        "--queue": {
+            "--incremental": args.incremental,
+            "--frontier": args.frontier is not None,
+            "--resume": args.resume,
+            "--profile-locators": args.profile_locators},
+        "--workers": {
+            "--incremental": args.incremental,
+            "--profile-locators": args.profile_locators,
+            "--trace": args.trace is not None,
+            "--profile": args.profile is not None,
+            "--record/--replay": args.record is not None or args.replay is not None}}
+    for mode in given:
+        for option, used in unsupported.get(mode, {}).items():
+            if used:
+                parser.error(f"{option} cannot be used with {mode}")
+    return args
 
 # Runs the pipeline to AWS i.e. files saved to S3
 # and data uploaded to an RDS database
 if __name__ == "__main__":
     # Get the data, store it on S3, upload to RDS
     # Setup log files
-    logging.basicConfig(filename='./dcp_aws.log', level=logging.INFO, format='%(name)s: %(asctime)s - %(message)s', filemode="w")
+    # Records are queued and written (as JSON lines) by a background thread
+    configure_logging('./dcp_aws.log')
     logger = logging.getLogger('dcp_aws')
     logger.info('Initialising pipeline')
     
     args = get_args()
 
-    search_term = args.search
-    search = search_term.replace(' ', '_')
-    if args.pages is None:
-        num_pages = 0
-    else:
-        num_pages = args.pages
+    search_terms = get_search_terms(args)
+    search = search_terms[0].replace(' ', '_')
+    num_pages = args.pages
 
     # Get the aws settings from config file
     config = configparser.ConfigParser()
@@ -56,21 +233,91 @@ if __name__ == "__main__":
     # aws_access_key = config.get('S3Storage', 'accesskeyid')
     # aws_secret_key = config.get('S3Storage', 'secretaccesskey') 
     # aws_region = config.get('S3Storage', 'region') 
-    aws_access_key = os.getenv("AWS_ACCESS_KEY_ID")
-    aws_secret_key = os.getenv("AWS_SECRET_ACCESS_KEY")
-    aws_region = os.getenv("AWS_REGION")
-    logger.info(f"Running pipeline for search: {search}")
+    if args.trace is not None:
+        tracing.enable_tracing(args.trace)
+    if args.profile is not None:
+        profiling.enable_profiling(args.profile, args.profile_every)
+    if args.record is not None:
+        http_archive.activate(args.record, http_archive.RECORD)
+    elif args.replay is not None:
+        http_archive.activate(args.replay, http_archive.REPLAY, args.replay_latency)
+    if args.page_cache is not None:
+        page_cache.activate(args.page_cache, args.cache_ttl, args.cache_max_mb, args.offline)
+    rate_limit.configure(
+        rate=args.rate,
+        max_rate=args.max_rate,
+        min_rate=min(args.rate, rate_limit.settings()["min_rate"]),
+        max_concurrency=args.max_concurrency or rate_limit.settings()["max_concurrency"])
+    retry.configure(attempts=args.retries + 1)
+    dead_letters_path = args.dead_letters or "./dead_letters.sqlite"
+    logger.info(f"Running pipeline for search: {', '.join(search_terms)}")
     try:
-        pipeline.run_pipeline(
-            search, 
-            num_pages,
-            S3Storage(
-                aws_access_key,
-                aws_secret_key,
-                aws_region,
-                "raw-data",
+        if args.daemon:
+            if args.metrics_port is not None:
+                metrics.start_metrics_server(args.metrics_port)
+            # Create the S3 client now rather than in the first job
+            get_s3_client()
+            daemon.serve(
+                daemon.Daemon(
+                    get_file_store,
+                    DBStorage(get_db_conn()),
+                    scrapers=args.scrapers,
+                    frontier=None if args.frontier is None else Frontier(args.frontier),
+                    dead_letters=DeadLetters(dead_letters_path)),
+                port=None if args.socket is not None else args.listen_port,
+                socket_path=args.socket,
+                host=args.listen_host)
+        elif args.searches is not None or args.search_file is not None:
+            # A batch of one search still runs as a batch
+            pipeline.run_batch_pipeline(
+                [term.replace(' ', '_') for term in search_terms],
+                num_pages,
+                get_file_store,
+                DBStorage(get_db_conn()),
+                metrics_port=args.metrics_port,
+                profile_locators=args.profile_locators,
+                frontier=None if args.frontier is None else Frontier(args.frontier),
+                resume=args.resume,
+                incremental=args.incremental,
+                dead_letters=DeadLetters(dead_letters_path))
+        elif args.queue:
+            job_queue = JobQueue(args.queue_db or get_db_conn(), lease_seconds=args.lease_seconds)
+            if args.reset_queue:
+                job_queue.reset(search)
+            distributed_pipeline.run_queue_worker(
+                search,
+                num_pages,
+                get_file_store(search),
+                DBStorage(get_db_conn()),
+                job_queue,
+                batch_size=args.batch_size,
+                metrics_port=args.metrics_port)
+        elif args.workers > 1:
+            parallel_pipeline.run_parallel_pipeline(
                 search,
-                "images"), 
-            DBStorage(get_db_conn()))
+                num_pages,
+                functools.partial(get_file_store, search),
+                functools.partial(DBStorage, get_db_conn()),
+                workers=args.workers,
+                metrics_port=args.metrics_port,
+                frontier_factory=None if args.frontier is None else functools.partial(Frontier, args.frontier),
+                resume=args.resume,
+                dead_letters_factory=functools.partial(DeadLetters, dead_letters_path))
+        else:
+            pipeline.run_pipeline(
+                search, 
+                num_pages,
+                get_file_store(search), 
+                DBStorage(get_db_conn()),
+                metrics_port=args.metrics_port,
+                profile_locators=args.profile_locators,
+                frontier=None if args.frontier is None else Frontier(args.frontier),
+                resume=args.resume,
+                incremental=args.incremental,
+                dead_letters=DeadLetters(dead_letters_path))
     except RuntimeError as e:
-       logger.exception(f"Exception raised in {__name__}. exception: {str(e)}")
\ No newline at end of file
+       logger.exception(f"Exception raised in {__name__}. exception: {str(e)}")
+    finally:
+        profiling.disable_profiling()
+        http_archive.deactivate()
+        page_cache.deactivate()
\ No newline at end of file
@@ -1,9 +1,22 @@
 from package.storage.file_storage import FileStorage
+from package.storage.manifest import Manifest
+from package.storage.frontier import Frontier
+from package.storage.dead_letter import DeadLetters
 import pipeline
+import parallel_pipeline
+import daemon
+import argparse
 import configparser
 import os
-from source.package.storage.db_storage import DBStorage
+import functools
+from package.storage.db_storage import DBStorage
 import logging
+from package.utils.log_setup import configure_logging
+from package.utils import http_archive
+from package.utils import page_cache
+from package.utils import profiling
+from package.utils import rate_limit
+from package.utils import retry
 
 def get_db_conn() -> str:
     """Initialises the DBStorage object using settings in config.ini
@@ -26,24 +39,171 @@ def get_db_conn() -> str:
     PORT = config.get('DBStorage', 'port')
     return f"{DATABASE_TYPE}+{DBAPI}://{USER}:{PASSWORD}@{HOST}:{PORT}/{DATABASE}"
 
+def get_file_store(root_folder: str, search: str) -> FileStorage:
+    """Initialises the FileStorage object for a search
+    (module level so worker processes can create one)
+
+    Parameters
+    ----------
+    root_folder : str
+        The folder holding the data for every search
+    search : str
+        The search, used as the data folder
+
+    Returns
+    -------
+    FileStorage
+        A FileStorage instance
+    """
+    data_folder = f"{root_folder}/{search}"
+    images_folder = f"{root_folder}/{search}/images"
+    return FileStorage(
+        root_folder,
+        data_folder,
+        images_folder,
+        Manifest(f"{root_folder}/manifest.sqlite"))
+
+def get_args():
+    # Get the parameters for running / profiling / recording the pipeline
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--search', type=str, default="pear")
+    parser.add_argument('--pages', type=int, default=1)
+    parser.add_argument('--workers', type=int, default=1,
+        help="Worker processes (each with its own browser) to split the results pages between")
+    parser.add_argument('--frontier', type=str, default=None,
+        help="SQLite file recording the pages and items processed, so the run can be resumed")
+    parser.add_argument('--resume', action='store_true',
+        help="Continue the last run for the search from the frontier, retrying failed items")
+    parser.add_argument('--incremental', action='store_true',
+        help="Only scrape recipes added since the last incremental run (results listed newest first)")
+    parser.add_argument('--rate', type=float, default=2.0,
+        help="Requests per second to the site to start at (adapted to its response times)")
+    parser.add_argument('--max-rate', type=float, default=10.0,
+        help="Most requests per second to the site")
+    parser.add_argument('--max-concurrency', type=int, default=None,
+        help="Most requests in flight to the site from the daemon's scrapers, by default 8")
+    parser.add_argument('--retries', type=int, default=2,
+        help="Retries of a page load, file or database call after a transient error")
+    parser.add_argument('--dead-letters', type=str, default=None,
+        help="SQLite file recording the recipes which could not be scraped or stored")
+    parser.add_argument('--daemon', action='store_true',
+        help="Keep warm scrapers and storage running and take crawl jobs over a local HTTP API")
+    parser.add_argument('--listen-host', type=str, default="127.0.0.1",
+        help="Address the daemon's API listens on with --listen-port e.g. 0.0.0.0 in a container")
+    daemon_address = parser.add_mutually_exclusive_group()
+    daemon_address.add_argument('--listen-port', type=int, default=8080,
+        help="Port for the daemon's API (on --listen-host)")
+    daemon_address.add_argument('--socket', type=str, default=None,
+        help="Unix socket for the daemon's API instead of a port")
+    parser.add_argument('--scrapers', type=int, default=1,
+        help="Scrapers (browsers) kept warm by the daemon, i.e. jobs run at once")
+    parser.add_argument('--profile', type=str, default=None,
+        help="Write CPU (pstats, collapsed stacks) and memory profiles of the run to this folder")
+    parser.add_argument('--profile-every', type=int, default=10,
+        help="Results pages between memory snapshots when profiling")
+    archive = parser.add_mutually_exclusive_group()
+    archive.add_argument('--record', type=str, default=None,
+        help="Record the pages and images fetched to this HTTP archive file")
+    archive.add_argument('--replay', type=str, default=None,
+        help="Serve the pages and images from this HTTP archive file instead of the web site")
+    parser.add_argument('--replay-latency', type=float, default=0.0,
+        help="Seconds added to every replayed response")
+    parser.add_argument('--page-cache', type=str, default=None,
+        help="Cache the results and recipe pages loaded in this file, and replay them when cached")
+    parser.add_argument('--cache-ttl', type=float, default=86400.0,
+        help="Seconds a cached page is replayed for")
+    parser.add_argument('--cache-max-mb', type=float, default=512.0,
+        help="Most MB of (compressed) pages cached, the least recently used are evicted")
+    parser.add_argument('--offline', action='store_true',
+        help="Only replay pages from the page cache, loading nothing from the web site")
+    args = parser.parse_args()
+    if args.offline and args.page_cache is None:
+        parser.error("--offline needs a --page-cache")
+    if args.max_concurrency is not None and not args.daemon:
+        # Only the daemon's scrapers make requests at the same time
+        parser.error("--max-concurrency needs --daemon, the pipeline makes one request at a time")
+    if args.resume and args.frontier is None:
+        parser.error("--resume needs the --frontier of the run to continue")
+    if args.daemon and args.workers > 1:
+        parser.error("--daemon and --workers cannot be used together")
+    # Options a mode would otherwise ignore
+    unsupported = {
+        "--daemon": {
+            "--incremental": args.incremental,
+            "--resume": args.resume},
+        "--workers": {
+            "--incremental": args.incremental,
+            "--profile": args.profile is not None,
+            "--record/--replay": args.record is not None or args.replay is not None}}
+    for mode, used in [("--daemon", args.daemon), ("--workers", args.workers > 1)]:
+        for option, given in unsupported[mode].items():
+            if used and given:
+                parser.error(f"{option} cannot be used with {mode}")
+    return args
+
 # Runs the pipeliee locally i.e. files saved locally
 # and data uploaded to a local DB
 if __name__ == "__main__":
     # Setup log files
-    logging.basicConfig(filename='./dcp_local.log', level=logging.INFO, format='%(name)s: %(asctime)s - %(message)s', filemode="w")
+    # Records are queued and written (as JSON lines) by a background thread
+    configure_logging('./dcp_local.log')
     logger = logging.getLogger('dcp_local')
     logger.info('Initialising pipeline')
-    search_term = "pear"
-    search = search_term.replace(' ', '_')
+    args = get_args()
+    search = args.search.replace(' ', '_')
+    num_pages = args.pages
     root_folder = "./raw_data"
-    data_folder = f"{root_folder}/{search}"
-    images_folder = f"{root_folder}/{search}/images"
+    if args.profile is not None:
+        profiling.enable_profiling(args.profile, args.profile_every)
+    if args.record is not None:
+        http_archive.activate(args.record, http_archive.RECORD)
+    elif args.replay is not None:
+        http_archive.activate(args.replay, http_archive.REPLAY, args.replay_latency)
+    if args.page_cache is not None:
+        page_cache.activate(args.page_cache, args.cache_ttl, args.cache_max_mb, args.offline)
+    rate_limit.configure(
+        rate=args.rate,
+        max_rate=args.max_rate,
+        min_rate=min(args.rate, rate_limit.settings()["min_rate"]),
+        max_concurrency=args.max_concurrency or rate_limit.settings()["max_concurrency"])
+    retry.configure(attempts=args.retries + 1)
+    dead_letters_path = args.dead_letters or f"{root_folder}/dead_letters.sqlite"
     logger.info(f"Running pipeline for search: {search}")
     try:
-        pipeline.run_pipeline(
-            search, 
-            1,
-            FileStorage("./raw_data", data_folder, images_folder), 
-            DBStorage(get_db_conn()))
+        if args.daemon:
+            daemon.serve(
+                daemon.Daemon(
+                    functools.partial(get_file_store, root_folder),
+                    DBStorage(get_db_conn()),
+                    scrapers=args.scrapers,
+                    frontier=None if args.frontier is None else Frontier(args.frontier),
+                    dead_letters=DeadLetters(dead_letters_path)),
+                port=None if args.socket is not None else args.listen_port,
+                socket_path=args.socket,
+                host=args.listen_host)
+        elif args.workers > 1:
+            parallel_pipeline.run_parallel_pipeline(
+                search,
+                num_pages,
+                functools.partial(get_file_store, root_folder, search),
+                functools.partial(DBStorage, get_db_conn()),
+                workers=args.workers,
+                frontier_factory=None if args.frontier is None else functools.partial(Frontier, args.frontier),
+                resume=args.resume,
+                dead_letters_factory=functools.partial(DeadLetters, dead_letters_path))
+        else:
+            pipeline.run_pipeline(
+                search, 
+                num_pages,
+                get_file_store(root_folder, search), 
+                DBStorage(get_db_conn()),
+                frontier=None if args.frontier is None else Frontier(args.frontier),
+                resume=args.resume,
+                incremental=args.incremental,
+                dead_letters=DeadLetters(dead_letters_path))
     except RuntimeError as e:
-       logger.exception(f"Exception raised in {__name__}. exception: {str(e)}")
\ No newline at end of file
+       logger.exception(f"Exception raised in {__name__}. exception: {str(e)}")
+    finally:
+        profiling.disable_profiling()
+        http_archive.deactivate()
+        page_cache.deactivate()
\ No newline at end of file
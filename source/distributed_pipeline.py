@@ -0,0 +1,190 @@
+"""
+Runs the pipeline as one of several workers sharing a JobQueue, e.g.
+dcp_aws.py containers on different instances given the same search.
+Each worker joins the search's run in progress, or starts a new run if the
+last one has finished, and queues the results pages of the search (pages
+already queued by another worker are ignored), then claims batches of jobs: a results
+page job queues the recipe URLs listed on the page, and recipe jobs are
+scraped and stored as a batch. The worker stops when no jobs of the search
+are left pending or leased by other workers
+"""
+
+from __future__ import annotations
+import logging
+import os
+import socket
+import time
+from typing import TYPE_CHECKING
+from recipe_scraper import RecipeScraper
+from package.storage.file_storage import Storage
+from package.storage import job_queue as jq
+from package.utils.logger import log
+from package.utils import metrics
+from package.utils import retry
+import pipeline
+
+if TYPE_CHECKING:
+    from package.storage.db_storage import DBStorage
+
+logger = logging.getLogger("distributed_pipeline")
+
+
+def worker_id() -> str:
+    """Returns an ID for this worker process: the host name and process ID"""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def _process_batch(
+        rs: RecipeScraper,
+        search_term: str,
+        jobs: list[dict],
+        job_queue: jq.JobQueue,
+        owner: str,
+        file_store: Storage,
+        db_storage: DBStorage) -> int:
+    """Runs a batch of claimed jobs; a job which fails (after any retries)
+    is returned to the queue (to be retried by any worker) and the rest of
+    the batch continues, unless a dependency's circuit breaker is open,
+    when the whole batch is returned and the error raised.
+    The leases on the rest of the batch are renewed once half the lease
+    has passed since they were last renewed
+
+    Parameters
+    ----------
+    rs : RecipeScraper
+        The scraper, with the search already executed
+    search_term : str
+        The search words used for the search
+    jobs : list[dict]
+        Jobs returned by `JobQueue.claim`
+    job_queue : JobQueue
+        The queue shared by the workers
+    owner : str
+        The worker ID holding the leases
+    file_store : Storage
+       An instance of a concrete Storage object
+    db_storage : DBStorage
+        An instance of DBStorage initialised with a valid DB connection
+
+    Returns
+    -------
+    int
+        The number of recipes scraped and saved
+    """
+    page_data = []
+    scraped_jobs = []
+    renewed = time.monotonic()
+    for n, job in enumerate(jobs):
+        try:
+            if job["kind"] == jq.RESULTS_PAGE:
+                urls = pipeline.get_results_urls(rs, search_term, int(job["key"]), db_storage)
+                queued = job_queue.enqueue(search_term, jq.RECIPE, urls)
+                job_queue.complete(search_term, [job], owner)
+                logger.info(f"Queued {queued} of {len(urls)} urls from page {job['key']} of search results.",
+                    extra={"stage": "results_page", "search": search_term})
+            else:
+                page_dict = pipeline.scrape_item(rs, job["key"], search_term, db_storage)
+                if len(page_dict) != 0:
+                    page_data.append(page_dict)
+                    scraped_jobs.append(job)
+                else:
+                    # Skipped or nothing to store
+                    job_queue.complete(search_term, [job], owner)
+        except RuntimeError as e:
+            job_queue.fail(search_term, [job], owner, str(e.__cause__ or e))
+            if isinstance(retry.root_cause(e), retry.CircuitOpenError):
+                # Leave the rest to workers which can reach the dependency
+                job_queue.fail(search_term, jobs[n + 1:] + scraped_jobs, owner, str(retry.root_cause(e)))
+                raise
+        # Hold the rest of the batch while this worker is alive
+        if time.monotonic() - renewed > job_queue.lease_seconds / 2:
+            job_queue.renew(search_term, jobs[n + 1:] + scraped_jobs, owner)
+            renewed = time.monotonic()
+    if len(page_data) > 0:
+        try:
+            pipeline.store_data_files(file_store, page_data, search_term)
+            pipeline.store_data_db(db_storage, page_data)
+        except RuntimeError as e:
+            job_queue.fail(search_term, scraped_jobs, owner, str(e.__cause__ or e))
+            return 0
+        job_queue.complete(search_term, scraped_jobs, owner)
+    return len(page_data)
+
+
+@log(my_logger=logger)
+def run_queue_worker(
+        search_term: str,
+        num_pages: int,
+        file_store: Storage,
+        db_storage: DBStorage,
+        job_queue: jq.JobQueue,
+        owner: str = None,
+        batch_size: int = 10,
+        poll_seconds: float = 5.0,
+        website_url: str = None,
+        metrics_port: int = None) -> int:
+    """Works through the queued jobs of a search with the other workers
+
+    Parameters
+    ----------
+    search_term : str
+        The search words to be used to search for recipes
+    num_pages : int
+        Number of results pages to queue (0 for every page)
+    file_store : Storage
+       An instance of a concrete Storage object
+    db_storage : DBStorage
+        An instance of DBStorage initialised with a valid DB connection
+    job_queue : JobQueue
+        The queue shared by the workers
+    owner : str, optional
+        The worker ID holding leases, by default the host name and process ID
+    batch_size : int, optional
+        Jobs claimed at a time, by default 10
+    poll_seconds : float, optional
+        Seconds to wait for leases held by other workers to finish or
+        expire when there are no pending jobs, by default 5
+    website_url : str, optional
+        Scrape a copy of the site at another address e.g. a local mock, by default the real site
+    metrics_port : int, optional
+        Port to publish Prometheus metrics on (at /metrics), by default None
+
+    Returns
+    -------
+    int
+        The number of recipes scraped and saved by this worker
+
+    Raises
+    ------
+    RuntimeError
+        RuntimeError excepion will be propagated up and raised to calling functions
+    """
+    if metrics_port is not None:
+        metrics.start_metrics_server(metrics_port)
+    owner = owner or worker_id()
+    items = 0
+    rs = RecipeScraper(website_url=website_url)
+    try:
+        results_pages = rs.search_recipes(search_term, num_pages)
+        job_queue.begin(search_term)
+        queued = job_queue.enqueue(search_term, jq.RESULTS_PAGE, list(range(1, results_pages + 1)))
+        logger.info(f"Worker {owner} queued {queued} of {results_pages} results pages",
+            extra={"stage": "queue", "search": search_term})
+        while True:
+            jobs = job_queue.claim(search_term, owner, batch_size)
+            if len(jobs) == 0:
+                if job_queue.outstanding(search_term) == 0:
+                    break
+                # Other workers hold the remaining jobs; wait in case a lease is lost
+                time.sleep(poll_seconds)
+                continue
+            items += _process_batch(
+                rs, search_term, jobs, job_queue, owner, file_store, db_storage)
+    finally:
+        rs.quit()
+    counts = job_queue.counts(search_term)
+    logger.info(f"Worker {owner} scraped {items} recipes; queue states: {counts}",
+        extra={"stage": "done", "search": search_term})
+    # Publish the index of stored records (if the storage keeps one)
+    file_store.sync_manifest()
+    return items
@@ -0,0 +1,163 @@
+from contextlib import contextmanager
+from types import ModuleType
+import threading
+import time
+
+
+class LocatorMeasurement:
+    """
+    The result of one lookup with a Locator
+
+    Attributes
+    ----------
+    count : int
+        Number of elements found
+    """
+
+    def __init__(self):
+        self.count = 0
+
+
+class LocatorProfiler:
+    """
+    Records the wall time, number of elements found, misses (no elements)
+    and exceptions for each Locator used by a Scraper, to show which
+    selectors are worth optimising or replacing.
+    Locators are reported by the name of the constant they are assigned
+    to (see `name_locators`), or by their strategy and value otherwise
+    """
+
+    def __init__(self):
+        self.__names = {}
+        self.__stats = {}
+        self.__lock = threading.Lock()
+
+    def name_locators(self, module: ModuleType):
+        """Names the Locator constants defined in a module
+        e.g. recipe_constants, so they are reported as RECIPE_NAME_LOC etc.
+
+        Parameters
+        ----------
+        module : ModuleType
+            The module defining Locator constants
+        """
+        for name, value in vars(module).items():
+            if name.isupper() and hasattr(value, "locate_by") and hasattr(value, "locate_value"):
+                self.__names[id(value)] = name
+
+    def name_of(self, loc) -> str:
+        """Returns the name a Locator is reported under
+
+        Parameters
+        ----------
+        loc : Locator
+            A Locator (or a (by, value) tuple)
+
+        Returns
+        -------
+        str
+            The constant name, or "by=value"
+        """
+        name = self.__names.get(id(loc))
+        if name is None:
+            locate_by, locate_value = loc
+            name = f"{locate_by}={locate_value}"
+        return name
+
+    @contextmanager
+    def measure(self, loc):
+        """Context manager which times a lookup with a Locator.
+        Set `count` on the yielded measurement to the number of elements found
+
+        Parameters
+        ----------
+        loc : Locator
+            The Locator used for the lookup
+
+        Yields
+        ------
+        LocatorMeasurement
+            The measurement for the lookup
+        """
+        measurement = LocatorMeasurement()
+        start = time.perf_counter()
+        error = False
+        try:
+            yield measurement
+        except Exception:
+            error = True
+            raise
+        finally:
+            self.record(self.name_of(loc), time.perf_counter() - start, measurement.count, error)
+
+    def record(self,
+            name: str,
+            seconds: float,
+            count: int,
+            error: bool = False):
+        """Records one lookup
+
+        Parameters
+        ----------
+        name : str
+            The name the Locator is reported under
+        seconds : float
+            Wall time of the lookup
+        count : int
+            Number of elements found
+        error : bool, optional
+            True if the lookup raised an exception, by default False
+        """
+        with self.__lock:
+            stats = self.__stats.setdefault(
+                name,
+                {"calls": 0, "seconds": 0.0, "max_seconds": 0.0, "elements": 0, "misses": 0, "errors": 0})
+            stats["calls"] += 1
+            stats["seconds"] += seconds
+            stats["max_seconds"] = max(stats["max_seconds"], seconds)
+            stats["elements"] += count
+            stats["misses"] += 1 if count == 0 else 0
+            stats["errors"] += 1 if error else 0
+
+    def report(self) -> list[dict]:
+        """Returns the statistics for each Locator, most expensive first
+
+        Returns
+        -------
+        list[dict]
+            One dictionary per Locator with the calls, total and mean time,
+            elements found and miss / error rates
+        """
+        with self.__lock:
+            stats = {name: dict(values) for name, values in self.__stats.items()}
+        rows = []
+        for name, values in stats.items():
+            calls = values["calls"]
+            rows.append({
+                "locator": name,
+                "calls": calls,
+                "total_seconds": values["seconds"],
+                "mean_ms": 1000 * values["seconds"] / calls,
+                "max_ms": 1000 * values["max_seconds"],
+                "mean_elements": values["elements"] / calls,
+                "miss_rate": values["misses"] / calls,
+                "error_rate": values["errors"] / calls
+            })
+        return sorted(rows, key=lambda row: row["total_seconds"], reverse=True)
+
+    def format_report(self) -> str:
+        """Formats the report as a text table
+
+        Returns
+        -------
+        str
+            The report
+        """
+        lines = [f"{'locator':<40} {'calls':>7} {'total s':>9} {'mean ms':>9} {'max ms':>9} "
+            f"{'elems':>7} {'miss %':>7} {'err %':>7}"]
+        for row in self.report():
+            lines.append(
+                f"{row['locator'][:40]:<40} {row['calls']:>7} {row['total_seconds']:>9.2f} "
+                f"{row['mean_ms']:>9.1f} {row['max_ms']:>9.1f} {row['mean_elements']:>7.1f} "
+                f"{100 * row['miss_rate']:>7.1f} {100 * row['error_rate']:>7.1f}")
+        return "\n".join(lines)
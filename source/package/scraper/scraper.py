@@ -1,3 +1,6 @@
+from contextlib import nullcontext
+import os
+import time
 from typing import Dict
 from selenium import webdriver
 from selenium.webdriver.remote.webelement import WebElement
@@ -8,8 +11,98 @@ from selenium.common.exceptions import StaleElementReferenceException
 from selenium.common.exceptions import TimeoutException
 from selenium.webdriver.chrome.options import Options
 from ..utils.logger import log_class
+from ..utils import http_archive
+from ..utils import metrics
+from ..utils import page_cache
+from ..utils import rate_limit
+from .locator_profiler import LocatorMeasurement, LocatorProfiler
 import logging
 
+# Returns the HTTP status of the page loaded (0 or undefined if the
+# browser does not report it)
+_RESPONSE_STATUS = (
+    "const entry = performance.getEntriesByType('navigation')[0];"
+    "return entry ? entry.responseStatus : null;")
+
+# Navigations between checks of the browser's memory
+_RSS_CHECK_EVERY = 10
+
+# Parts of WebDriver error messages which mean the browser
+# (or the tab) has crashed or the session is gone
+_CRASH_MESSAGES = ["chrome not reachable", "disconnected", "tab crashed",
+    "session deleted", "no such session", "invalid session id", "target window already closed"]
+
+# Exceptions raised when chromedriver itself has gone
+_CRASH_ERRORS = {"InvalidSessionIdException", "NoSuchWindowException",
+    "MaxRetryError", "ConnectionRefusedError", "ProtocolError", "RemoteDisconnected"}
+
+
+def _session_failure(e: Exception) -> str:
+    """Returns why a browser session can no longer be used, if
+    the error from a page load means it crashed or hung
+
+    Parameters
+    ----------
+    e : Exception
+        The error raised loading a page
+
+    Returns
+    -------
+    str
+        crashed, hung (the page load timed out) or None
+    """
+    if isinstance(e, TimeoutException):
+        return "hung"
+    if type(e).__name__ in _CRASH_ERRORS:
+        return "crashed"
+    message = str(e).lower()
+    if any(crash in message for crash in _CRASH_MESSAGES):
+        return "crashed"
+    return None
+
+
+def _process_tree_rss(pid: int) -> int:
+    """Returns the resident memory of a process and its descendants
+    (chromedriver, Chrome and its renderers), using psutil if installed,
+    otherwise /proc
+
+    Parameters
+    ----------
+    pid : int
+        The process ID
+
+    Returns
+    -------
+    int
+        Bytes, or None if it cannot be measured
+    """
+    try:
+        import psutil
+    except ImportError:
+        psutil = None
+    if psutil is not None:
+        try:
+            process = psutil.Process(pid)
+            return sum(p.memory_info().rss for p in [process] + process.children(recursive=True))
+        except psutil.Error:
+            return None
+    total = 0
+    pids = [pid]
+    try:
+        while pids:
+            pid = pids.pop()
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+            for task in os.listdir(f"/proc/{pid}/task"):
+                with open(f"/proc/{pid}/task/{task}/children") as f:
+                    pids.extend(int(child) for child in f.read().split())
+    except (OSError, ValueError):
+        # Not Linux, or a process exited while being read
+        return total or None
+    return total
+
 # @log_class
 class Locator:
     # Create a logger for the Locator class
@@ -53,20 +146,100 @@ class Scraper():
     logger = logging.getLogger(__name__)
     """
     This class provides generic functions for web scraping
+
+    The browser session is recycled (quit and relaunched, with its cookies
+    restored) before a page load once it has loaded `max_pages` pages or
+    the browser's processes use more than `max_rss_mb` of memory, as
+    Chrome's memory grows over a long run. A session which has crashed,
+    or hung (a page load takes longer than `page_load_timeout`), is
+    recycled and the page load tried again
+
+    When the page cache is active, the pages loaded by `search` and
+    `go_to_page_url` are replayed from it if cached, and cached otherwise
+
+    Attributes
+    ----------
+    session_pages : int
+        Pages loaded by the current browser session
+    recycles : int
+        Times the browser session has been recycled
     """
 
     def __init__(self, 
-                url: str) -> None:
+                url: str,
+                profiler: LocatorProfiler = None,
+                max_pages: int = 500,
+                max_rss_mb: float = 1500,
+                page_load_timeout: float = 60) -> None:
         """
         Parameters
         ----------
         url: str
             The URL of the website to be scraped
+        profiler: LocatorProfiler, optional
+            Records the cost of each Locator used to scrape data, by default None
+        max_pages: int, optional
+            Pages loaded before the browser session is recycled, by default 500 (None for no limit)
+        max_rss_mb: float, optional
+            Memory (MB) used by the browser's processes before the session
+            is recycled, by default 1500 (None for no limit)
+        page_load_timeout: float, optional
+            Seconds before a page load is treated as hung, by default 60
         Returns
         -------
         None
         """
-        # initiate the session
+        self.profiler = profiler
+        self.session_pages = 0
+        self.recycles = 0
+        self.__url = url
+        self.__max_pages = max_pages
+        self.__max_rss = None if max_rss_mb is None else max_rss_mb * 2**20
+        self.__page_load_timeout = page_load_timeout
+        # Restored when the session is recycled e.g. cookie consent
+        self.__cookies = []
+        self.__start()
+        self.__navigate(url)
+
+    def recycle(self, reason: str = "requested") -> None:
+        """
+        Quits the browser session and starts a new one on the website's
+        home page, restoring the cookies of the old session
+
+        Parameters
+        ----------
+        reason: str, optional
+            Why the session is recycled e.g. pages, rss, crashed or hung
+            (for the logs and metrics), by default requested
+        """
+        start = time.perf_counter()
+        if self.__driver is not None:
+            try:
+                self.__cookies = self.__driver.get_cookies()
+            except Exception:
+                # Crashed: the cookies saved at the last check are used
+                pass
+            try:
+                self.__driver.quit()
+            except Exception:
+                pass
+        self.__start()
+        self.__load(self.__url)
+        for cookie in self.__cookies:
+            try:
+                self.__driver.add_cookie(cookie)
+            except Exception:
+                # e.g. set for another domain
+                continue
+        self.recycles += 1
+        metrics.SESSION_RECYCLES.labels(reason).inc()
+        self.logger.warning(f"Recycled the browser session after {self.session_pages} pages ({reason}), "
+            f"restored {len(self.__cookies)} cookies",
+            extra={"stage": "recycle", "duration": time.perf_counter() - start})
+        self.session_pages = 0
+
+    def __start(self) -> None:
+        """Starts a browser session"""
         options = Options()
         options.add_argument("--headless")
         # These settings required otherwise initialisation of driver slow
@@ -81,7 +254,7 @@ class Scraper():
         # options.binary_location = '/usr/bin/google-chrome'
         # driverService = Service('/usr/bin/chromedriver')
         self.__driver = webdriver.Chrome(options=options)
-        self.__driver.get(url)
+        self.__driver.set_page_load_timeout(self.__page_load_timeout)
 
     def dismiss_popup(
             self,
@@ -149,7 +322,7 @@ class Scraper():
 
         """
 
-        self.__driver.get(search_url)
+        self.__navigate(search_url, cached=True)
         
         # if the no results div exists then search returned no results
         return len(self.__driver.find_elements(*results_loc)) != 0
@@ -181,8 +354,14 @@ class Scraper():
 
         # Was getting a timeout error here, adding this wait for all the elements
         # to be present seems to solve this
-        items = WebDriverWait(self.__driver, 10).until(
-            EC.presence_of_all_elements_located(results_loc))
+        try:
+            items = WebDriverWait(self.__driver, 10).until(
+                EC.presence_of_all_elements_located(results_loc))
+        except TimeoutException:
+            # The results did not render in time: treat as a slowdown of the site
+            if not http_archive.replaying():
+                rate_limit.get_limiter(self.__last_url).backoff(rate_limit.TIMEOUT)
+            raise
         for item in items:
             # go to each recipe and get the link and add to list
             item_url = item.get_attribute('href')
@@ -208,7 +387,7 @@ class Scraper():
         bool
             True when page navigation successful, False otherwise
         """
-        self.__driver.get(url)
+        self.__navigate(url, cached=True)
         if invalid_page != None:
             return len(self.__driver.find_elements(*invalid_page)) == 0
         else:
@@ -260,8 +439,10 @@ class Scraper():
         str
             The text attribute of the web element
         """
-        
-        return self.__driver.find_element(*loc).text
+        with self.__measure(loc) as measurement:
+            text = self.__driver.find_element(*loc).text
+            measurement.count = 1
+        return text
 
     def get_elements_list(self, 
             item_key: str,
@@ -285,8 +466,10 @@ class Scraper():
             A list of dictionaries with a single key: value
             pair in each dictionary
         """
-        list_items = self.__driver.find_elements(*list_loc)
-        return [{item_key: item.text} for item in list_items]
+        with self.__measure(list_loc) as measurement:
+            list_items = self.__driver.find_elements(*list_loc)
+            measurement.count = len(list_items)
+            return [{item_key: item.text} for item in list_items]
  
     def get_elements_dict(
             self, 
@@ -313,13 +496,17 @@ class Scraper():
         """
         dict_list = []
 
-        list_items = self.__driver.find_elements(*list_loc)
+        with self.__measure(list_loc) as measurement:
+            list_items = self.__driver.find_elements(*list_loc)
+            measurement.count = len(list_items)
         if len(list_items) > 0:
             for item in list_items:
                 item_dict = {}
                 for key, value in locators.items():
                     key_text = key
-                    key_value = item.find_element(*value).text
+                    with self.__measure(value) as measurement:
+                        key_value = item.find_element(*value).text
+                        measurement.count = 1
                     item_dict.update({key_text: key_value})
                 dict_list.append(item_dict)
             return dict_list
@@ -342,12 +529,115 @@ class Scraper():
             A list of image URLS
         """
         image_urls = []
-        images = self.__driver.find_elements(*loc)
-        for image in images:
-            image_urls.append(image.get_attribute('src'))
+        with self.__measure(loc) as measurement:
+            images = self.__driver.find_elements(*loc)
+            measurement.count = len(images)
+            for image in images:
+                image_urls.append(image.get_attribute('src'))
         return image_urls
 
+    def __navigate(self, url: str, cached: bool = False) -> None:
+        """
+        Loads a page in the browser, recording it to (or replaying it from)
+        the HTTP archive when one is active. Loads from the live site
+        are paced by the host's rate limiter, which is given the status
+        of the response from the browser's Navigation Timing entry
+
+        Parameters
+        ----------
+        url: str
+            The URL of the page on the website
+        cached: bool, optional
+            Replay the page from the page cache if it is cached there,
+            otherwise cache it once loaded, by default False
+        """
+        self.__check_session()
+        try:
+            self.__load(url, cached)
+        except Exception as e:
+            reason = _session_failure(e)
+            if reason is None:
+                raise
+            self.recycle(reason)
+            self.__load(url, cached)
+        self.session_pages += 1
+
+    def __load(self, url: str, cached: bool = False) -> None:
+        """
+        Loads a page in the browser (see __navigate)
+
+        Parameters
+        ----------
+        url: str
+            The URL of the page on the website
+        cached: bool, optional
+            Use the page cache, by default False
+        """
+        self.__last_url = url
+        if page_cache.offline() and not cached:
+            # Nothing is loaded from the website, e.g. its home page
+            self.__driver.get("about:blank")
+            return
+        if cached:
+            cache_url = page_cache.browser_url(url)
+            if cache_url is not None:
+                self.__driver.get(cache_url)
+                return
+        if http_archive.replaying():
+            self.__driver.get(http_archive.browser_url(url))
+        else:
+            with rate_limit.request(url) as req:
+                self.__driver.get(url)
+                req.record(self.__driver.execute_script(_RESPONSE_STATUS))
+        if http_archive.recording() or (cached and page_cache.active()):
+            page_source = self.__driver.page_source
+            http_archive.record_page(url, page_source)
+            if cached:
+                page_cache.store(url, page_source)
+
+    def __check_session(self) -> None:
+        """Recycles the browser session if it has loaded `max_pages` pages
+        or its processes' memory is over `max_rss_mb`"""
+        if self.__max_pages is not None and self.session_pages >= self.__max_pages:
+            self.recycle("pages")
+            return
+        if self.session_pages == 0 or self.session_pages % _RSS_CHECK_EVERY != 0:
+            return
+        try:
+            self.__cookies = self.__driver.get_cookies()
+        except Exception:
+            # Dealt with by the next page load
+            return
+        service = getattr(self.__driver, "service", None)
+        process = getattr(service, "process", None)
+        rss = None if process is None else _process_tree_rss(process.pid)
+        if rss is None:
+            return
+        metrics.BROWSER_RSS.set(rss)
+        if self.__max_rss is not None and rss > self.__max_rss:
+            self.recycle("rss")
+
+    def __measure(self, loc: Locator):
+        """
+        Returns a context manager which profiles a lookup with `loc`,
+        or does nothing if there is no profiler
+
+        Parameters
+        ----------
+        loc: Locator
+            The Locator used for the lookup
+
+        Returns
+        -------
+        ContextManager[LocatorMeasurement]
+            Context manager yielding the measurement for the lookup
+        """
+        if self.profiler is None:
+            return nullcontext(LocatorMeasurement())
+        return self.profiler.measure(loc)
+
     def quit(self) -> None:
         """Closes the browser session"""
-        self.__driver.quit()
+        if self.__driver is not None:
+            self.__driver.quit()
         self.__driver = None
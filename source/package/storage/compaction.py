@@ -0,0 +1,384 @@
+import gzip
+import hashlib
+import io
+import json
+import sqlite3
+import uuid
+from .storage import Storage
+from ..utils.utilities import UUIDEncoder
+from ..utils.logger import log_class
+import logging
+
+# Phases of a compaction run, in the order they are executed
+PHASES = ["list", "index", "write", "swap", "delete", "done"]
+
+# Number of journal rows fetched at a time
+JOURNAL_BATCH = 500
+
+@log_class
+class Compactor:
+    """
+    Merges the small batch json files saved under a folder into large
+    gzip compressed JSON lines files, keeping only the latest record
+    for each item_id.
+
+    Each record is written as its own gzip member so the manifest can
+    point at (and ranged reads can fetch) a single record.
+    Progress is kept in a local SQLite journal, so an interrupted run
+    resumes where it stopped, and only one source file and one output
+    file are held in memory at a time.
+
+    Attributes
+    ----------
+    storage : Storage
+        The storage holding the files to compact
+    folder : str
+        The folder (or key prefix) of the files to compact
+    output_folder : str
+        The folder compacted files are written to
+    records_per_file : int
+        The maximum number of records in each compacted file
+    """
+    # Create a logger for the Compactor class
+    # Will be accessed by class decorator
+    # which decorates each method with logging functionality
+    logger = logging.getLogger(__name__)
+
+    def __init__(self,
+            storage: Storage,
+            folder: str,
+            journal_path: str,
+            output_folder: str = None,
+            records_per_file: int = 10000):
+        """
+        Creates (or resumes) a compaction of the files in `folder`
+
+        Parameters
+        ----------
+        storage : Storage
+            The storage holding the files to compact
+        folder : str
+            The folder (or key prefix) of the files to compact
+        journal_path : str
+            Path of the local SQLite journal used to resume the run
+        output_folder : str, optional
+            The folder for compacted files, by default `folder`/compacted
+        records_per_file : int, optional
+            The maximum number of records in each compacted file, by default 10000
+        """
+        self.storage = storage
+        self.folder = folder
+        self.output_folder = output_folder or f"{folder}/compacted"
+        self.records_per_file = records_per_file
+        self.__conn = sqlite3.connect(journal_path)
+        with self.__conn:
+            self.__conn.executescript(
+                """CREATE TABLE IF NOT EXISTS meta (
+                    name TEXT PRIMARY KEY,
+                    value TEXT);
+                CREATE TABLE IF NOT EXISTS sources (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    object_key TEXT UNIQUE NOT NULL,
+                    indexed INTEGER NOT NULL DEFAULT 0,
+                    deleted INTEGER NOT NULL DEFAULT 0);
+                CREATE TABLE IF NOT EXISTS winners (
+                    item_id TEXT PRIMARY KEY,
+                    rank_time REAL NOT NULL,
+                    source_seq INTEGER NOT NULL,
+                    record_idx INTEGER NOT NULL);
+                CREATE INDEX IF NOT EXISTS ix_winners_source ON winners (source_seq);
+                CREATE TABLE IF NOT EXISTS parts (
+                    part_no INTEGER PRIMARY KEY,
+                    object_key TEXT NOT NULL,
+                    records INTEGER NOT NULL);
+                CREATE TABLE IF NOT EXISTS part_entries (
+                    part_no INTEGER NOT NULL,
+                    item_id TEXT NOT NULL,
+                    byte_offset INTEGER NOT NULL,
+                    byte_length INTEGER NOT NULL,
+                    content_hash TEXT NOT NULL);""")
+            self.__conn.execute(
+                "INSERT OR IGNORE INTO meta VALUES ('run_id', ?), ('phase', 'list'), ('folder', ?)",
+                (uuid.uuid4().hex[:8], folder))
+        if self.__get_meta("folder") != folder:
+            raise RuntimeError(
+                f"Journal {journal_path} belongs to a compaction of {self.__get_meta('folder')}")
+
+    def run(self) -> dict:
+        """Runs (or resumes) the compaction through to completion
+
+        Returns
+        -------
+        dict
+            Summary of the run: number of source files, records and compacted files
+        """
+        steps = {
+            "list": self.__list,
+            "index": self.__index,
+            "write": self.__write,
+            "swap": self.__swap,
+            "delete": self.__delete
+        }
+        while self.phase() != "done":
+            phase = self.phase()
+            steps[phase]()
+            self.__set_meta("phase", PHASES[PHASES.index(phase) + 1])
+            self.logger.info(f"Compaction of {self.folder}: completed phase {phase}")
+        return {
+            "sources": self.__scalar("SELECT COUNT(*) FROM sources"),
+            "records": self.__scalar("SELECT COUNT(*) FROM winners"),
+            "files": self.__scalar("SELECT COUNT(*) FROM parts")
+        }
+
+    def phase(self) -> str:
+        """Returns the current phase of the run
+
+        Returns
+        -------
+        str
+            One of `PHASES`
+        """
+        return self.__get_meta("phase")
+
+    def __list(self):
+        """Records the source files to compact in the journal"""
+        manifest = self.storage.manifest
+        with self.__conn:
+            for key in self.storage.list_files(self.folder, "json"):
+                if key.startswith(f"{self.output_folder}/"):
+                    continue
+                if manifest is not None and manifest.is_tombstoned(key):
+                    continue
+                self.__conn.execute(
+                    "INSERT OR IGNORE INTO sources (object_key) VALUES (?)", (key,))
+
+    def __index(self):
+        """Finds the latest record for each item_id, one source file at a time"""
+        manifest = self.storage.manifest
+        for seq, key in self.__sources("indexed"):
+            # Records saved later win: the save time is taken from the
+            # manifest, or for files it does not know (e.g. saved before
+            # there was a manifest) the time the file was written, then
+            # listing order breaks ties
+            key_time = manifest.key_time(key) if manifest is not None else None
+            if key_time is None:
+                key_time = self.storage.modified_time(key)
+            rows = [
+                (item_id, key_time, seq, idx)
+                for idx, item_id, _ in self.__read_records(key, seq)]
+            with self.__conn:
+                self.__conn.executemany(
+                    """INSERT INTO winners (item_id, rank_time, source_seq, record_idx)
+                        VALUES (?, ?, ?, ?)
+                        ON CONFLICT (item_id) DO UPDATE SET
+                            rank_time = excluded.rank_time,
+                            source_seq = excluded.source_seq,
+                            record_idx = excluded.record_idx
+                        WHERE (excluded.rank_time, excluded.source_seq, excluded.record_idx)
+                            > (winners.rank_time, winners.source_seq, winners.record_idx)""",
+                    rows)
+                self.__conn.execute("UPDATE sources SET indexed = 1 WHERE seq = ?", (seq,))
+
+    def __write(self):
+        """Writes the winning records to compacted files. Records already
+        written to committed files before an interruption are skipped
+        """
+        skip = self.__scalar("SELECT COALESCE(SUM(records), 0) FROM parts")
+        buffer = _PartBuffer()
+        for seq, key in self.__sources(None):
+            winners = dict(self.__conn.execute(
+                "SELECT record_idx, item_id FROM winners WHERE source_seq = ?",
+                (seq,)).fetchall())
+            if skip >= len(winners):
+                skip -= len(winners)
+                continue
+            for idx, item_id, record in self.__read_records(key, seq):
+                if winners.get(idx) != item_id:
+                    continue
+                if skip > 0:
+                    skip -= 1
+                    continue
+                buffer.add(item_id, record)
+                if len(buffer) >= self.records_per_file:
+                    self.__flush(buffer)
+                    buffer = _PartBuffer()
+        if len(buffer) > 0:
+            self.__flush(buffer)
+
+    def __flush(self, buffer):
+        """Saves a compacted file and records it in the journal
+
+        Parameters
+        ----------
+        buffer : _PartBuffer
+            The records for the file
+        """
+        part_no = self.__scalar("SELECT COUNT(*) FROM parts")
+        file = f"part-{self.__get_meta('run_id')}-{part_no:05d}.jsonl.gz"
+        self.storage.save_bytes(bytes(buffer.body), self.output_folder, file)
+        with self.__conn:
+            self.__conn.execute(
+                "INSERT INTO parts VALUES (?, ?, ?)",
+                (part_no, f"{self.output_folder}/{file}", len(buffer)))
+            self.__conn.executemany(
+                "INSERT INTO part_entries VALUES (?, ?, ?, ?, ?)",
+                [(part_no, *span) for span in buffer.spans])
+
+    def __swap(self):
+        """Publishes the compacted files: tombstone objects listing the replaced
+        files are saved, then the manifest (if any) is updated in one transaction.
+        Each record keeps the time it was saved (its rank time), so
+        `Manifest.since` is not changed by compaction
+        """
+        run_id = self.__get_meta("run_id")
+        chunk, chunk_no = [], 0
+        for _, key in self.__sources(None):
+            chunk.append(key)
+            if len(chunk) == self.records_per_file:
+                self.__save_tombstones(run_id, chunk_no, chunk)
+                chunk, chunk_no = [], chunk_no + 1
+        if len(chunk) > 0:
+            self.__save_tombstones(run_id, chunk_no, chunk)
+
+        if self.storage.manifest is not None:
+            self.storage.manifest.swap(
+                self.__conn.execute(
+                    """SELECT e.item_id, p.object_key, e.byte_offset, e.byte_length,
+                        e.content_hash, NULLIF(w.rank_time, 0)
+                        FROM part_entries e JOIN parts p ON p.part_no = e.part_no
+                        JOIN winners w ON w.item_id = e.item_id
+                        ORDER BY e.part_no, e.byte_offset"""),
+                (key for _, key in self.__sources(None)))
+            self.storage.sync_manifest()
+
+    def __save_tombstones(self, run_id: str, chunk_no: int, keys: list):
+        """Saves a tombstone object listing replaced files
+
+        Parameters
+        ----------
+        run_id : str
+            The ID of the compaction run
+        chunk_no : int
+            Sequence number of the tombstone object
+        keys : list
+            The replaced files
+        """
+        self.storage.save_json_file(
+            {"run_id": run_id, "replaced": keys},
+            self.output_folder,
+            f"_tombstones-{run_id}-{chunk_no:05d}")
+
+    def __delete(self):
+        """Deletes the replaced source files"""
+        for seq, key in self.__sources("deleted"):
+            self.storage.delete_file(key)
+            with self.__conn:
+                self.__conn.execute("UPDATE sources SET deleted = 1 WHERE seq = ?", (seq,))
+
+    def __read_records(self, key: str, seq: int):
+        """Reads a source file and yields its records
+
+        Parameters
+        ----------
+        key : str
+            The source file
+        seq : int
+            Sequence number of the source file in the journal
+
+        Yields
+        ------
+        tuple
+            (record index, item_id, record); records without an
+            item_id are given an ID unique to their position
+        """
+        records = self.storage.read_json_file(key)
+        if not isinstance(records, list):
+            records = [records]
+        for idx, record in enumerate(records):
+            item_id = record.get("item_id") if isinstance(record, dict) else None
+            yield idx, str(item_id) if item_id is not None else f"{seq}#{idx}", record
+
+    def __sources(self, flag: str):
+        """Yields source files in journal order without loading them all at once
+
+        Parameters
+        ----------
+        flag : str
+            Only yield sources where this column is not set, or None for all sources
+
+        Yields
+        ------
+        tuple
+            (sequence number, object key)
+        """
+        condition = f"AND {flag} = 0" if flag is not None else ""
+        last = 0
+        while True:
+            rows = self.__conn.execute(
+                f"""SELECT seq, object_key FROM sources WHERE seq > ? {condition}
+                    ORDER BY seq LIMIT {JOURNAL_BATCH}""",
+                (last,)).fetchall()
+            if len(rows) == 0:
+                return
+            yield from rows
+            last = rows[-1][0]
+
+    def __scalar(self, sql: str):
+        """Returns the single value selected by a journal query"""
+        return self.__conn.execute(sql).fetchone()[0]
+
+    def __get_meta(self, name: str) -> str:
+        """Returns a value from the journal metadata"""
+        return self.__conn.execute(
+            "SELECT value FROM meta WHERE name = ?", (name,)).fetchone()[0]
+
+    def __set_meta(self, name: str, value: str):
+        """Sets a value in the journal metadata"""
+        with self.__conn:
+            self.__conn.execute("UPDATE meta SET value = ? WHERE name = ?", (value, name))
+
+
+class _PartBuffer:
+    """Accumulates the gzip members of one compacted file"""
+
+    def __init__(self):
+        self.body = bytearray()
+        self.spans = []
+
+    def __len__(self):
+        return len(self.spans)
+
+    def add(self, item_id: str, record: dict):
+        """Compresses a record as a gzip member and appends it
+
+        Parameters
+        ----------
+        item_id : str
+            The unique ID of the record
+        record : dict
+            The record
+        """
+        data = json.dumps(record, cls=UUIDEncoder).encode("utf-8")
+        member = gzip.compress(data + b"\n", mtime=0)
+        self.spans.append((item_id, len(self.body), len(member), hashlib.sha256(data).hexdigest()))
+        self.body += member
+
+
+def iter_compacted(storage: Storage, file: str):
+    """Reads the records from a compacted file
+
+    Parameters
+    ----------
+    storage : Storage
+        The storage holding the file
+    file : str
+        The compacted file (full path or key)
+
+    Yields
+    ------
+    dict
+        Each record in the file
+    """
+    with gzip.GzipFile(fileobj=io.BytesIO(storage.read_range(file, 0))) as infile:
+        for line in infile:
+            yield json.loads(line)
@@ -1,12 +1,17 @@
-import psycopg2
+from __future__ import annotations
 from sqlalchemy.exc import ProgrammingError, OperationalError
+import json
+import time
+from typing import TYPE_CHECKING
 import uuid
-import pandas as pd
-from pandas import json_normalize
-from sqlalchemy import create_engine
+from sqlalchemy import bindparam, create_engine, text
 from ..utils.logger import log_class
 import logging
 
+if TYPE_CHECKING:
+    # pandas is imported when data is first written, as it is slow to import
+    import pandas as pd
+
 @log_class
 class DBStorage:
     # Create a logger for the Locator class
@@ -41,7 +46,8 @@ class DBStorage:
             child_tabs: list[tuple],
             fk_column: list):
         """Normalises a json dictionary into parent and child entities
-        and inserts the data into the relevant database tables
+        and inserts the data into the relevant database tables,
+        in one transaction so a failed insert can be retried
 
         Parameters
         ----------
@@ -59,18 +65,44 @@ class DBStorage:
         fk_column : list
             The unique column(s) for the parent table, also used as foreign key in child tables
         """
+        from pandas import json_normalize
         # Get the parent table
-        (json_normalize(
-            data_json)[parent_tab_cols]).set_index(
-            fk_column, verify_integrity=True).to_sql(
-            parent_table, self.__engine, if_exists="append")
-        # Get the child table(s)
-        for tab in child_tabs:
-            table_name, index_cols = tab
-            (json_normalize(
-                    data_json, [table_name], fk_column)).set_index(
-                    index_cols, verify_integrity=True).to_sql(
-                    table_name, self.__engine, if_exists="append")
+        parent_df = json_normalize(data_json)[parent_tab_cols]
+        if self.__engine.dialect.name != "postgresql":
+            parent_df = self.__as_text(parent_df)
+        with self.__engine.begin() as conn:
+            parent_df.set_index(
+                fk_column, verify_integrity=True).to_sql(
+                parent_table, conn, if_exists="append")
+            # Get the child table(s)
+            for tab in child_tabs:
+                table_name, index_cols = tab
+                (json_normalize(
+                        data_json, [table_name], fk_column)).set_index(
+                        index_cols, verify_integrity=True).to_sql(
+                        table_name, conn, if_exists="append")
+
+    def __as_text(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Converts lists and UUIDs to text, for databases other than
+        Postgres (e.g. a SQLite stand-in) which cannot store them
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            A pandas DataFrame
+
+        Returns
+        -------
+        pd.DataFrame
+            The DataFrame with lists as JSON and UUIDs as hex
+        """
+        def as_text(value):
+            if isinstance(value, list):
+                return json.dumps(value)
+            if isinstance(value, uuid.UUID):
+                return value.hex
+            return value
+        return df.apply(lambda column: column.map(as_text))
 
     def upsert_df(self,
         df: pd.DataFrame, 
@@ -163,14 +195,146 @@ class DBStorage:
         try:
             result = self.__engine.execute(
                 f"""SELECT EXISTS (
-                    SELECT FROM {table_name} 
+                    SELECT 1 FROM {table_name} 
                     WHERE  {item_id_column} = '{item_id_value}');
                     """)
             if result.first()[0]:
                 return True
         except ProgrammingError as pe:
+            import psycopg2
             if pe.code == psycopg2.errors.lookup("42P01"):
                 return True
         except OperationalError as oe:
             return False
 
+    def link_items(self,
+            table_name: str,
+            search: str,
+            item_ids: list) -> bool:
+        """
+        Records which items a search found, in a link table with one row per
+        (search, item_id) pair, creating the table if needed.
+        Pairs already recorded are ignored, so an item found by several
+        searches (or by the same search on another run) is linked to each once
+
+        Parameters
+        ----------
+        table_name: str
+            The link table name e.g. search_recipe
+        search: str
+            The search
+        item_ids: list
+            The IDs of the items listed in the search results
+
+        Returns
+        -------
+            True if successful
+        """
+        if len(item_ids) == 0:
+            return True
+        with self.__engine.begin() as conn:
+            conn.execute(text(
+                f"""CREATE TABLE IF NOT EXISTS {table_name} (
+                    search TEXT NOT NULL,
+                    item_id TEXT NOT NULL,
+                    PRIMARY KEY (search, item_id))"""))
+            conn.execute(text(
+                f"""INSERT INTO {table_name} (search, item_id) VALUES (:search, :item_id)
+                    ON CONFLICT DO NOTHING"""),
+                [{"search": search, "item_id": item_id} for item_id in dict.fromkeys(item_ids)])
+        return True
+
+    def existing_items(self,
+            table_name: str,
+            item_id_column: str,
+            item_id_values: list) -> set:
+        """
+        Returns which of several IDs have a record in a table, in one query
+
+        Parameters
+        ----------
+        table_name: str
+            The table name
+        item_id_column: str
+            Name of the the ID column
+        item_id_values: list
+            The ID values to check
+
+        Returns
+        -------
+            The IDs with a record (none if the table doesn't exist)
+        """
+        if len(item_id_values) == 0:
+            return set()
+        try:
+            with self.__engine.connect() as conn:
+                result = conn.execute(
+                    text(f"SELECT {item_id_column} FROM {table_name} WHERE {item_id_column} IN :ids")
+                        .bindparams(bindparam("ids", expanding=True)),
+                    {"ids": list(set(item_id_values))})
+                return {row[0] for row in result}
+        except (ProgrammingError, OperationalError):
+            # The table has not been created yet
+            return set()
+
+    def get_high_water(self,
+            table_name: str,
+            search: str) -> str:
+        """
+        Returns the high-water mark of a search: the newest item
+        listed by the search when it was last crawled
+
+        Parameters
+        ----------
+        table_name: str
+            The high-water mark table name e.g. search_high_water
+        search: str
+            The search
+
+        Returns
+        -------
+            The item ID, or None if the search has no mark
+        """
+        try:
+            with self.__engine.connect() as conn:
+                row = conn.execute(
+                    text(f"SELECT item_id FROM {table_name} WHERE search = :search"),
+                    {"search": search}).first()
+        except (ProgrammingError, OperationalError):
+            # The table has not been created yet
+            return None
+        return None if row is None else row[0]
+
+    def set_high_water(self,
+            table_name: str,
+            search: str,
+            item_id: str) -> bool:
+        """
+        Sets the high-water mark of a search, creating the table if needed
+
+        Parameters
+        ----------
+        table_name: str
+            The high-water mark table name e.g. search_high_water
+        search: str
+            The search
+        item_id: str
+            The newest item listed by the search
+
+        Returns
+        -------
+            True if successful
+        """
+        with self.__engine.begin() as conn:
+            conn.execute(text(
+                f"""CREATE TABLE IF NOT EXISTS {table_name} (
+                    search TEXT PRIMARY KEY,
+                    item_id TEXT NOT NULL,
+                    updated_time DOUBLE PRECISION NOT NULL)"""))
+            conn.execute(text(
+                f"""INSERT INTO {table_name} (search, item_id, updated_time)
+                    VALUES (:search, :item_id, :updated_time)
+                    ON CONFLICT (search) DO UPDATE
+                    SET item_id = EXCLUDED.item_id, updated_time = EXCLUDED.updated_time"""),
+                {"search": search, "item_id": item_id, "updated_time": time.time()})
+        return True
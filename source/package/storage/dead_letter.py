@@ -0,0 +1,123 @@
+import os
+import sqlite3
+import threading
+import time
+from ..utils import metrics
+
+
+class DeadLetters:
+    """
+    A record of the items (recipe URLs) the pipeline gave up on, with the
+    stage which failed (scrape or store), the last error and the number of
+    times each has failed, so they can be inspected and fed to a later run.
+    An item recorded again (failing in another run) has its attempts
+    counted up; an item scraped and stored by a later run is removed.
+    The file may be shared by several processes (e.g. pipeline workers)
+
+    Attributes
+    ----------
+    path : str
+        Path of the local SQLite file holding the records
+    """
+
+    def __init__(self, path: str):
+        """
+        Opens (or creates) the dead letter records at `path`
+
+        Parameters
+        ----------
+        path : str
+            Path of the local SQLite file holding the records
+        """
+        self.path = path
+        folder = os.path.dirname(path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        self.__lock = threading.Lock()
+        self.__conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.__conn.row_factory = sqlite3.Row
+        self.__conn.execute("PRAGMA journal_mode=WAL")
+        with self.__conn:
+            self.__conn.execute(
+                """CREATE TABLE IF NOT EXISTS dead_letters (
+                    search TEXT NOT NULL,
+                    url TEXT NOT NULL,
+                    stage TEXT NOT NULL,
+                    error_type TEXT NOT NULL,
+                    error TEXT,
+                    attempts INTEGER NOT NULL,
+                    failed_time REAL NOT NULL,
+                    PRIMARY KEY (search, url))""")
+
+    def record(self,
+            search: str,
+            urls: list,
+            stage: str,
+            error: BaseException):
+        """Records items as permanently failed
+
+        Parameters
+        ----------
+        search : str
+            The search the items were listed by
+        urls : list
+            The URLs of the items
+        stage : str
+            The stage which failed e.g. scrape or store
+        error : BaseException
+            The error raised
+        """
+        if len(urls) == 0:
+            return
+        with self.__lock, self.__conn:
+            self.__conn.executemany(
+                """INSERT INTO dead_letters VALUES (?, ?, ?, ?, ?, 1, ?)
+                    ON CONFLICT (search, url) DO UPDATE SET
+                        stage = excluded.stage, error_type = excluded.error_type,
+                        error = excluded.error, attempts = attempts + 1,
+                        failed_time = excluded.failed_time""",
+                [(search, url, stage, type(error).__name__, str(error), time.time())
+                    for url in urls])
+        metrics.DEAD_LETTERS.labels(stage).inc(len(urls))
+
+    def remove(self, search: str, urls: list):
+        """Removes the records of items which have since been stored
+
+        Parameters
+        ----------
+        search : str
+            The search
+        urls : list
+            The URLs of the items
+        """
+        with self.__lock, self.__conn:
+            self.__conn.executemany(
+                "DELETE FROM dead_letters WHERE search = ? AND url = ?",
+                [(search, url) for url in urls])
+
+    def items(self, search: str = None) -> list[dict]:
+        """Returns the recorded items
+
+        Parameters
+        ----------
+        search : str, optional
+            Only the items of this search, by default every search
+
+        Returns
+        -------
+        list[dict]
+            The items (search, url, stage, error_type, error, attempts,
+            failed_time), oldest first
+        """
+        query = "SELECT * FROM dead_letters"
+        params = ()
+        if search is not None:
+            query += " WHERE search = ?"
+            params = (search,)
+        with self.__lock:
+            return [dict(row) for row in self.__conn.execute(f"{query} ORDER BY failed_time", params)]
+
+    def close(self):
+        """Closes the file"""
+        with self.__lock:
+            self.__conn.close()
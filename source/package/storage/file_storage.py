@@ -1,12 +1,20 @@
+import hashlib
 import json
 from logging import root
-from ..utils.utilities import UUIDEncoder
 import os
-from urllib import request
+import re
+from typing import Iterator
 from .storage import Storage
+from .manifest import Manifest
 from ..utils.logger import log_class
+from ..utils import http_archive
+from ..utils import rate_limit
+from ..utils import tracing
 import logging
 
+# Name of a shard directory (two hex characters of the file name hash)
+SHARD_PATTERN = re.compile("[0-9a-f]{2}")
+
 @log_class
 class FileStorage(Storage):
     """
@@ -20,6 +28,11 @@ class FileStorage(Storage):
         The folder where json files are stored
     images_folder :
         The folder where images are stored
+    manifest : Manifest
+        Optional manifest indexing the records in saved json files
+    shard_depth : int
+        Number of levels of hash prefix directories files are saved
+        under within a folder (0 for a flat layout)
 
     """
     # Create a logger for the Locator class
@@ -30,7 +43,9 @@ class FileStorage(Storage):
     def __init__(self,
             root_folder: str,
             data_folder: str,
-            images_folder: str):
+            images_folder: str,
+            manifest: Manifest = None,
+            shard_depth: int = 0):
         """
         Creates an instance of the FileStorage class
 
@@ -42,10 +57,18 @@ class FileStorage(Storage):
             Name of the data folder to create on initialisation
         images_folder : str
             Name of the image folder to create on initialisation
+        manifest : Manifest, optional
+            Manifest to record saved records in, by default None
+        shard_depth : int, optional
+            Number of levels of hash prefix directories to save files under
+            e.g. 2 saves `images/panda.jpg` as `images/3f/a1/panda.jpg`,
+            by default 0 (a flat layout)
         """
         self.root_folder = root_folder
         self.data_folder = data_folder
         self.images_folder = images_folder
+        self.manifest = manifest
+        self.shard_depth = shard_depth
         self.__create_folder(root_folder)
         self.__create_folder(data_folder)
         self.__create_folder(images_folder)
@@ -64,12 +87,62 @@ class FileStorage(Storage):
         if not os.path.exists(folder):
             os.mkdir(folder)
     
+    def resolve_path(self,
+            folder: str,
+            file: str) -> str:
+        """
+        Returns the path a file is saved to within a folder,
+        including any shard directories
+
+        Parameters
+        ----------
+        folder: str
+            The folder the file belongs to
+        file : str
+            The name of the file (including extension)
+
+        Returns
+        -------
+        str
+            The full path of the file
+        """
+        if self.shard_depth == 0:
+            return f"{folder}/{file}"
+        digest = hashlib.md5(file.encode("utf-8")).hexdigest()
+        shards = "/".join(digest[2 * level:2 * level + 2] for level in range(self.shard_depth))
+        return f"{folder}/{shards}/{file}"
+
+    def __prepare_path(self,
+            folder: str,
+            file: str) -> str:
+        """
+        Resolves the path for a file to be saved and creates its shard directories
+
+        Parameters
+        ----------
+        folder: str
+            The folder the file belongs to
+        file : str
+            The name of the file (including extension)
+
+        Returns
+        -------
+        str
+            The full path of the file
+        """
+        path = self.resolve_path(folder, file)
+        if self.shard_depth > 0:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
     def list_files(self,
             folder: str,
-            file_type: str = None) -> list:
+            file_type: str = None) -> Iterator[str]:
         """
-        Lists all files in a given folder (filtered optionally by file type)
-        
+        Lists all files in a given folder (filtered optionally by file type),
+        including files in shard directories.
+        Files are yielded as the folder is scanned rather than collected in a list
+
         Parameters
         ----------
         folder: str
@@ -77,26 +150,50 @@ class FileStorage(Storage):
         file_type : str, optional
             A valid file type extension, by default None
 
-        Returns
-        -------
-        list:
-            A list of file names (full paths) in the folder
-        """
-        files = []
-        for path in os.listdir(folder):
-            # get the full path
-            full_path = os.path.join(folder, path)
-            # exclude directories
-            if os.path.isfile(full_path):
-                if file_type is None or file_type == full_path.rsplit('.', 1)[-1]:
-                    files.append(full_path)
-        return files
+        Yields
+        ------
+        str:
+            The file names (full paths) in the folder
+        """
+        suffix = None if file_type is None else f".{file_type}"
+        yield from self.__scan_folder(folder, suffix, self.shard_depth)
+
+    def __scan_folder(self,
+            folder: str,
+            suffix: str,
+            depth: int) -> Iterator[str]:
+        """
+        Scans a folder (and its shard directories up to `depth` levels)
+
+        Parameters
+        ----------
+        folder: str
+            The folder to scan
+        suffix : str
+            File name suffix to filter on, or None for all files
+        depth : int
+            Number of levels of shard directories below `folder`
+
+        Yields
+        ------
+        str:
+            The file names (full paths) in the folder
+        """
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                # DirEntry caches the file type, so no extra stat per file
+                if entry.is_file():
+                    if suffix is None or entry.name.endswith(suffix):
+                        yield entry.path
+                elif depth > 0 and entry.is_dir() and SHARD_PATTERN.fullmatch(entry.name):
+                    yield from self.__scan_folder(entry.path, suffix, depth - 1)
 
     def save_json_file(self,
             dict_to_save: dict,
             folder: str,
             file: str):
-        """Saves a dictionary to json file
+        """Saves a dictionary (or list of dictionaries) to json file
+        Records with an item_id are added to the manifest, if there is one
 
         Parameters
         ----------
@@ -107,13 +204,12 @@ class FileStorage(Storage):
         file : str
             The name of the file
         """
-        # Open a file to write to and save json string to the file
-        with open(f"{folder}/{file}.json", "w") as outfile:
-            json.dump(
-                dict_to_save,
-                outfile,
-                cls=UUIDEncoder,
-                indent=4)
+        path = self.__prepare_path(folder, f"{file}.json")
+        body, spans = self._encode_json(dict_to_save)
+        # Open a file to write to and save json bytes to the file
+        with open(path, "wb") as outfile:
+            outfile.write(body)
+        self._record_spans(path, spans)
 
     def save_image(self,
             url: str,
@@ -132,7 +228,16 @@ class FileStorage(Storage):
             The name of the file to save as
         """
         # Download the file from `url` and save it locally under `file_name`:
-        request.urlretrieve(url, f"{folder}/{file}")
+        with tracing.span("image_download", "storage", url=url):
+            if http_archive.active():
+                # Recorded to / replayed from the HTTP archive
+                with open(self.__prepare_path(folder, file), "wb") as f:
+                    f.write(http_archive.fetch(url))
+            else:
+                from urllib import request
+                # Shares the host's limits with the page loads
+                with rate_limit.request(url):
+                    request.urlretrieve(url, self.__prepare_path(folder, file))
     
     def read_json_file(self,
             file: str) -> str:
@@ -151,4 +256,102 @@ class FileStorage(Storage):
         """
         # Open a file for reading and load json into str
         with open(f"{file}", "r") as jsonfile: 
-            return json.load(jsonfile)
\ No newline at end of file
+            return json.load(jsonfile)
+
+    def read_range(self,
+            file: str,
+            offset: int,
+            length: int = None) -> bytes:
+        """
+        Reads a range of bytes from a file
+
+        Parameters
+        ----------
+        file : str
+            The name of the file to be read (full path)
+        offset : int
+            Offset of the first byte to read
+        length : int, optional
+            Number of bytes to read, by default to the end of the file
+
+        Returns
+        -------
+        bytes
+            The bytes read from the file
+        """
+        with open(file, "rb") as infile:
+            infile.seek(offset)
+            return infile.read(-1 if length is None else length)
+
+    def save_bytes(self,
+            data: bytes,
+            folder: str,
+            file: str):
+        """
+        Saves bytes to a file. The file is written under a temporary name
+        and renamed so it never appears partially written
+
+        Parameters
+        ----------
+        data : bytes
+            The bytes to save
+        folder : str
+            The folder where the file will be saved
+        file : str
+            The name of the file (including extension)
+        """
+        self.__create_folder(folder)
+        path = self.__prepare_path(folder, file)
+        with open(f"{path}.tmp", "wb") as outfile:
+            outfile.write(data)
+        os.replace(f"{path}.tmp", path)
+
+    def delete_file(self,
+            file: str):
+        """
+        Deletes a file if it exists
+
+        Parameters
+        ----------
+        file : str
+            The name of the file to be deleted (full path)
+        """
+        if os.path.exists(file):
+            os.remove(file)
+
+    def file_exists(self,
+            folder: str,
+            file: str) -> bool:
+        """
+        Checks whether a file has been saved to a folder
+
+        Parameters
+        ----------
+        folder: str
+            The folder the file belongs to
+        file : str
+            The name of the file (including extension)
+
+        Returns
+        -------
+        bool
+            True if the file exists
+        """
+        return os.path.exists(self.resolve_path(folder, file))
+
+    def modified_time(self,
+            file: str) -> float:
+        """
+        Returns the time a file was last written
+
+        Parameters
+        ----------
+        file : str
+            The name of the file (full path)
+
+        Returns
+        -------
+        float
+            Epoch time the file was last modified
+        """
+        return os.path.getmtime(file)
@@ -0,0 +1,340 @@
+import os
+import sqlite3
+import threading
+import time
+
+# Item states
+PENDING = "pending"
+IN_PROGRESS = "in_progress"
+DONE = "done"
+FAILED = "failed"
+
+
+class Frontier:
+    """
+    The persistent state of a crawl, per search: the number of results
+    pages, the results pages visited and the recipe URLs found on them,
+    each pending, in progress, done (stored, or nothing to store) or
+    failed, so a run which stopped part way can be resumed.
+    Item state changes are held in memory and written (checkpointed) in
+    one transaction every `checkpoint_every` changes and whenever
+    `checkpoint` is called, so a crash loses at most the changes since the
+    last checkpoint; items which lose their done state are scraped again
+    and skipped by the database check.
+    The file may be shared by several processes (e.g. pipeline workers)
+
+    Attributes
+    ----------
+    path : str
+        Path of the local SQLite file holding the frontier
+    """
+
+    def __init__(self, path: str, checkpoint_every: int = 50):
+        """
+        Opens (or creates) a frontier at `path`
+
+        Parameters
+        ----------
+        path : str
+            Path of the local SQLite file holding the frontier
+        checkpoint_every : int, optional
+            Changes between automatic checkpoints, by default 50
+        """
+        self.path = path
+        folder = os.path.dirname(path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        self.__checkpoint_every = checkpoint_every
+        # State changes waiting for the next checkpoint
+        self.__changes = []
+        self.__lock = threading.Lock()
+        # Wait for other processes' checkpoints rather than failing
+        self.__conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.__conn.row_factory = sqlite3.Row
+        self.__conn.execute("PRAGMA journal_mode=WAL")
+        with self.__conn:
+            self.__conn.execute(
+                """CREATE TABLE IF NOT EXISTS searches (
+                    search TEXT PRIMARY KEY,
+                    results_pages INTEGER NOT NULL,
+                    started_time REAL NOT NULL)""")
+            self.__conn.execute(
+                """CREATE TABLE IF NOT EXISTS pages (
+                    search TEXT NOT NULL,
+                    page_num INTEGER NOT NULL,
+                    done INTEGER NOT NULL DEFAULT 0,
+                    visited_time REAL NOT NULL,
+                    PRIMARY KEY (search, page_num))""")
+            self.__conn.execute(
+                """CREATE TABLE IF NOT EXISTS items (
+                    search TEXT NOT NULL,
+                    item_id TEXT NOT NULL,
+                    url TEXT NOT NULL,
+                    page_num INTEGER NOT NULL,
+                    seq INTEGER NOT NULL,
+                    state TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    updated_time REAL NOT NULL,
+                    PRIMARY KEY (search, item_id))""")
+            self.__conn.execute(
+                "CREATE INDEX IF NOT EXISTS ix_items_page ON items (search, page_num, seq)")
+
+    def reset(self, search: str):
+        """Forgets the state of a search, to crawl it from the start
+
+        Parameters
+        ----------
+        search : str
+            The search
+        """
+        with self.__lock, self.__conn:
+            for table in ["searches", "pages", "items"]:
+                self.__conn.execute(f"DELETE FROM {table} WHERE search = ?", (search,))
+            self.__changes = [change for change in self.__changes if change[4] != search]
+
+    def begin(self, search: str, results_pages: int) -> int:
+        """Records the number of results pages of a search, unless
+        resuming a crawl which already recorded it
+
+        Parameters
+        ----------
+        search : str
+            The search
+        results_pages : int
+            The number of results pages found by the search
+
+        Returns
+        -------
+        int
+            The number of results pages to crawl, as first recorded
+        """
+        with self.__lock, self.__conn:
+            self.__conn.execute(
+                "INSERT OR IGNORE INTO searches VALUES (?, ?, ?)",
+                (search, results_pages, time.time()))
+            return self.__conn.execute(
+                "SELECT results_pages FROM searches WHERE search = ?",
+                (search,)).fetchone()[0]
+
+    def page_visited(self, search: str, page_num: int) -> bool:
+        """Checks if the URLs of a results page have been recorded
+
+        Parameters
+        ----------
+        search : str
+            The search
+        page_num : int
+            The results page number
+
+        Returns
+        -------
+        bool
+            True if the page was visited
+        """
+        with self.__lock:
+            return self.__conn.execute(
+                "SELECT 1 FROM pages WHERE search = ? AND page_num = ?",
+                (search, page_num)).fetchone() is not None
+
+    def page_done(self, search: str, page_num: int) -> bool:
+        """Checks if every item of a results page has been processed and stored
+
+        Parameters
+        ----------
+        search : str
+            The search
+        page_num : int
+            The results page number
+
+        Returns
+        -------
+        bool
+            True if the page is done
+        """
+        with self.__lock:
+            return self.__conn.execute(
+                "SELECT 1 FROM pages WHERE search = ? AND page_num = ? AND done = 1",
+                (search, page_num)).fetchone() is not None
+
+    def add_page(self, search: str, page_num: int, urls: list):
+        """Records a visited results page and the recipe URLs found on it
+        as pending; URLs already recorded (e.g. on an earlier page) keep
+        their state. Checkpoints, so the page is not fetched again
+
+        Parameters
+        ----------
+        search : str
+            The search
+        page_num : int
+            The results page number
+        urls : list
+            The recipe URLs listed on the page
+        """
+        now = time.time()
+        with self.__lock, self.__conn:
+            self.__conn.executemany(
+                """INSERT OR IGNORE INTO items
+                    (search, item_id, url, page_num, seq, state, updated_time)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                ((search, _item_id(url), url, page_num, seq, PENDING, now)
+                for seq, url in enumerate(urls)))
+            self.__conn.execute(
+                "INSERT OR IGNORE INTO pages (search, page_num, visited_time) VALUES (?, ?, ?)",
+                (search, page_num, now))
+
+    def remaining(self, search: str, page_num: int) -> list:
+        """Returns the URLs of a visited results page which are not done:
+        pending, failed, or in progress when the run stopped
+
+        Parameters
+        ----------
+        search : str
+            The search
+        page_num : int
+            The results page number
+
+        Returns
+        -------
+        list
+            The URLs, in the order listed on the page
+        """
+        with self.__lock:
+            self.__commit()
+            return [row["url"] for row in self.__conn.execute(
+                """SELECT url FROM items WHERE search = ? AND page_num = ? AND state != ?
+                    ORDER BY seq""",
+                (search, page_num, DONE))]
+
+    def first_item(self, search: str, page_num: int) -> str:
+        """Returns the ID of the first recipe listed on a visited results
+        page, whatever the state of its items
+
+        Parameters
+        ----------
+        search : str
+            The search
+        page_num : int
+            The results page number
+
+        Returns
+        -------
+        str
+            The item ID, or None if the page has not been visited (or listed nothing)
+        """
+        with self.__lock:
+            row = self.__conn.execute(
+                """SELECT item_id FROM items WHERE search = ? AND page_num = ?
+                    ORDER BY seq LIMIT 1""",
+                (search, page_num)).fetchone()
+        return None if row is None else row["item_id"]
+
+    def mark(self, search: str, urls: list, state: str, error: str = None):
+        """Sets the state of items; checkpoints every `checkpoint_every` changes
+
+        Parameters
+        ----------
+        search : str
+            The search
+        urls : list
+            The recipe URLs
+        state : str
+            PENDING, IN_PROGRESS, DONE or FAILED
+        error : str, optional
+            The reason a failed item failed, by default None
+        """
+        if state not in (PENDING, IN_PROGRESS, DONE, FAILED):
+            raise ValueError(f"Unknown frontier state: {state}")
+        now = time.time()
+        with self.__lock:
+            self.__changes.extend(
+                (state, error, now, int(state == IN_PROGRESS), search, _item_id(url))
+                for url in urls)
+            if len(self.__changes) >= self.__checkpoint_every:
+                self.__commit()
+
+    def finish_page(self, search: str, page_num: int):
+        """Marks a results page done if all its items are done, and checkpoints
+
+        Parameters
+        ----------
+        search : str
+            The search
+        page_num : int
+            The results page number
+        """
+        with self.__lock:
+            self.__commit()
+            self.__conn.execute(
+                """UPDATE pages SET done = 1 WHERE search = ? AND page_num = ?
+                    AND NOT EXISTS (SELECT 1 FROM items
+                        WHERE search = pages.search AND page_num = pages.page_num AND state != ?)""",
+                (search, page_num, DONE))
+            self.__conn.commit()
+
+    def counts(self, search: str) -> dict:
+        """Returns the number of items of a search in each state
+
+        Parameters
+        ----------
+        search : str
+            The search
+
+        Returns
+        -------
+        dict
+            Counts keyed by state
+        """
+        with self.__lock:
+            self.__commit()
+            return {row["state"]: row["count"] for row in self.__conn.execute(
+                "SELECT state, COUNT(*) AS count FROM items WHERE search = ? GROUP BY state",
+                (search,))}
+
+    def failed(self, search: str) -> list[dict]:
+        """Returns the failed items of a search
+
+        Parameters
+        ----------
+        search : str
+            The search
+
+        Returns
+        -------
+        list[dict]
+            The items (url, page_num, attempts, error), by results page
+        """
+        with self.__lock:
+            self.__commit()
+            return [dict(row) for row in self.__conn.execute(
+                """SELECT url, page_num, attempts, error FROM items
+                    WHERE search = ? AND state = ? ORDER BY page_num, seq""",
+                (search, FAILED))]
+
+    def checkpoint(self):
+        """Commits the changes made since the last checkpoint"""
+        with self.__lock:
+            self.__commit()
+
+    def __commit(self):
+        """Writes the waiting state changes in one transaction (called holding the lock)"""
+        if len(self.__changes) == 0:
+            return
+        with self.__conn:
+            self.__conn.executemany(
+                """UPDATE items SET state = ?, error = ?, updated_time = ?,
+                    attempts = attempts + ?
+                    WHERE search = ? AND item_id = ?""",
+                self.__changes)
+        self.__changes = []
+
+    def close(self):
+        """Checkpoints and closes the connection to the frontier file"""
+        with self.__lock:
+            self.__commit()
+            self.__conn.close()
+
+
+def _item_id(url: str) -> str:
+    """Returns the item ID of a recipe URL (the last part)"""
+    return url.rsplit('/', 1)[-1]
@@ -0,0 +1,386 @@
+from sqlalchemy import bindparam, create_engine, text
+from ..utils.logger import log_class
+import logging
+
+# Job kinds, claimed in this order so recipes found are scraped
+# before more results pages are read
+RECIPE = "recipe"
+RESULTS_PAGE = "results_page"
+_PRIORITY = {RECIPE: 0, RESULTS_PAGE: 1}
+
+# Job states
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+# The database's clock in epoch seconds, so leases do not depend
+# on the clocks of the worker machines
+_NOW = {
+    "postgresql": "EXTRACT(EPOCH FROM clock_timestamp())",
+    "sqlite": "((julianday('now') - 2440587.5) * 86400.0)"
+}
+
+
+@log_class
+class JobQueue:
+    # Create a logger for the JobQueue class
+    # Will be accessed by class decorator
+    # which decorates each method with logging functionality
+    logger = logging.getLogger(__name__)
+    """
+    A queue of crawl jobs (results pages and recipe URLs of a search) in
+    a database table shared by several workers, e.g. dcp_aws.py containers
+    on different instances.
+    Workers claim batches of jobs with `SELECT ... FOR UPDATE SKIP LOCKED`
+    (so no two workers claim the same job) and hold them on a lease;
+    jobs whose lease expires (the worker died or hung) are re-queued, and
+    jobs which fail or lose their lease `max_attempts` times are marked failed.
+    A job is only queued once per run of a search, so workers given the
+    same search share the work rather than repeating it. A run ends when
+    none of its jobs are pending or leased; the next worker to `begin` the
+    search (e.g. the next scheduled crawl) clears them and starts a new run.
+    Postgres is the intended database; SQLite (which allows one writer at
+    a time, so needs no row locks) can stand in for tests
+    """
+    def __init__(self,
+            db_conn: str,
+            lease_seconds: float = 300,
+            max_attempts: int = 3,
+            table_name: str = "crawl_jobs"):
+        """
+        Creates an instance of the class JobQueue, creating the table if needed
+
+        Parameters
+        ----------
+        db_conn : str
+            A valid database connection string
+        lease_seconds : float, optional
+            Seconds a claimed job is held before it can be claimed again, by default 300
+        max_attempts : int, optional
+            Claims of a job before it is marked failed, by default 3
+        table_name : str, optional
+            The table holding the jobs, by default crawl_jobs
+        """
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.__table = table_name
+        self.__engine = create_engine(db_conn)
+        if self.__engine.dialect.name not in _NOW:
+            raise RuntimeError(f"The job queue does not support {self.__engine.dialect.name} databases")
+        self.__now = _NOW[self.__engine.dialect.name]
+        self.__lock_rows = " FOR UPDATE SKIP LOCKED" if self.__engine.dialect.name == "postgresql" else ""
+        with self.__engine.begin() as conn:
+            conn.execute(text(
+                f"""CREATE TABLE IF NOT EXISTS {self.__table} (
+                    search TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    job_key TEXT NOT NULL,
+                    priority INTEGER NOT NULL,
+                    state TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    lease_owner TEXT,
+                    lease_expires DOUBLE PRECISION,
+                    error TEXT,
+                    updated_time DOUBLE PRECISION NOT NULL,
+                    PRIMARY KEY (search, kind, job_key))"""))
+            conn.execute(text(
+                f"""CREATE INDEX IF NOT EXISTS ix_{self.__table}_claim
+                    ON {self.__table} (search, state, priority, updated_time)"""))
+
+    def begin(self, search: str) -> bool:
+        """Starts a new run of a search if the last run has finished
+        (every job is done or failed), clearing its jobs so they are
+        queued again; a run still in progress is joined
+
+        Parameters
+        ----------
+        search : str
+            The search
+
+        Returns
+        -------
+        bool
+            True if the jobs of a finished run were cleared
+        """
+        with self.__engine.begin() as conn:
+            cleared = conn.execute(text(
+                f"""DELETE FROM {self.__table}
+                    WHERE search = :search AND NOT EXISTS (
+                        SELECT 1 FROM {self.__table}
+                        WHERE search = :search AND state IN ('{PENDING}', '{LEASED}'))"""),
+                {"search": search}).rowcount
+        if cleared > 0:
+            self.logger.info(f"Cleared {cleared} jobs of the last run to start a new run",
+                extra={"stage": "queue", "search": search})
+        return cleared > 0
+
+    def enqueue(self,
+            search: str,
+            kind: str,
+            keys: list) -> int:
+        """Queues jobs as pending, ignoring any already queued for the search
+
+        Parameters
+        ----------
+        search : str
+            The search
+        kind : str
+            RESULTS_PAGE (the key is the page number) or RECIPE (the key is the URL)
+        keys : list
+            The job keys
+
+        Returns
+        -------
+        int
+            The number of jobs queued (0 if the database driver does not report it)
+        """
+        if kind not in _PRIORITY:
+            raise ValueError(f"Unknown job kind: {kind}")
+        if len(keys) == 0:
+            return 0
+        with self.__engine.begin() as conn:
+            result = conn.execute(text(
+                f"""INSERT INTO {self.__table}
+                    (search, kind, job_key, priority, state, updated_time)
+                    VALUES (:search, :kind, :key, :priority, '{PENDING}', {self.__now})
+                    ON CONFLICT DO NOTHING"""),
+                [{"search": search, "kind": kind, "key": str(key), "priority": _PRIORITY[kind]}
+                    for key in keys])
+            return max(result.rowcount, 0)
+
+    def claim(self,
+            search: str,
+            owner: str,
+            limit: int = 10) -> list[dict]:
+        """Leases up to `limit` pending jobs of a search to a worker,
+        first re-queuing jobs whose lease has expired
+
+        Parameters
+        ----------
+        search : str
+            The search
+        owner : str
+            The worker ID e.g. host name and process ID
+        limit : int, optional
+            The most jobs to claim, by default 10
+
+        Returns
+        -------
+        list[dict]
+            The jobs (kind, key, attempts), recipes first
+        """
+        with self.__engine.begin() as conn:
+            lost = conn.execute(text(
+                f"""UPDATE {self.__table}
+                    SET state = CASE WHEN attempts >= :max_attempts THEN '{FAILED}' ELSE '{PENDING}' END,
+                        error = 'Lease expired (held by ' || lease_owner || ')',
+                        lease_owner = NULL, lease_expires = NULL, updated_time = {self.__now}
+                    WHERE search = :search AND state = '{LEASED}' AND lease_expires < {self.__now}"""),
+                {"search": search, "max_attempts": self.max_attempts}).rowcount
+            if lost > 0:
+                self.logger.warning(f"Re-queued {lost} jobs with expired leases",
+                    extra={"stage": "queue", "search": search})
+            rows = conn.execute(text(
+                f"""UPDATE {self.__table}
+                    SET state = '{LEASED}', lease_owner = :owner,
+                        lease_expires = {self.__now} + :lease_seconds,
+                        attempts = attempts + 1, updated_time = {self.__now}
+                    WHERE (search, kind, job_key) IN (
+                        SELECT search, kind, job_key FROM {self.__table}
+                        WHERE search = :search AND state = '{PENDING}'
+                        ORDER BY priority, updated_time
+                        LIMIT :limit{self.__lock_rows})
+                    RETURNING kind, job_key, attempts"""),
+                {"search": search, "owner": owner, "lease_seconds": self.lease_seconds,
+                    "limit": limit}).fetchall()
+        jobs = [{"kind": row[0], "key": row[1], "attempts": row[2]} for row in rows]
+        return sorted(jobs, key=lambda job: _PRIORITY[job["kind"]])
+
+    def renew(self,
+            search: str,
+            jobs: list[dict],
+            owner: str) -> int:
+        """Extends the lease on jobs still held by a worker
+
+        Parameters
+        ----------
+        search : str
+            The search
+        jobs : list[dict]
+            Jobs returned by `claim`
+        owner : str
+            The worker ID
+
+        Returns
+        -------
+        int
+            The number of leases extended
+        """
+        return self.__update(
+            search, jobs, owner,
+            f"state = '{LEASED}', lease_expires = {self.__now} + :lease_seconds",
+            lease_seconds=self.lease_seconds)
+
+    def complete(self,
+            search: str,
+            jobs: list[dict],
+            owner: str) -> int:
+        """Marks jobs held by a worker done
+
+        Parameters
+        ----------
+        search : str
+            The search
+        jobs : list[dict]
+            Jobs returned by `claim`
+        owner : str
+            The worker ID
+
+        Returns
+        -------
+        int
+            The number of jobs marked done; fewer than `jobs` if a lease was lost
+        """
+        return self.__update(
+            search, jobs, owner,
+            f"state = '{DONE}', error = NULL, lease_owner = NULL, lease_expires = NULL")
+
+    def fail(self,
+            search: str,
+            jobs: list[dict],
+            owner: str,
+            error: str) -> int:
+        """Returns jobs held by a worker to the queue after an error,
+        or marks them failed once they have been tried `max_attempts` times
+
+        Parameters
+        ----------
+        search : str
+            The search
+        jobs : list[dict]
+            Jobs returned by `claim`
+        owner : str
+            The worker ID
+        error : str
+            The reason the jobs failed
+
+        Returns
+        -------
+        int
+            The number of jobs updated
+        """
+        return self.__update(
+            search, jobs, owner,
+            f"""state = CASE WHEN attempts >= :max_attempts THEN '{FAILED}' ELSE '{PENDING}' END,
+                error = :error, lease_owner = NULL, lease_expires = NULL""",
+            max_attempts=self.max_attempts, error=error)
+
+    def outstanding(self, search: str) -> int:
+        """Returns the number of pending and leased jobs of a search
+
+        Parameters
+        ----------
+        search : str
+            The search
+
+        Returns
+        -------
+        int
+            Jobs not yet done or failed
+        """
+        counts = self.counts(search)
+        return counts.get(PENDING, 0) + counts.get(LEASED, 0)
+
+    def counts(self, search: str) -> dict:
+        """Returns the number of jobs of a search in each state
+
+        Parameters
+        ----------
+        search : str
+            The search
+
+        Returns
+        -------
+        dict
+            Counts keyed by state
+        """
+        with self.__engine.connect() as conn:
+            return {row[0]: row[1] for row in conn.execute(text(
+                f"SELECT state, COUNT(*) FROM {self.__table} WHERE search = :search GROUP BY state"),
+                {"search": search})}
+
+    def failed(self, search: str) -> list[dict]:
+        """Returns the failed jobs of a search
+
+        Parameters
+        ----------
+        search : str
+            The search
+
+        Returns
+        -------
+        list[dict]
+            The jobs (kind, key, attempts, error)
+        """
+        with self.__engine.connect() as conn:
+            return [{"kind": row[0], "key": row[1], "attempts": row[2], "error": row[3]}
+                for row in conn.execute(text(
+                    f"""SELECT kind, job_key, attempts, error FROM {self.__table}
+                        WHERE search = :search AND state = '{FAILED}'
+                        ORDER BY priority, job_key"""),
+                    {"search": search})]
+
+    def reset(self, search: str):
+        """Removes every job of a search, so it can be crawled again from the start
+
+        Parameters
+        ----------
+        search : str
+            The search
+        """
+        with self.__engine.begin() as conn:
+            conn.execute(text(f"DELETE FROM {self.__table} WHERE search = :search"),
+                {"search": search})
+
+    def __update(self,
+            search: str,
+            jobs: list[dict],
+            owner: str,
+            assignments: str,
+            **params) -> int:
+        """Updates jobs leased to a worker, with one statement per kind of job
+
+        Parameters
+        ----------
+        search : str
+            The search
+        jobs : list[dict]
+            Jobs returned by `claim`
+        owner : str
+            The worker ID
+        assignments : str
+            The SET clause
+        **params
+            Parameters of the SET clause
+
+        Returns
+        -------
+        int
+            The number of jobs updated
+        """
+        keys = {}
+        for job in jobs:
+            keys.setdefault(job["kind"], []).append(job["key"])
+        statement = text(
+            f"""UPDATE {self.__table} SET {assignments}, updated_time = {self.__now}
+                WHERE search = :search AND kind = :kind AND job_key IN :keys
+                AND state = '{LEASED}' AND lease_owner = :owner""").bindparams(
+            bindparam("keys", expanding=True))
+        updated = 0
+        with self.__engine.begin() as conn:
+            for kind, kind_keys in keys.items():
+                updated += conn.execute(statement,
+                    {"search": search, "kind": kind, "keys": kind_keys,
+                        "owner": owner, **params}).rowcount
+        return updated
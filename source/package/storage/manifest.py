@@ -0,0 +1,301 @@
+import os
+import sqlite3
+import threading
+import time
+
+
+class Manifest:
+    """
+    An append-only index of the records held in raw storage.
+    Each entry maps an item_id to the object (file or S3 key) it was
+    written to, the byte range of the record within that object,
+    a hash of the record content and the time it was saved.
+    The latest entry for an item_id wins, so re-scraped items
+    simply append a new entry (entries merged from other writers may
+    arrive out of order, so the latest is the one saved last, not the
+    one appended last). Objects replaced by compaction are
+    recorded as tombstones.
+
+    Attributes
+    ----------
+    path : str
+        Path of the local SQLite file holding the manifest
+    """
+
+    def __init__(self, path: str):
+        """
+        Opens (or creates) a manifest at `path`
+
+        Parameters
+        ----------
+        path : str
+            Path of the local SQLite file holding the manifest
+        """
+        self.path = path
+        folder = os.path.dirname(path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        self.__lock = threading.Lock()
+        self.__conn = sqlite3.connect(path, check_same_thread=False)
+        self.__conn.row_factory = sqlite3.Row
+        with self.__conn:
+            self.__conn.execute(
+                """CREATE TABLE IF NOT EXISTS manifest (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    item_id TEXT NOT NULL,
+                    object_key TEXT NOT NULL,
+                    byte_offset INTEGER NOT NULL,
+                    byte_length INTEGER NOT NULL,
+                    content_hash TEXT NOT NULL,
+                    scrape_time REAL NOT NULL)""")
+            self.__conn.execute(
+                "CREATE INDEX IF NOT EXISTS ix_manifest_item ON manifest (item_id, seq)")
+            self.__conn.execute(
+                "CREATE INDEX IF NOT EXISTS ix_manifest_time ON manifest (scrape_time)")
+            self.__conn.execute(
+                "CREATE INDEX IF NOT EXISTS ix_manifest_item_time ON manifest (item_id, scrape_time)")
+            self.__conn.execute(
+                """CREATE TABLE IF NOT EXISTS tombstones (
+                    object_key TEXT PRIMARY KEY,
+                    replaced_time REAL NOT NULL)""")
+
+    def record(self,
+            item_id: str,
+            object_key: str,
+            byte_offset: int,
+            byte_length: int,
+            content_hash: str,
+            scrape_time: float = None):
+        """Appends a single entry to the manifest
+
+        Parameters
+        ----------
+        item_id : str
+            The unique ID of the item
+        object_key : str
+            The file path or object key the record was written to
+        byte_offset : int
+            Offset of the first byte of the record within the object
+        byte_length : int
+            Length of the record in bytes
+        content_hash : str
+            Hash of the record bytes
+        scrape_time : float, optional
+            Epoch time the record was saved, by default now
+        """
+        self.record_many([(item_id, object_key, byte_offset, byte_length, content_hash, scrape_time)])
+
+    def record_many(self, entries: list[tuple]):
+        """Appends several entries to the manifest in one transaction
+
+        Parameters
+        ----------
+        entries : list[tuple]
+            Tuples of (item_id, object_key, byte_offset, byte_length,
+            content_hash, scrape_time) as for `record`
+        """
+        now = time.time()
+        rows = [
+            (item_id, key, offset, length, content_hash, now if scrape_time is None else scrape_time)
+            for item_id, key, offset, length, content_hash, scrape_time in entries]
+        with self.__lock, self.__conn:
+            self.__conn.executemany(
+                """INSERT INTO manifest
+                    (item_id, object_key, byte_offset, byte_length, content_hash, scrape_time)
+                    VALUES (?, ?, ?, ?, ?, ?)""",
+                rows)
+
+    def swap(self,
+            entries: list[tuple],
+            replaced_keys: list[str]):
+        """Appends entries for records moved to new objects and tombstones
+        the objects they replace, in a single transaction
+
+        Parameters
+        ----------
+        entries : Iterable[tuple]
+            Tuples of (item_id, object_key, byte_offset, byte_length,
+            content_hash, scrape_time) as for `record`
+        replaced_keys : Iterable[str]
+            The file paths or object keys being replaced
+        """
+        now = time.time()
+        with self.__lock, self.__conn:
+            self.__conn.executemany(
+                """INSERT INTO manifest
+                    (item_id, object_key, byte_offset, byte_length, content_hash, scrape_time)
+                    VALUES (?, ?, ?, ?, ?, ?)""",
+                ((item_id, key, offset, length, content_hash, now if scrape_time is None else scrape_time)
+                for item_id, key, offset, length, content_hash, scrape_time in entries))
+            self.__conn.executemany(
+                "INSERT OR IGNORE INTO tombstones (object_key, replaced_time) VALUES (?, ?)",
+                ((key, now) for key in replaced_keys))
+
+    def is_tombstoned(self, object_key: str) -> bool:
+        """Checks if an object has been replaced by compaction
+
+        Parameters
+        ----------
+        object_key : str
+            The file path or object key
+
+        Returns
+        -------
+        bool
+            True if the object has been replaced
+        """
+        with self.__lock:
+            return self.__conn.execute(
+                "SELECT 1 FROM tombstones WHERE object_key = ?",
+                (object_key,)).fetchone() is not None
+
+    def key_time(self, object_key: str) -> float:
+        """Returns the latest time a record was saved to an object
+
+        Parameters
+        ----------
+        object_key : str
+            The file path or object key
+
+        Returns
+        -------
+        float
+            Epoch time, or None if the object is not in the manifest
+        """
+        with self.__lock:
+            return self.__conn.execute(
+                "SELECT MAX(scrape_time) FROM manifest WHERE object_key = ?",
+                (object_key,)).fetchone()[0]
+
+    def merge(self, path: str):
+        """Appends the entries of another manifest file which are not
+        already in this manifest e.g. a copy mirrored from object storage
+
+        Parameters
+        ----------
+        path : str
+            Path of the SQLite manifest file to merge in
+        """
+        with self.__lock:
+            self.__conn.execute("ATTACH DATABASE ? AS other", (path,))
+            try:
+                with self.__conn:
+                    self.__conn.execute(
+                        """INSERT INTO manifest
+                            (item_id, object_key, byte_offset, byte_length, content_hash, scrape_time)
+                            SELECT o.item_id, o.object_key, o.byte_offset, o.byte_length,
+                                o.content_hash, o.scrape_time
+                            FROM other.manifest o
+                            WHERE NOT EXISTS (
+                                SELECT 1 FROM manifest m
+                                WHERE m.item_id = o.item_id
+                                AND m.object_key = o.object_key
+                                AND m.byte_offset = o.byte_offset
+                                AND m.content_hash = o.content_hash)
+                            ORDER BY o.seq""")
+                    if self.__conn.execute(
+                            "SELECT 1 FROM other.sqlite_master WHERE name = 'tombstones'").fetchone():
+                        self.__conn.execute(
+                            "INSERT OR IGNORE INTO tombstones SELECT * FROM other.tombstones")
+            finally:
+                self.__conn.execute("DETACH DATABASE other")
+
+    def lookup(self, item_id: str) -> dict:
+        """Returns the latest (most recently saved) entry for an item
+
+        Parameters
+        ----------
+        item_id : str
+            The unique ID of the item
+
+        Returns
+        -------
+        dict
+            The manifest entry, or None if the item is not in the manifest
+        """
+        with self.__lock:
+            row = self.__conn.execute(
+                """SELECT * FROM manifest WHERE item_id = ?
+                    ORDER BY scrape_time DESC, seq DESC LIMIT 1""",
+                (item_id,)).fetchone()
+        return None if row is None else dict(row)
+
+    def since(self, scrape_time: float) -> list[dict]:
+        """Returns the latest entry of every item saved after `scrape_time`
+
+        Parameters
+        ----------
+        scrape_time : float
+            Epoch time to return entries after
+
+        Returns
+        -------
+        list[dict]
+            Manifest entries ordered by scrape time
+        """
+        return self.__latest("m.scrape_time > ?", (scrape_time,))
+
+    def entries(self, key_prefix: str = "") -> list[dict]:
+        """Returns the latest entry of every item stored under a key prefix
+        e.g. the data folder for a search term
+
+        Parameters
+        ----------
+        key_prefix : str, optional
+            Prefix of the object keys to return, by default all entries
+
+        Returns
+        -------
+        list[dict]
+            Manifest entries ordered by scrape time
+        """
+        return self.__latest("m.object_key LIKE ? ESCAPE '\\'", (self.__like_prefix(key_prefix),))
+
+    def __latest(self, condition: str, params: tuple) -> list[dict]:
+        """Runs a query over the latest entry per item
+
+        Parameters
+        ----------
+        condition : str
+            SQL condition applied to the latest entries (aliased `m`)
+        params : tuple
+            Parameters for the condition
+
+        Returns
+        -------
+        list[dict]
+            Manifest entries ordered by scrape time
+        """
+        with self.__lock:
+            rows = self.__conn.execute(
+                f"""SELECT m.seq, m.item_id, m.object_key, m.byte_offset, m.byte_length,
+                        m.content_hash, m.scrape_time
+                    FROM (SELECT *, ROW_NUMBER() OVER (
+                        PARTITION BY item_id ORDER BY scrape_time DESC, seq DESC) AS rank
+                        FROM manifest) m
+                    WHERE m.rank = 1 AND {condition}
+                    ORDER BY m.scrape_time, m.seq""",
+                params).fetchall()
+        return [dict(row) for row in rows]
+
+    @staticmethod
+    def __like_prefix(prefix: str) -> str:
+        """Escapes a prefix for use in a LIKE pattern
+
+        Parameters
+        ----------
+        prefix : str
+            The literal prefix
+
+        Returns
+        -------
+        str
+            LIKE pattern matching keys starting with `prefix`
+        """
+        escaped = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        return f"{escaped}%"
+
+    def close(self):
+        """Closes the connection to the manifest file"""
+        with self.__lock:
+            self.__conn.close()
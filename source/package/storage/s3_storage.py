@@ -1,36 +1,94 @@
-import boto3
-import requests
-from ..utils.utilities import UUIDEncoder
+import functools
+import io
 import json
+import os
+import tempfile
+import threading
+from typing import Iterator
 import uuid
+from .storage import Storage
+from .manifest import Manifest
 from ..utils.logger import log_class
+from ..utils import http_archive
+from ..utils import rate_limit
+from ..utils import tracing
 import logging
 
+# Prefix of the manifests mirrored in the bucket: every sync uploads a new
+# object (replacing the writer's previous one), so writers syncing at the same
+# time do not overwrite each other's entries. Every object is merged in when
+# a storage starts, and the objects merged are replaced by a single one
+MANIFEST_PREFIX = "_manifest/"
+
+# The manifest object last uploaded for each (bucket, local manifest file)
+# fetched by this process (None until one is uploaded), so the storages of
+# several searches sharing a manifest fetch it only once and replace each
+# other's uploads
+_mirrored = {}
+_mirrored_lock = threading.RLock()
+
+# Local cache of the bucket names resolved for each bucket prefix
+BUCKET_CACHE_FILE = os.getenv(
+    "DCP_BUCKET_CACHE",
+    os.path.join(os.path.expanduser("~"), ".dcp", "s3_buckets.json"))
+
+@functools.lru_cache(maxsize=None)
+def get_s3_client(profile_name: str = 'default'):
+    """Returns the S3 client shared by every S3Storage in the process.
+    The session and client are only created on first use.
+    Set AWS_ENDPOINT_URL to use an S3 compatible stand-in e.g. moto or MinIO
+
+    Parameters
+    ----------
+    profile_name : str, optional
+        The AWS credentials profile, by default 'default'
+
+    Returns
+    -------
+    S3.Client
+        A boto3 S3 client (clients are thread safe)
+    """
+    # boto3 is imported on first use, as it is slow to import
+    import boto3
+    session = boto3.Session(profile_name=profile_name)
+    return session.client('s3', endpoint_url=os.getenv("AWS_ENDPOINT_URL"))
+
 @log_class
-class S3Storage:
+class S3Storage(Storage):
     """
     A class to manage operating system file operations
 
+    The S3 client is created, and the bucket resolved, on first use
+    so constructing an S3Storage makes no AWS calls
+
     Attributes
     ----------
     data_folder : str
         The folder where json files are stored
     images_folder :
         The folder where images are stored
+    manifest : Manifest
+        Optional manifest indexing the records in saved json files,
+        mirrored to the bucket by `sync_manifest`
     """
 
     # Create a logger for the Locator class
     # Will be accessed by class decorator
     # which decorates each method with logging functionality
     logger = logging.getLogger(__name__)
-    
+
+    # Guards the local bucket name cache file
+    __cache_lock = threading.Lock()
+
     def __init__(self, 
             access_key_id: str, 
             secret_access_key: str,
             region: str,
             bucket_prefix: str,
             data_folder: str,
-            images_folder: str):
+            images_folder: str,
+            manifest: Manifest = None,
+            bucket_name: str = None):
         """Creates an instance of the S3Storage class
 
         Parameters
@@ -41,26 +99,54 @@ class S3Storage:
             AWS Secret Access Key
         region : str
             AWS region
+        bucket_prefix : str
+            Prefix of the bucket name, used to find (or create) the bucket
+            when `bucket_name` is not set and no name is cached
         data_folder : str
             Name of the data folder to create on initialisation
         images_folder : str
             Name of the image folder to create on initialisation
+        manifest : Manifest, optional
+            Manifest to record saved records in, by default None.
+            Entries already mirrored to the bucket are merged into it
+        bucket_name : str, optional
+            Name of the bucket to use e.g. from config, by default None
         """
-        session = boto3.Session(profile_name='default')
-        self.__s3resource = session.resource('s3')
-        # self.__s3resource = boto3.resource(
-        #     's3',
-        #     aws_access_key_id = access_key_id,
-        #     aws_secret_access_key = secret_access_key,
-        #     region_name = region
-        #     )
-
         self.__region = region
-        self.__s3bucket = None
-        self.__bucket_name = None
+        self.__bucket_prefix = bucket_prefix
+        self.__bucket_name = bucket_name
+        self.__bucket_lock = threading.Lock()
+        self.__bucket_ready = False
         self.data_folder = data_folder
         self.images_folder = f"{data_folder}/{images_folder}"
-        self.__create_bucket(bucket_prefix)
+        self.manifest = manifest
+
+    @property
+    def __s3client(self):
+        """The shared S3 client"""
+        return get_s3_client()
+
+    @property
+    def __bucket(self) -> str:
+        """The bucket name, resolved (and the manifest fetched) on first use"""
+        if not self.__bucket_ready:
+            with self.__bucket_lock:
+                if not self.__bucket_ready:
+                    bucket_name = self.__bucket_name or self.__cached_bucket_name()
+                    if (self.__bucket_name is None and bucket_name is not None
+                            and not self.__bucket_exists(bucket_name)):
+                        # Deleted (or renamed) since it was cached
+                        self.logger.warning(f"Cached bucket {bucket_name} no longer exists, "
+                            f"resolving the bucket for {self.__bucket_prefix} again")
+                        self.__cache_bucket_name(None)
+                        bucket_name = None
+                    if bucket_name is None:
+                        bucket_name = self.__create_bucket(self.__bucket_prefix)
+                    if self.manifest is not None:
+                        self.__fetch_manifest(bucket_name)
+                    self.__bucket_name = bucket_name
+                    self.__bucket_ready = True
+        return self.__bucket_name
 
     def save_image(self,
             url: str,
@@ -78,16 +164,28 @@ class S3Storage:
             The name of the image file
         """
         # Download the file from `url` and save it to s3 under `file_name`:
-        r = requests.get(url, stream=True)
+        with tracing.span("image_download", "storage", url=url):
+            if http_archive.active():
+                # Recorded to / replayed from the HTTP archive
+                image = io.BytesIO(http_archive.fetch(url))
+            else:
+                import requests
+                # Shares the host's limits with the page loads
+                with rate_limit.request(url) as req:
+                    response = requests.get(url, stream=True)
+                    req.record(response.status_code, response.headers.get("Retry-After"))
+                image = response.raw
         #Key will the the folder/filename
         key = f"{folder}/{file}" 
-        self.__s3bucket.upload_fileobj(r.raw, key)
+        with tracing.span("image_upload", "storage", key=key):
+            self.__s3client.upload_fileobj(image, self.__bucket, key)
 
     def save_json_file(self,
             dict_to_save: dict,
             folder: str,
             file: str):
         """Creates a file in JSON format from a dictionary and saves to the S3 bucket
+        Records with an item_id are added to the manifest, if there is one
 
         Parameters
         ----------
@@ -98,13 +196,13 @@ class S3Storage:
         file : str
             The name of the JSON file to be created
         """            
-        self.__s3bucket.put_object(
-            Body=json.dumps(
-                dict_to_save, 
-                cls=UUIDEncoder, 
-                indent=4),
-            Bucket=self.__bucket_name,
-            Key=f"{folder}/{file}.json")
+        key = f"{folder}/{file}.json"
+        body, spans = self._encode_json(dict_to_save)
+        self.__s3client.put_object(
+            Body=body,
+            Bucket=self.__bucket,
+            Key=key)
+        self._record_spans(key, spans)
 
     def __create_bucket_name(self, 
             bucket_prefix: str) -> str:
@@ -123,9 +221,76 @@ class S3Storage:
         # The generated bucket name must be between 3 and 63 chars long
         return ''.join([bucket_prefix, str(uuid.uuid4())])
 
+    def __cached_bucket_name(self) -> str:
+        """Gets the bucket name previously resolved for the bucket prefix
+
+        Returns
+        -------
+        str
+            The bucket name, or None if it is not cached
+        """
+        with self.__cache_lock:
+            if not os.path.exists(BUCKET_CACHE_FILE):
+                return None
+            with open(BUCKET_CACHE_FILE, "r") as cachefile:
+                try:
+                    return json.load(cachefile).get(self.__bucket_prefix)
+                except ValueError:
+                    return None
+
+    def __cache_bucket_name(self, bucket_name: str):
+        """Saves the bucket name resolved for the bucket prefix
+
+        Parameters
+        ----------
+        bucket_name : str
+            The bucket name, or None to remove the prefix's entry
+        """
+        with self.__cache_lock:
+            os.makedirs(os.path.dirname(BUCKET_CACHE_FILE), exist_ok=True)
+            cache = {}
+            if os.path.exists(BUCKET_CACHE_FILE):
+                with open(BUCKET_CACHE_FILE, "r") as cachefile:
+                    try:
+                        cache = json.load(cachefile)
+                    except ValueError:
+                        pass
+            if bucket_name is None:
+                cache.pop(self.__bucket_prefix, None)
+            else:
+                cache[self.__bucket_prefix] = bucket_name
+            with open(f"{BUCKET_CACHE_FILE}.tmp", "w") as cachefile:
+                json.dump(cache, cachefile)
+            os.replace(f"{BUCKET_CACHE_FILE}.tmp", BUCKET_CACHE_FILE)
+
+    def __bucket_exists(self, bucket_name: str) -> bool:
+        """Checks a bucket still exists
+
+        Parameters
+        ----------
+        bucket_name : str
+            The bucket name
+
+        Returns
+        -------
+        bool
+            False if S3 reports the bucket does not exist
+        """
+        from botocore.exceptions import ClientError
+        try:
+            self.__s3client.head_bucket(Bucket=bucket_name)
+        except ClientError as ce:
+            if ce.response['Error']['Code'] in ('404', 'NoSuchBucket'):
+                return False
+            raise
+        return True
+
     def __create_bucket(self, 
-            bucket_prefix: str):
-        """Creates an S3 bucket
+            bucket_prefix: str) -> str:
+        """Finds the S3 bucket for the prefix, creating it if there is none,
+        and caches its name. A bucket whose name starts with the prefix
+        is used first, then (as before prefixes were matched) a bucket
+        whose name contains it
 
         Parameters
         ----------
@@ -134,18 +299,19 @@ class S3Storage:
 
         Returns
         -------
-        Bucket
-           Bucket: S3 Bucket
+        str
+           The bucket name
         """            
-        for bucket in self.__s3resource.buckets.all():
-            if bucket_prefix in bucket.name:
-                self.__s3bucket = bucket
-                self.__bucket_name = bucket.name
-                return
-        
+        names = [bucket['Name'] for bucket in self.__s3client.list_buckets()['Buckets']]
+        matches = ([name for name in names if name.startswith(bucket_prefix)]
+            or [name for name in names if bucket_prefix in name])
+        if len(matches) > 0:
+            self.__cache_bucket_name(matches[0])
+            return matches[0]
+
         bucket_name = self.__create_bucket_name(bucket_prefix)
 
-        bucket = self.__s3resource.create_bucket(
+        self.__s3client.create_bucket(
             Bucket=bucket_name,
             CreateBucketConfiguration={
             'LocationConstraint': self.__region})
@@ -165,15 +331,15 @@ class S3Storage:
                 }
             ]
         })
-        bucket_policy = self.__s3resource.BucketPolicy(bucket_name)
-        bucket_policy.put(Policy=bucket_policy_json)
-        self.__s3bucket = bucket
-        self.__bucket_name = bucket_name
+        self.__s3client.put_bucket_policy(Bucket=bucket_name, Policy=bucket_policy_json)
+        self.__cache_bucket_name(bucket_name)
+        return bucket_name
 
     def list_files(self,
             folder: str,
-            file_type: str = None) -> list:
-        """Lists files in an S3 bucket folder (filtered optionally by file type)
+            file_type: str = None) -> Iterator[str]:
+        """Lists files in an S3 bucket folder (filtered optionally by file type).
+        Keys are yielded a page of the listing at a time
 
         Parameters
         ----------
@@ -182,18 +348,16 @@ class S3Storage:
         file_type : str, optional
             A valid file type extension, by default None
 
-        Returns
-        -------
-        list
-            List of file names (keys)
+        Yields
+        ------
+        str
+            File names (keys)
         """            
-        files = []
-
-        for object_summary in self.__s3bucket.objects.filter(Prefix=f"{folder}/"):
-            if file_type is None or object_summary.key.endswith(file_type) :
-                files.append(object_summary.key)
-
-        return files
+        paginator = self.__s3client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.__bucket, Prefix=f"{folder}/"):
+            for object_summary in page.get('Contents', []):
+                if file_type is None or object_summary['Key'].endswith(file_type):
+                    yield object_summary['Key']
 
     def read_json_file(self,
             file: str) -> str:
@@ -209,6 +373,183 @@ class S3Storage:
         str
             A string in json format
         """            
-        content_object = self.__s3bucket.Object(file)
-        file_content = content_object.get()['Body'].read().decode('utf-8')
-        return json.loads(file_content)
\ No newline at end of file
+        content_object = self.__s3client.get_object(Bucket=self.__bucket, Key=file)
+        file_content = content_object['Body'].read().decode('utf-8')
+        return json.loads(file_content)
+
+    def read_range(self,
+            file: str,
+            offset: int,
+            length: int = None) -> bytes:
+        """Reads a range of bytes from an object with a ranged GET
+
+        Parameters
+        ----------
+        file : str
+            The key of the object
+        offset : int
+            Offset of the first byte to read
+        length : int, optional
+            Number of bytes to read, by default to the end of the object
+
+        Returns
+        -------
+        bytes
+            The bytes read from the object
+        """
+        end = "" if length is None else offset + length - 1
+        content_object = self.__s3client.get_object(
+            Bucket=self.__bucket,
+            Key=file,
+            Range=f"bytes={offset}-{end}")
+        return content_object['Body'].read()
+
+    def save_bytes(self,
+            data: bytes,
+            folder: str,
+            file: str):
+        """Saves bytes to an object in the S3 bucket
+
+        Parameters
+        ----------
+        data : bytes
+            The bytes to save
+        folder : str
+            The name of the folder to save to
+        file : str
+            The name of the object (including extension)
+        """
+        self.__s3client.put_object(
+            Body=data,
+            Bucket=self.__bucket,
+            Key=f"{folder}/{file}")
+
+    def delete_file(self,
+            file: str):
+        """Deletes an object from the S3 bucket
+
+        Parameters
+        ----------
+        file : str
+            The key of the object
+        """
+        self.__s3client.delete_object(Bucket=self.__bucket, Key=file)
+
+    def modified_time(self,
+            file: str) -> float:
+        """Returns the time an object was last written
+
+        Parameters
+        ----------
+        file : str
+            The key of the object
+
+        Returns
+        -------
+        float
+            Epoch time of the object's LastModified
+        """
+        return self.__s3client.head_object(Bucket=self.__bucket, Key=file)['LastModified'].timestamp()
+
+    def file_exists(self,
+            folder: str,
+            file: str) -> bool:
+        """Checks whether an object has been saved to a 'folder'
+
+        Parameters
+        ----------
+        folder : str
+            The name of the 'folder' the object belongs to
+        file : str
+            The name of the file
+
+        Returns
+        -------
+        bool
+            True if the object exists
+        """
+        from botocore.exceptions import ClientError
+        try:
+            self.__s3client.head_object(Bucket=self.__bucket, Key=f"{folder}/{file}")
+        except ClientError as ce:
+            if ce.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                return False
+            raise
+        return True
+
+    def sync_manifest(self):
+        """Uploads the local manifest to the bucket, replacing the object
+        last uploaded for it by this process"""
+        if self.manifest is not None:
+            self.__upload_manifest(self.__bucket)
+
+    def __upload_manifest(self, bucket_name: str):
+        """Uploads the local manifest as a new object and deletes the one
+        it replaces. Objects are never overwritten, so one being merged
+        by another writer cannot change before it is deleted
+
+        Parameters
+        ----------
+        bucket_name : str
+            The bucket name
+        """
+        key = f"{MANIFEST_PREFIX}{uuid.uuid4()}.sqlite"
+        mirror = (bucket_name, os.path.abspath(self.manifest.path))
+        with _mirrored_lock:
+            self.__s3client.upload_file(self.manifest.path, bucket_name, key)
+            replaced, _mirrored[mirror] = _mirrored.get(mirror), key
+        if replaced is not None:
+            self.__s3client.delete_object(Bucket=bucket_name, Key=replaced)
+
+    def __fetch_manifest(self, bucket_name: str):
+        """Merges the manifests mirrored in the bucket by every writer (if any)
+        into the local manifest, then replaces them with a single object
+        so the number of objects does not grow with every run.
+        Only the first storage of the process using the manifest fetches it
+
+        Parameters
+        ----------
+        bucket_name : str
+            The bucket name
+        """
+        mirror = (bucket_name, os.path.abspath(self.manifest.path))
+        with _mirrored_lock:
+            if mirror not in _mirrored:
+                self.__merge_mirrored(bucket_name)
+                _mirrored.setdefault(mirror, None)
+
+    def __merge_mirrored(self, bucket_name: str):
+        """Merges every manifest object in the bucket into the local
+        manifest and replaces them with a single object
+
+        Parameters
+        ----------
+        bucket_name : str
+            The bucket name
+        """
+        from botocore.exceptions import ClientError
+        fd, path = tempfile.mkstemp(suffix=".sqlite")
+        os.close(fd)
+        paginator = self.__s3client.get_paginator('list_objects_v2')
+        merged_keys = []
+        try:
+            # Nothing is listed if nothing has been mirrored yet
+            for page in paginator.paginate(Bucket=bucket_name, Prefix=MANIFEST_PREFIX):
+                for object_summary in page.get('Contents', []):
+                    try:
+                        self.__s3client.download_file(bucket_name, object_summary['Key'], path)
+                    except ClientError as ce:
+                        # Removed since it was listed
+                        if ce.response['Error']['Code'] not in ('404', 'NoSuchKey'):
+                            raise
+                        continue
+                    self.manifest.merge(path)
+                    merged_keys.append(object_summary['Key'])
+        finally:
+            os.remove(path)
+        if len(merged_keys) > 1:
+            # Written before the merged objects are deleted, so a failure
+            # part way leaves duplicate (not missing) entries
+            self.__upload_manifest(bucket_name)
+            for key in merged_keys:
+                self.__s3client.delete_object(Bucket=bucket_name, Key=key)
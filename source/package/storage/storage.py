@@ -1,13 +1,26 @@
 from abc import ABC, abstractmethod
+from typing import Iterator
+import gzip
+import hashlib
+import json
+from ..utils.utilities import UUIDEncoder
+from ..utils import tracing
 
 class Storage(ABC):
 
     """Abstract class for storage operations
+
+    Attributes
+    ----------
+    manifest : Manifest
+        Optional manifest indexing the records written by the storage
     """
+    manifest = None
+
     @abstractmethod
     def list_files(self,
             folder: str,
-            file_type: str = None) -> list:        
+            file_type: str = None) -> Iterator[str]:
         pass
 
     @abstractmethod
@@ -24,7 +37,135 @@ class Storage(ABC):
             file: str):
         pass
 
-    @abstractmethod        
+    @abstractmethod
     def read_json_file(self,
             file: str) -> str:
-        pass
\ No newline at end of file
+        pass
+
+    @abstractmethod
+    def read_range(self,
+            file: str,
+            offset: int,
+            length: int = None) -> bytes:
+        pass
+
+    @abstractmethod
+    def save_bytes(self,
+            data: bytes,
+            folder: str,
+            file: str):
+        pass
+
+    @abstractmethod
+    def delete_file(self,
+            file: str):
+        pass
+
+    @abstractmethod
+    def modified_time(self,
+            file: str) -> float:
+        pass
+
+    def file_exists(self,
+            folder: str,
+            file: str) -> bool:
+        """Checks whether a file has been saved to a folder
+        (storages that cannot check report it missing, so it is saved again)
+
+        Parameters
+        ----------
+        folder : str
+            The folder the file belongs to
+        file : str
+            The name of the file (including extension)
+
+        Returns
+        -------
+        bool
+            True if the file is known to exist
+        """
+        return False
+
+    def sync_manifest(self):
+        """Publishes the manifest alongside the stored data
+        (nothing to do when the manifest is already local to the data)
+        """
+        pass
+
+    def read_item(self, item_id: str) -> dict:
+        """Reads a single record using the manifest, without listing
+        or reading whole batch files
+
+        Parameters
+        ----------
+        item_id : str
+            The unique ID of the item
+
+        Returns
+        -------
+        dict
+            The record, or None if the item is not in the manifest
+        """
+        if self.manifest is None:
+            return None
+        entry = self.manifest.lookup(item_id)
+        if entry is None:
+            return None
+        data = self.read_range(
+            entry["object_key"],
+            entry["byte_offset"],
+            entry["byte_length"])
+        if entry["object_key"].endswith(".gz"):
+            # Compacted files hold one gzip member per record
+            data = gzip.decompress(data)
+        return json.loads(data)
+
+    def _encode_json(self, dict_to_save) -> tuple:
+        """Serialises data to JSON bytes. A list of records is written
+        one record at a time so the byte range of each record is known
+
+        Parameters
+        ----------
+        dict_to_save : dict | list
+            A dictionary, or a list of record dictionaries
+
+        Returns
+        -------
+        tuple
+            The JSON bytes, and a list of (item_id, offset, length, hash)
+            for each record which has an item_id
+        """
+        with tracing.span("serialize", "storage"):
+            if not isinstance(dict_to_save, list):
+                return json.dumps(dict_to_save, cls=UUIDEncoder, indent=4).encode("utf-8"), []
+
+            body = bytearray(b"[\n")
+            spans = []
+            for idx, record in enumerate(dict_to_save):
+                if idx > 0:
+                    body += b",\n"
+                data = json.dumps(record, cls=UUIDEncoder, indent=4).encode("utf-8")
+                if isinstance(record, dict) and "item_id" in record:
+                    spans.append((
+                        str(record["item_id"]),
+                        len(body),
+                        len(data),
+                        hashlib.sha256(data).hexdigest()))
+                body += data
+            body += b"\n]"
+            return bytes(body), spans
+
+    def _record_spans(self, key: str, spans: list):
+        """Adds the records written to an object to the manifest
+
+        Parameters
+        ----------
+        key : str
+            The file path or object key the records were written to
+        spans : list
+            List of (item_id, offset, length, hash) from `_encode_json`
+        """
+        if self.manifest is not None and len(spans) > 0:
+            self.manifest.record_many(
+                [(item_id, key, offset, length, content_hash, None)
+                for item_id, offset, length, content_hash in spans])
@@ -0,0 +1,353 @@
+"""
+Record / replay of the HTTP responses fetched during a run (results
+pages, recipe pages and images) in a compressed SQLite archive keyed by URL,
+so a crawl can be repeated offline with a chosen latency.
+In record mode pages loaded by a Scraper (the rendered page source) and
+images saved by a Storage are stored as they are fetched. In replay mode
+the browser is pointed at a local server answering from the archive and
+images are read from it directly.
+The archive is process wide: Scraper and the storages call the functions
+below, which fetch from the live site until `activate` is called
+"""
+
+from urllib.parse import urlsplit
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from . import rate_limit
+
+RECORD = "record"
+REPLAY = "replay"
+
+logger = logging.getLogger(__name__)
+
+_archive = None
+_mode = None
+_latency = 0.0
+_server = None
+_server_lock = threading.Lock()
+
+
+class ArchiveMissError(LookupError):
+    """Raised when replaying a URL which is not in the archive"""
+
+
+class HttpArchive:
+    """
+    A SQLite file holding one zlib compressed response per URL;
+    recording a URL again replaces the earlier response
+
+    Attributes
+    ----------
+    path : str
+        Path of the SQLite file holding the archive
+    """
+
+    def __init__(self, path: str):
+        """
+        Opens (or creates) an archive at `path`
+
+        Parameters
+        ----------
+        path : str
+            Path of the SQLite file holding the archive
+        """
+        self.path = path
+        folder = os.path.dirname(path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        self.__lock = threading.Lock()
+        self.__conn = sqlite3.connect(path, check_same_thread=False)
+        with self.__conn:
+            self.__conn.execute(
+                """CREATE TABLE IF NOT EXISTS responses (
+                    url TEXT PRIMARY KEY,
+                    path TEXT NOT NULL,
+                    status INTEGER NOT NULL,
+                    content_type TEXT,
+                    body BLOB NOT NULL,
+                    body_length INTEGER NOT NULL,
+                    recorded_time REAL NOT NULL)""")
+            self.__conn.execute(
+                "CREATE INDEX IF NOT EXISTS ix_responses_path ON responses (path, recorded_time)")
+
+    def record(self,
+            url: str,
+            body: bytes,
+            status: int = 200,
+            content_type: str = None):
+        """Stores the response for a URL
+
+        Parameters
+        ----------
+        url : str
+            The URL fetched
+        body : bytes
+            The response body
+        status : int, optional
+            The HTTP status, by default 200
+        content_type : str, optional
+            The response content type, by default None
+        """
+        with self.__lock, self.__conn:
+            self.__conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (url, _path(url), status, content_type,
+                    zlib.compress(body), len(body), time.time()))
+
+    def lookup(self, url: str) -> tuple:
+        """Returns the response recorded for a URL
+
+        Parameters
+        ----------
+        url : str
+            The URL
+
+        Returns
+        -------
+        tuple
+            (status, content_type, body), or None if the URL was not recorded
+        """
+        with self.__lock:
+            row = self.__conn.execute(
+                "SELECT status, content_type, body FROM responses WHERE url = ?",
+                (url,)).fetchone()
+        return None if row is None else (row[0], row[1], zlib.decompress(row[2]))
+
+    def lookup_path(self, path: str) -> tuple:
+        """Returns the latest response recorded for a path (and query)
+        on any host, as requested from the replay server
+
+        Parameters
+        ----------
+        path : str
+            The path and query e.g. /search?q=chicken
+
+        Returns
+        -------
+        tuple
+            (status, content_type, body), or None if the path was not recorded
+        """
+        with self.__lock:
+            row = self.__conn.execute(
+                """SELECT status, content_type, body FROM responses WHERE path = ?
+                ORDER BY recorded_time DESC LIMIT 1""",
+                (path,)).fetchone()
+        return None if row is None else (row[0], row[1], zlib.decompress(row[2]))
+
+    def urls(self) -> list:
+        """Returns the recorded URLs"""
+        with self.__lock:
+            return [row[0] for row in self.__conn.execute("SELECT url FROM responses ORDER BY url")]
+
+    def close(self):
+        """Closes the archive"""
+        with self.__lock:
+            self.__conn.close()
+
+
+class ArchiveServer:
+    """
+    A local HTTP server answering from an archive by path, which the
+    browser is pointed at when replaying
+
+    Attributes
+    ----------
+    url : str
+        The base URL of the server e.g. http://127.0.0.1:50123/
+    """
+
+    def __init__(self, archive: HttpArchive, latency: float = 0.0):
+        """
+        Parameters
+        ----------
+        archive : HttpArchive
+            The archive to answer from
+        latency : float, optional
+            Seconds added to every response, by default 0
+        """
+        # Imported here as the HTTP modules are slow to import
+        # and only needed when replaying
+        from http.server import ThreadingHTTPServer
+        self.__archive = archive
+        self.__latency = latency
+        self.__httpd = ThreadingHTTPServer(("127.0.0.1", 0), self.__handler())
+        host, port = self.__httpd.server_address[:2]
+        self.url = f"http://{host}:{port}/"
+        self.__thread = threading.Thread(
+            target=self.__httpd.serve_forever, name="archive-server", daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        """Stops the server"""
+        self.__httpd.shutdown()
+        self.__httpd.server_close()
+        self.__thread.join()
+
+    def __handler(self) -> type:
+        """Returns a request handler class bound to this server"""
+        from http.server import BaseHTTPRequestHandler
+        archive = self.__archive
+        latency = self.__latency
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if latency > 0:
+                    time.sleep(latency)
+                response = archive.lookup_path(self.path)
+                if response is None:
+                    logger.warning(f"Not in the HTTP archive: {self.path}")
+                    status, content_type, body = 404, "text/plain", b""
+                else:
+                    status, content_type, body = response
+                self.send_response(status)
+                self.send_header("Content-Type", content_type or "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # Requests are not logged
+                pass
+
+        return Handler
+
+
+def activate(path: str, mode: str, latency: float = 0.0) -> HttpArchive:
+    """Starts recording to, or replaying from, an archive
+
+    Parameters
+    ----------
+    path : str
+        Path of the SQLite file holding the archive
+    mode : str
+        RECORD or REPLAY
+    latency : float, optional
+        Seconds added to every replayed response, by default 0
+
+    Returns
+    -------
+    HttpArchive
+        The process archive
+    """
+    global _archive, _mode, _latency
+    if mode not in (RECORD, REPLAY):
+        raise ValueError(f"Unknown HTTP archive mode: {mode}")
+    deactivate()
+    _archive = HttpArchive(path)
+    _mode = mode
+    _latency = latency
+    return _archive
+
+
+def deactivate():
+    """Stops recording / replaying and closes the archive"""
+    global _archive, _mode, _server
+    with _server_lock:
+        if _server is not None:
+            _server.stop()
+            _server = None
+    if _archive is not None:
+        _archive.close()
+    _archive = None
+    _mode = None
+
+
+def active() -> bool:
+    """Returns True if responses are being recorded or replayed"""
+    return _mode is not None
+
+
+def recording() -> bool:
+    """Returns True if responses are being recorded"""
+    return _mode == RECORD
+
+
+def replaying() -> bool:
+    """Returns True if responses are being replayed"""
+    return _mode == REPLAY
+
+
+def browser_url(url: str) -> str:
+    """Returns the URL a browser should load for `url`: the replay
+    server's address for the same path when replaying, otherwise `url`
+
+    Parameters
+    ----------
+    url : str
+        The URL on the live site
+
+    Returns
+    -------
+    str
+        The URL to load
+    """
+    global _server
+    if not replaying():
+        return url
+    with _server_lock:
+        if _server is None:
+            _server = ArchiveServer(_archive, _latency)
+        server_url = _server.url
+    if url.startswith(server_url):
+        # A link read from a replayed page
+        return url
+    return server_url + _path(url).lstrip("/")
+
+
+def record_page(url: str, page_source: str):
+    """Records a page loaded by a browser, if recording
+
+    Parameters
+    ----------
+    url : str
+        The URL on the live site
+    page_source : str
+        The page source from the browser
+    """
+    if recording():
+        _archive.record(url, page_source.encode("utf-8"), content_type="text/html; charset=utf-8")
+
+
+def fetch(url: str) -> bytes:
+    """Fetches a URL (e.g. an image): from the archive when replaying,
+    otherwise from the live site, recording the response if recording
+
+    Parameters
+    ----------
+    url : str
+        The URL
+
+    Returns
+    -------
+    bytes
+        The response body
+
+    Raises
+    ------
+    ArchiveMissError
+        When replaying a URL which was not recorded
+    """
+    if replaying():
+        if _latency > 0:
+            time.sleep(_latency)
+        response = _archive.lookup(url)
+        if response is None:
+            raise ArchiveMissError(f"Not in the HTTP archive: {url}")
+        return response[2]
+    from urllib import request
+    with rate_limit.request(url), request.urlopen(url) as response:
+        body = response.read()
+        if recording():
+            _archive.record(url, body, response.status, response.headers.get("Content-Type"))
+    return body
+
+
+def _path(url: str) -> str:
+    """Returns the path and query of a URL e.g. /search?q=chicken"""
+    parts = urlsplit(url)
+    return (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
@@ -0,0 +1,135 @@
+import atexit
+import copy
+import json
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# Extra attributes copied from log records into the JSON lines
+# e.g. logger.info("Saved file", extra={"stage": "store", "item_id": item_id})
+STRUCTURED_FIELDS = ("stage", "item_id", "duration", "search", "worker")
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats log records as single line JSON objects, including
+    any structured fields passed in the `extra` of the log call
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        """Formats a log record as JSON
+
+        Parameters
+        ----------
+        record : logging.LogRecord
+            The log record
+
+        Returns
+        -------
+        str
+            The JSON line
+        """
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        for field in STRUCTURED_FIELDS:
+            if hasattr(record, field):
+                entry[field] = getattr(record, field)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class StructuredQueueHandler(QueueHandler):
+    """
+    Queues log records for a QueueListener without formatting them,
+    so the structured fields survive until the listener writes them.
+    The message and any exception are rendered to text here, as the
+    arguments and traceback cannot safely cross threads
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """Prepares a log record for queuing
+
+        Parameters
+        ----------
+        record : logging.LogRecord
+            The log record
+
+        Returns
+        -------
+        logging.LogRecord
+            A copy of the record with message and exception as text
+        """
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class StoppableQueueListener(QueueListener):
+    """QueueListener which can be stopped more than once
+    e.g. explicitly and then again at exit
+    """
+
+    def stop(self):
+        """Flushes the queue and stops the listener thread, if running"""
+        if self._thread is not None:
+            super().stop()
+
+
+def configure_logging(
+        filename: str,
+        level: int = logging.INFO,
+        max_bytes: int = 10 * 1024 * 1024,
+        backup_count: int = 5,
+        json_format: bool = True) -> QueueListener:
+    """Sets up logging so callers only put records on an in-memory queue
+    and a background thread writes them to a size-rotated log file
+
+    Parameters
+    ----------
+    filename : str
+        The log file
+    level : int, optional
+        The logging level, by default logging.INFO
+    max_bytes : int, optional
+        Size the log file is rotated at, by default 10MB
+    backup_count : int, optional
+        Number of rotated log files kept, by default 5
+    json_format : bool, optional
+        Write JSON lines (otherwise plain text), by default True
+
+    Returns
+    -------
+    QueueListener
+        The started listener; it is stopped (and the queue flushed) at exit
+    """
+    log_queue = queue.SimpleQueue()
+    file_handler = RotatingFileHandler(
+        filename,
+        maxBytes=max_bytes,
+        backupCount=backup_count)
+    if json_format:
+        file_handler.setFormatter(JsonFormatter())
+    else:
+        file_handler.setFormatter(logging.Formatter('%(name)s: %(asctime)s - %(message)s'))
+
+    root_logger = logging.getLogger()
+    for handler in root_logger.handlers[:]:
+        root_logger.removeHandler(handler)
+    root_logger.addHandler(StructuredQueueHandler(log_queue))
+    root_logger.setLevel(level)
+
+    listener = StoppableQueueListener(log_queue, file_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -1,10 +1,22 @@
 import logging
 import functools
+import inspect
+
+
+class _LoggedError(RuntimeError):
+    """RuntimeError raised by the log decorator once an exception has been logged,
+    so decorated methods calling each other do not log and wrap it again
+    """
 
 
 def log(_func=None, *, my_logger: logging.Logger = None):
     """Decorator to perform exception handling and logging
 
+    The logger is resolved when the function is decorated, and the
+    argument list is only formatted when debug logging is enabled.
+    A generator function's iteration is wrapped too, so an exception
+    raised while the items are read is logged and raised the same way
+
     Parameters
     ----------
     _func : object, optional
@@ -17,27 +29,48 @@ def log(_func=None, *, my_logger: logging.Logger = None):
     Runtime error
     """
     def decorator_log(func):
-        @functools.wraps(func)
-        def wrapper(*args, **kwargs):
-            # if no Logger passed in then create one for the function
-            if my_logger is None:
-                logger =logging.getLogger(func.__name__)
-            else:
-                logger = my_logger
-            # Get the function arguments for debug messages
-            args_repr = [repr(a) for a in args]
-            kwargs_repr = [f"{k}={v!r}" for k, v in kwargs.items()]
-            signature = ", ".join(args_repr + kwargs_repr)
-            logger.debug(f"function {func.__name__} called with args {signature}")
-            # Execute the function and return the result
-            try:
-                result = func(*args, **kwargs)
-                return result
-            # Catches any exception in the function
-            except Exception as e:
-                # Log the exception details
-                logger.exception(f"Exception raised in {func.__name__}. exception: {str(e)}")
-                raise RuntimeError from e
+        # if no Logger passed in then create one for the function
+        logger = logging.getLogger(func.__name__) if my_logger is None else my_logger
+
+        def log_call(args, kwargs):
+            if logger.isEnabledFor(logging.DEBUG):
+                # Get the function arguments for debug messages
+                args_repr = [repr(a) for a in args]
+                kwargs_repr = [f"{k}={v!r}" for k, v in kwargs.items()]
+                signature = ", ".join(args_repr + kwargs_repr)
+                logger.debug(f"function {func.__name__} called with args {signature}")
+
+        def log_error(e: Exception) -> _LoggedError:
+            # Log the exception details
+            logger.exception(f"Exception raised in {func.__name__}. exception: {str(e)}")
+            return _LoggedError()
+
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                log_call(args, kwargs)
+                # Iterate the generator here, so errors raised while
+                # its items are read are handled as below
+                try:
+                    return (yield from func(*args, **kwargs))
+                except _LoggedError:
+                    raise
+                except Exception as e:
+                    raise log_error(e) from e
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                log_call(args, kwargs)
+                # Execute the function and return the result
+                try:
+                    return func(*args, **kwargs)
+                except _LoggedError:
+                    # Already logged by a decorated function further down the stack
+                    raise
+                # Catches any exception in the function
+                except Exception as e:
+                    raise log_error(e) from e
+        wrapper._log_wrapped = True
         return wrapper
 
     if _func is None:
@@ -48,6 +81,10 @@ def log(_func=None, *, my_logger: logging.Logger = None):
 def log_class(Cls):
     """Class decortaor which will apply the log decorator to all methods in class
 
+    Public methods (including inherited ones) are wrapped once, when the
+    class is decorated, and the class itself is returned so isinstance
+    checks and subclassing work as normal
+
     Parameters
     ----------
     Cls : class
@@ -56,36 +93,17 @@ def log_class(Cls):
     Returns
     -------
     class
-        Returns the wrapped class method
-    """    
-    # decoration body
-    class Wrapper:
-        """Modifies __init__ and __getattribute_
-        for decorated classes
-        """        
-        def __init__(self, *args, **kwargs):
-            self.decorated_obj = Cls(*args, **kwargs)
-            # Get the objects logger attribrute or class variable
-            # This is to pass to the log decorator
-            try:
-                self.logger = self.decorated_obj.logger
-            except AttributeError:
-                # If object has no logger then 
-                # one will be created by the log decorator
-                pass
-
-        def __getattribute__(self, s):
-            try:
-                x = super().__getattribute__(s)
-                return x
-            except AttributeError:
-                pass
-            x = self.decorated_obj.__getattribute__(s)
-            if type(x) == type(self.__init__): 
-                # It is an instance method
-                # So apply the log decorator to the method
-                return log(x, my_logger=self.logger)
-            else:
-                return x
-
-    return Wrapper  # decoration ends here
\ No newline at end of file
+        Returns the class with its methods wrapped
+    """
+    # Get the class logger attribute to pass to the log decorator
+    # If the class has no logger then one will be created by the log decorator
+    logger = getattr(Cls, "logger", None)
+    for name in dir(Cls):
+        if name.startswith("_"):
+            continue
+        # Find the attribute without triggering descriptors
+        # so static / class methods and properties are left alone
+        attr = inspect.getattr_static(Cls, name)
+        if inspect.isfunction(attr) and not getattr(attr, "_log_wrapped", False):
+            setattr(Cls, name, log(attr, my_logger=logger))
+    return Cls
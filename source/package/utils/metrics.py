@@ -0,0 +1,318 @@
+"""
+Prometheus metrics for the pipeline stages.
+If prometheus_client is not installed the metrics are no-ops,
+so instrumented code runs unchanged.
+A worker process (see parallel_pipeline) records the updates of its
+counters and histograms after `forward_updates`, and sends them to the
+coordinator, which adds them to its own with `apply_updates`, so the
+coordinator's /metrics covers every worker
+"""
+
+from contextlib import contextmanager
+import time
+from . import profiling
+from . import tracing
+
+try:
+    import prometheus_client
+except ImportError:
+    prometheus_client = None
+
+# Counters and histograms by name, to apply forwarded updates to
+_forwarded = {}
+
+# Updates recorded for the coordinator, once forwarding (or None)
+_updates = None
+
+
+class _NoopMetric:
+    """Stands in for a metric when prometheus_client is not installed"""
+
+    def labels(self, *args, **kwargs):
+        return self
+
+    def inc(self, amount: float = 1):
+        pass
+
+    def set(self, value: float):
+        pass
+
+    def observe(self, value: float):
+        pass
+
+
+class _ForwardedMetric:
+    """Wraps a counter or histogram (or one of its labelled children),
+    recording its updates to be forwarded once `forward_updates` is called"""
+
+    def __init__(self, name: str, metric, label_values: tuple = ()):
+        self.name = name
+        self.metric = metric
+        self.label_values = label_values
+
+    def labels(self, *label_values):
+        return _ForwardedMetric(self.name, self.metric.labels(*label_values), label_values)
+
+    def inc(self, amount: float = 1):
+        self.metric.inc(amount)
+        if _updates is not None:
+            _updates.append((self.name, self.label_values, "inc", amount))
+
+    def observe(self, value: float):
+        self.metric.observe(value)
+        if _updates is not None:
+            _updates.append((self.name, self.label_values, "observe", value))
+
+
+def _metric(metric_type: str, name: str, documentation: str, labels: list, **kwargs):
+    """Creates a metric, or a no-op stand in. A metric already registered
+    (e.g. by this module imported again under another package root) is
+    reused, as registering it twice is an error
+
+    Parameters
+    ----------
+    metric_type : str
+        The prometheus_client metric class name e.g. Counter
+    name : str
+        The metric name
+    documentation : str
+        The metric help text
+    labels : list
+        The label names
+
+    Returns
+    -------
+    object
+        The metric
+    """
+    if prometheus_client is None:
+        return _NoopMetric()
+    metric = prometheus_client.REGISTRY._names_to_collectors.get(name)
+    if metric is None:
+        metric = getattr(prometheus_client, metric_type)(name, documentation, labels, **kwargs)
+    if metric_type in ("Counter", "Histogram"):
+        # Gauges are left out: a worker's value (e.g. its share of the
+        # rate limit) is not the coordinator's
+        metric = _forwarded[name] = _ForwardedMetric(name, metric)
+    return metric
+
+
+# Time spent in each stage e.g. results_page, page_load, extract,
+# item_exists, json_write, image_save, db_insert
+STAGE_SECONDS = _metric(
+    "Histogram",
+    "dcp_stage_duration_seconds",
+    "Time spent in each pipeline stage",
+    ["stage"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60))
+
+# Exceptions raised in each stage
+STAGE_ERRORS = _metric(
+    "Counter",
+    "dcp_stage_errors_total",
+    "Exceptions raised in each pipeline stage",
+    ["stage"])
+
+# Recipe items by outcome: scraped, skipped (already stored),
+# duplicate (already seen by an earlier search of a batch), empty (not found / no data) or error
+ITEMS = _metric(
+    "Counter",
+    "dcp_items_total",
+    "Recipe items processed by outcome",
+    ["outcome"])
+
+# Results pages processed
+RESULTS_PAGES = _metric(
+    "Counter",
+    "dcp_results_pages_total",
+    "Search results pages processed",
+    [])
+
+
+# Per host limits set by the rate limiter (package.utils.rate_limit)
+RATE_LIMIT = _metric(
+    "Gauge",
+    "dcp_rate_limit_requests_per_second",
+    "Requests per second allowed to each host",
+    ["host"])
+
+CONCURRENCY_LIMIT = _metric(
+    "Gauge",
+    "dcp_concurrency_limit",
+    "Requests allowed in flight to each host",
+    ["host"])
+
+IN_FLIGHT = _metric(
+    "Gauge",
+    "dcp_requests_in_flight",
+    "Requests in flight to each host",
+    ["host"])
+
+# Backoffs by reason: slow, timeout, throttled (429) or server_error (5xx)
+BACKOFFS = _metric(
+    "Counter",
+    "dcp_backoffs_total",
+    "Responses which made the rate limiter back off",
+    ["host", "reason"])
+
+
+# Retries and circuit breakers per dependency (package.utils.retry):
+# browser, storage or database
+RETRIES = _metric(
+    "Counter",
+    "dcp_retries_total",
+    "Calls retried after a transient error",
+    ["dependency"])
+
+CIRCUIT_OPEN = _metric(
+    "Gauge",
+    "dcp_circuit_open",
+    "1 while the dependency's circuit breaker is open",
+    ["dependency"])
+
+# Items given up on, by the stage which failed
+DEAD_LETTERS = _metric(
+    "Counter",
+    "dcp_dead_letters_total",
+    "Items recorded as permanently failed",
+    ["stage"])
+
+
+# Browser sessions recycled, by reason: pages, rss, crashed or hung
+SESSION_RECYCLES = _metric(
+    "Counter",
+    "dcp_browser_recycles_total",
+    "Browser sessions quit and relaunched",
+    ["reason"])
+
+# Resident memory of the browser's processes at the last check
+BROWSER_RSS = _metric(
+    "Gauge",
+    "dcp_browser_rss_bytes",
+    "Resident memory of chromedriver and Chrome",
+    [])
+
+
+# Crawl jobs run by the daemon, by outcome: done or failed
+DAEMON_JOBS = _metric(
+    "Counter",
+    "dcp_daemon_jobs_total",
+    "Crawl jobs run by the daemon",
+    ["state"])
+
+DAEMON_QUEUED = _metric(
+    "Gauge",
+    "dcp_daemon_jobs_queued",
+    "Crawl jobs waiting for a scraper",
+    [])
+
+# Page cache lookups by outcome: hit, miss or expired, and pages evicted
+PAGE_CACHE = _metric(
+    "Counter",
+    "dcp_page_cache_total",
+    "Page cache lookups (and evictions)",
+    ["outcome"])
+
+PAGE_CACHE_BYTES = _metric(
+    "Gauge",
+    "dcp_page_cache_bytes",
+    "Compressed size of the pages in the page cache",
+    [])
+
+
+@contextmanager
+def time_stage(stage: str):
+    """Context manager which records the duration (and any exception)
+    of a pipeline stage, and a trace span / profile attribution for it
+    when tracing / profiling is enabled
+
+    Parameters
+    ----------
+    stage : str
+        The stage name
+    """
+    start = time.perf_counter()
+    try:
+        with tracing.span(stage, "stage"), profiling.stage(stage):
+            yield
+    except Exception:
+        STAGE_ERRORS.labels(stage).inc()
+        raise
+    finally:
+        STAGE_SECONDS.labels(stage).observe(time.perf_counter() - start)
+
+
+def count_item(outcome: str):
+    """Counts a recipe item by outcome
+
+    Parameters
+    ----------
+    outcome : str
+        One of scraped, skipped, duplicate, empty or error
+    """
+    ITEMS.labels(outcome).inc()
+
+
+def forward_updates(forward: bool = True):
+    """Starts (or stops) recording the updates of the counters and
+    histograms in this (worker) process, for `take_updates`
+
+    Parameters
+    ----------
+    forward : bool, optional
+        False to stop recording, by default True
+    """
+    global _updates
+    _updates = [] if forward else None
+
+
+def take_updates() -> list:
+    """Returns the updates recorded since the last call, to send to the
+    coordinator (an empty list unless forwarding)
+
+    Returns
+    -------
+    list
+        (name, label values, method, value) tuples
+    """
+    global _updates
+    if _updates is None:
+        return []
+    updates, _updates = _updates, []
+    return updates
+
+
+def apply_updates(updates: list):
+    """Adds the updates forwarded by a worker process to the metrics of this process
+
+    Parameters
+    ----------
+    updates : list
+        Updates from `take_updates` in the worker
+    """
+    for name, label_values, method, value in updates:
+        metric = _forwarded[name].metric
+        if len(label_values) > 0:
+            metric = metric.labels(*label_values)
+        getattr(metric, method)(value)
+
+
+def start_metrics_server(port: int, addr: str = "0.0.0.0") -> bool:
+    """Publishes the metrics on http://addr:port/metrics from a background thread
+
+    Parameters
+    ----------
+    port : int
+        The port to listen on
+    addr : str, optional
+        The address to listen on, by default all interfaces
+
+    Returns
+    -------
+    bool
+        True if the server was started, False if prometheus_client is not installed
+    """
+    if prometheus_client is None:
+        return False
+    prometheus_client.start_http_server(port, addr)
+    return True
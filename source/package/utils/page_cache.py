@@ -0,0 +1,385 @@
+"""
+An on-disk cache of the pages loaded by a Scraper (search results and
+recipe pages), holding the rendered page source per URL zlib compressed
+in SQLite. A cached page younger than `ttl` seconds is replayed into the
+browser from a local server instead of being loaded from the web site;
+the least recently used pages are evicted to keep the cache under
+`max_mb`. Offline, pages which are not cached are errors, so extraction
+(e.g. after a Locator change) can be re-run with no network. The cached
+pages can also be read directly with `PageCache.pages` to parse them
+without a browser.
+Unlike the HTTP archive, which records or replays a whole run, the cache
+is read through: pages not cached are loaded from the site and cached.
+The cache is process wide: Scraper calls the functions below, which do
+nothing until `activate` is called
+"""
+
+from html import escape
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Iterator
+from . import http_archive
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+_cache = None
+_offline = False
+_settings = None
+_server = None
+_server_lock = threading.Lock()
+
+# Path of a cached page on the local server: /page/<key>
+_PAGE_PATH = "/page/"
+
+# The opening head tag, after which the base URL is inserted
+_HEAD = re.compile(r"<head[^>]*>", re.IGNORECASE)
+
+# Added to a replayed page: relative links resolve to the web site,
+# and the browser fetches nothing (the page is already rendered, so
+# its scripts, styles and images are not needed)
+_REPLAY_HEAD = ('<base href="{url}">'
+    '<meta http-equiv="Content-Security-Policy" content="default-src \'none\'">')
+
+
+class PageCacheMissError(LookupError):
+    """Raised when loading a page which is not cached while offline"""
+
+
+class PageCache:
+    """
+    A SQLite file holding the rendered source of one page per URL,
+    with the time it was cached (for the TTL) and last read (for the
+    LRU eviction). The file may be shared by several processes
+    (e.g. pipeline workers)
+
+    Attributes
+    ----------
+    path : str
+        Path of the SQLite file holding the cache
+    ttl : float
+        Seconds a page is used for after it is cached (None for no expiry)
+    max_bytes : int
+        Most (compressed) bytes of pages held
+    """
+
+    def __init__(self, path: str, ttl: float = 86400.0, max_mb: float = 512.0):
+        """
+        Opens (or creates) a cache at `path`
+
+        Parameters
+        ----------
+        path : str
+            Path of the SQLite file holding the cache
+        ttl : float, optional
+            Seconds a page is used for after it is cached, by default
+            86400 (a day, None for no expiry)
+        max_mb : float, optional
+            Most MB of (compressed) pages held, by default 512
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = int(max_mb * 2**20)
+        folder = os.path.dirname(path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        self.__lock = threading.Lock()
+        self.__conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.__conn.execute("PRAGMA journal_mode=WAL")
+        with self.__conn:
+            self.__conn.execute(
+                """CREATE TABLE IF NOT EXISTS pages (
+                    url TEXT PRIMARY KEY,
+                    key TEXT NOT NULL UNIQUE,
+                    body BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    cached_time REAL NOT NULL,
+                    accessed_time REAL NOT NULL)""")
+            self.__conn.execute(
+                "CREATE INDEX IF NOT EXISTS ix_pages_accessed ON pages (accessed_time)")
+
+    def get(self, url: str) -> str:
+        """Returns the page source cached for a URL, unless it has expired
+
+        Parameters
+        ----------
+        url : str
+            The URL of the page
+
+        Returns
+        -------
+        str
+            The page source, or None if the page is not cached (or has expired)
+        """
+        row = self.__read(url)
+        return None if row is None else zlib.decompress(row[1]).decode("utf-8")
+
+    def key(self, url: str) -> str:
+        """Returns the key of a cached page (for the local server), unless it
+        has expired, marking it as used
+
+        Parameters
+        ----------
+        url : str
+            The URL of the page
+
+        Returns
+        -------
+        str
+            The key, or None if the page is not cached (or has expired)
+        """
+        row = self.__read(url, body=False)
+        return None if row is None else _key(url)
+
+    def put(self, url: str, page_source: str):
+        """Caches the source of a page, replacing any earlier copy, then
+        evicts the least recently used pages while the cache is too big
+
+        Parameters
+        ----------
+        url : str
+            The URL of the page
+        page_source : str
+            The page source from the browser
+        """
+        body = zlib.compress(page_source.encode("utf-8"))
+        now = time.time()
+        with self.__lock, self.__conn:
+            self.__conn.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)",
+                (url, _key(url), body, len(body), now, now))
+            total = self.__conn.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+            evicted = 0
+            if total > self.max_bytes:
+                for old_url, size in self.__conn.execute(
+                        "SELECT url, size FROM pages ORDER BY accessed_time").fetchall():
+                    if total <= self.max_bytes or old_url == url:
+                        break
+                    self.__conn.execute("DELETE FROM pages WHERE url = ?", (old_url,))
+                    total -= size
+                    evicted += 1
+        if evicted > 0:
+            logger.debug(f"Evicted {evicted} pages from the page cache")
+            metrics.PAGE_CACHE.labels("evicted").inc(evicted)
+        metrics.PAGE_CACHE_BYTES.set(total)
+
+    def lookup_path(self, path: str) -> tuple:
+        """Returns the response for a page requested from the local server:
+        the page source with the page's URL as its base, and the browser
+        blocked from fetching anything
+
+        Parameters
+        ----------
+        path : str
+            The path requested e.g. /page/<key>
+
+        Returns
+        -------
+        tuple
+            (status, content_type, body), or None if the page is not cached
+        """
+        if not path.startswith(_PAGE_PATH):
+            return None
+        with self.__lock:
+            row = self.__conn.execute(
+                "SELECT url, body FROM pages WHERE key = ?",
+                (path[len(_PAGE_PATH):],)).fetchone()
+        if row is None:
+            return None
+        head = _REPLAY_HEAD.format(url=escape(row[0]))
+        page_source = zlib.decompress(row[1]).decode("utf-8")
+        match = _HEAD.search(page_source)
+        if match is None:
+            page_source = head + page_source
+        else:
+            page_source = page_source[:match.end()] + head + page_source[match.end():]
+        return 200, "text/html; charset=utf-8", page_source.encode("utf-8")
+
+    def pages(self, prefix: str = "") -> Iterator[tuple]:
+        """Yields the cached pages which have not expired, e.g. to run an
+        extractor over them without a browser
+
+        Parameters
+        ----------
+        prefix : str, optional
+            Only the pages whose URL starts with this, by default every page
+
+        Yields
+        ------
+        tuple
+            (url, page_source), by URL
+        """
+        for url in self.urls(prefix):
+            page_source = self.get(url)
+            if page_source is not None:
+                yield url, page_source
+
+    def urls(self, prefix: str = "") -> list:
+        """Returns the URLs of the cached pages (including expired pages)
+
+        Parameters
+        ----------
+        prefix : str, optional
+            Only the URLs which start with this, by default every URL
+        """
+        with self.__lock:
+            return [row[0] for row in self.__conn.execute(
+                "SELECT url FROM pages WHERE substr(url, 1, ?) = ? ORDER BY url",
+                (len(prefix), prefix))]
+
+    def size(self) -> int:
+        """Returns the (compressed) bytes of pages held"""
+        with self.__lock:
+            return self.__conn.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+
+    def clear(self):
+        """Removes every page"""
+        with self.__lock, self.__conn:
+            self.__conn.execute("DELETE FROM pages")
+
+    def close(self):
+        """Closes the cache"""
+        with self.__lock:
+            self.__conn.close()
+
+    def __read(self, url: str, body: bool = True) -> tuple:
+        """Returns (url, body) of a page which has not expired, marking it
+        as used, or None; an expired page is removed"""
+        now = time.time()
+        with self.__lock, self.__conn:
+            row = self.__conn.execute(
+                f"SELECT url, {'body' if body else 'NULL'}, cached_time FROM pages WHERE url = ?",
+                (url,)).fetchone()
+            if row is None:
+                outcome = "miss"
+            elif self.ttl is not None and now - row[2] > self.ttl:
+                self.__conn.execute("DELETE FROM pages WHERE url = ?", (row[0],))
+                outcome = "expired"
+                row = None
+            else:
+                self.__conn.execute(
+                    "UPDATE pages SET accessed_time = ? WHERE url = ?", (now, row[0]))
+                outcome = "hit"
+        metrics.PAGE_CACHE.labels(outcome).inc()
+        return row
+
+
+def activate(
+        path: str,
+        ttl: float = 86400.0,
+        max_mb: float = 512.0,
+        offline: bool = False) -> PageCache:
+    """Starts caching pages in, and replaying them from, a cache
+
+    Parameters
+    ----------
+    path : str
+        Path of the SQLite file holding the cache
+    ttl : float, optional
+        Seconds a page is used for after it is cached, by default 86400 (None for no expiry)
+    max_mb : float, optional
+        Most MB of (compressed) pages held, by default 512
+    offline : bool, optional
+        Only replay cached pages: nothing is loaded from the web site
+        (not even its home page), by default False
+
+    Returns
+    -------
+    PageCache
+        The process cache
+    """
+    global _cache, _offline, _settings
+    deactivate()
+    _cache = PageCache(path, ttl, max_mb)
+    _offline = offline
+    _settings = {"path": path, "ttl": ttl, "max_mb": max_mb, "offline": offline}
+    return _cache
+
+
+def deactivate():
+    """Stops caching and closes the cache"""
+    global _cache, _offline, _settings, _server
+    with _server_lock:
+        if _server is not None:
+            _server.stop()
+            _server = None
+    if _cache is not None:
+        _cache.close()
+    _cache = None
+    _offline = False
+    _settings = None
+
+
+def active() -> bool:
+    """Returns True if pages are cached"""
+    return _cache is not None
+
+
+def offline() -> bool:
+    """Returns True if only cached pages are loaded"""
+    return _offline
+
+
+def settings() -> dict:
+    """Returns the arguments of `activate`, e.g. to activate the cache
+    in a worker process, or None if the cache is not active"""
+    return None if _settings is None else dict(_settings)
+
+
+def browser_url(url: str) -> str:
+    """Returns the URL a browser should load to replay a cached page
+
+    Parameters
+    ----------
+    url : str
+        The URL on the web site
+
+    Returns
+    -------
+    str
+        The local server's URL for the page, or None if the page is
+        not cached (or has expired) and should be loaded from the site
+
+    Raises
+    ------
+    PageCacheMissError
+        If the page is not cached and the cache is offline
+    """
+    global _server
+    if _cache is None:
+        return None
+    key = _cache.key(url)
+    if key is None:
+        if _offline:
+            raise PageCacheMissError(f"Not in the page cache: {url}")
+        return None
+    with _server_lock:
+        if _server is None:
+            _server = http_archive.ArchiveServer(_cache)
+        server_url = _server.url
+    return f"{server_url}{_PAGE_PATH.lstrip('/')}{key}"
+
+
+def store(url: str, page_source: str):
+    """Caches a page loaded from the web site, if caching
+
+    Parameters
+    ----------
+    url : str
+        The URL on the web site
+    page_source : str
+        The page source from the browser
+    """
+    if _cache is not None and not _offline:
+        _cache.put(url, page_source)
+
+
+def _key(url: str) -> str:
+    """Returns the key of a URL's page on the local server"""
+    return hashlib.sha1(url.encode("utf-8")).hexdigest()
@@ -0,0 +1,309 @@
+"""
+Opt-in CPU and memory profiling of a pipeline run, attributed to the
+pipeline stages timed by `metrics.time_stage`.
+While enabled the process is profiled with cProfile (written as pstats),
+the profiled thread is sampled to collapsed stacks prefixed with the
+current stage (for flame graph tools), and tracemalloc records the
+memory allocated in each stage. Every N results pages a tracemalloc
+snapshot is written, and the next call of each stage is bracketed by
+snapshots to find its top allocating lines.
+Instrumented code calls `stage` / `page_done`, which do nothing
+until `enable_profiling` is called
+"""
+
+from collections import Counter
+from contextlib import contextmanager
+import cProfile
+import json
+import os
+import sys
+import threading
+import tracemalloc
+
+_profiler = None
+
+
+class _StageMemory:
+    """Memory statistics for one stage"""
+
+    def __init__(self):
+        self.calls = 0
+        self.net_bytes = 0
+        self.peak_bytes = 0
+        self.top_allocators = Counter()
+
+
+class PipelineProfiler:
+    """
+    Profiles the thread which starts it, writing to `output_folder`:
+    cpu.pstats, cpu.collapsed, memory-page-<n>.snapshot files
+    and memory_report.json / memory_report.txt
+
+    Attributes
+    ----------
+    output_folder : str
+        The folder the profile files are written to
+    snapshot_every : int
+        Number of results pages between memory snapshots
+    sample_interval : float
+        Seconds between stack samples
+    """
+
+    def __init__(self,
+            output_folder: str,
+            snapshot_every: int = 10,
+            sample_interval: float = 0.01,
+            traceback_frames: int = 10,
+            top_n: int = 10):
+        """
+        Parameters
+        ----------
+        output_folder : str
+            The folder the profile files are written to
+        snapshot_every : int, optional
+            Number of results pages between memory snapshots, by default 10
+        sample_interval : float, optional
+            Seconds between stack samples, by default 0.01
+        traceback_frames : int, optional
+            Frames stored by tracemalloc per allocation, by default 10
+        top_n : int, optional
+            Number of allocating lines reported, by default 10
+        """
+        self.output_folder = output_folder
+        self.snapshot_every = snapshot_every
+        self.sample_interval = sample_interval
+        self.__traceback_frames = traceback_frames
+        self.__top_n = top_n
+        self.__cpu = cProfile.Profile()
+        self.__stacks = Counter()
+        self.__stages = {}
+        self.__stage_stack = []
+        self.__pages = 0
+        self.__snapshots = []
+        # Stages whose next call is bracketed by snapshots
+        self.__pending_detail = set()
+        self.__thread_id = None
+        self.__stop = threading.Event()
+        self.__sampler = None
+
+    def start(self):
+        """Starts profiling the calling thread"""
+        os.makedirs(self.output_folder, exist_ok=True)
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.__traceback_frames)
+        self.__thread_id = threading.get_ident()
+        self.__sampler = threading.Thread(
+            target=self.__sample, name="profile-sampler", daemon=True)
+        self.__sampler.start()
+        self.__cpu.enable()
+
+    def stop(self):
+        """Stops profiling and writes the profile files"""
+        self.__cpu.disable()
+        self.__stop.set()
+        if self.__sampler is not None:
+            self.__sampler.join()
+        self.__take_snapshot("final")
+        tracemalloc.stop()
+        self.__cpu.dump_stats(os.path.join(self.output_folder, "cpu.pstats"))
+        with open(os.path.join(self.output_folder, "cpu.collapsed"), "w") as f:
+            for stack, count in self.__stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        report = self.report()
+        with open(os.path.join(self.output_folder, "memory_report.json"), "w") as f:
+            json.dump(report, f, indent=4)
+        with open(os.path.join(self.output_folder, "memory_report.txt"), "w") as f:
+            f.write(self.format_report(report))
+
+    @contextmanager
+    def stage(self, name: str):
+        """Context manager which attributes CPU samples and
+        memory allocated while it is open to a stage
+
+        Parameters
+        ----------
+        name : str
+            The stage name
+        """
+        if threading.get_ident() != self.__thread_id:
+            # Only the profiled thread is attributed
+            yield
+            return
+        stats = self.__stages.setdefault(name, _StageMemory())
+        # Peak memory and allocator detail are only measured for outermost stages
+        outermost = not self.__stage_stack
+        detail = outermost and name in self.__pending_detail
+        before = self.__snapshot() if detail else None
+        start_bytes, _ = tracemalloc.get_traced_memory()
+        if outermost:
+            tracemalloc.reset_peak()
+        self.__stage_stack.append(name)
+        try:
+            yield
+        finally:
+            self.__stage_stack.pop()
+            end_bytes, peak_bytes = tracemalloc.get_traced_memory()
+            stats.calls += 1
+            stats.net_bytes += end_bytes - start_bytes
+            if outermost:
+                stats.peak_bytes = max(stats.peak_bytes, peak_bytes - start_bytes)
+            if detail:
+                self.__pending_detail.discard(name)
+                after = self.__snapshot()
+                for diff in after.compare_to(before, "lineno")[:self.__top_n]:
+                    if diff.size_diff > 0:
+                        frame = diff.traceback[0]
+                        stats.top_allocators[f"{frame.filename}:{frame.lineno}"] += diff.size_diff
+
+    def page_done(self):
+        """Counts a results page, writing a memory snapshot every `snapshot_every` pages"""
+        self.__pages += 1
+        if self.__pages % self.snapshot_every == 0:
+            self.__take_snapshot(f"page-{self.__pages}")
+            self.__pending_detail = set(self.__stages)
+
+    def report(self) -> dict:
+        """Returns the memory statistics
+
+        Returns
+        -------
+        dict
+            Per stage calls, net and peak bytes and top allocating lines,
+            and the traced memory and top allocating lines at each snapshot
+        """
+        stages = {}
+        for name, stats in sorted(self.__stages.items(), key=lambda s: s[1].net_bytes, reverse=True):
+            stages[name] = {
+                "calls": stats.calls,
+                "net_bytes": stats.net_bytes,
+                "peak_bytes": stats.peak_bytes,
+                "top_allocators": [
+                    {"line": line, "bytes": size}
+                    for line, size in stats.top_allocators.most_common(self.__top_n)]
+            }
+        return {"pages": self.__pages, "stages": stages, "snapshots": self.__snapshots}
+
+    def format_report(self, report: dict = None) -> str:
+        """Formats the memory report as text
+
+        Parameters
+        ----------
+        report : dict, optional
+            A report from `report`, by default the current one
+
+        Returns
+        -------
+        str
+            The report
+        """
+        report = self.report() if report is None else report
+        lines = [f"{'stage':<20} {'calls':>7} {'net KiB':>10} {'peak KiB':>10}"]
+        for name, stats in report["stages"].items():
+            lines.append(f"{name[:20]:<20} {stats['calls']:>7} "
+                f"{stats['net_bytes'] / 1024:>10.1f} {stats['peak_bytes'] / 1024:>10.1f}")
+            for allocator in stats["top_allocators"]:
+                lines.append(f"    {allocator['bytes'] / 1024:>10.1f} KiB  {allocator['line']}")
+        for snapshot in report["snapshots"]:
+            lines.append(f"\nsnapshot {snapshot['label']}: {snapshot['traced_bytes'] / 1024:.1f} KiB traced")
+            for allocator in snapshot["top_allocators"]:
+                lines.append(f"    {allocator['bytes'] / 1024:>10.1f} KiB  {allocator['line']}")
+        return "\n".join(lines) + "\n"
+
+    def __take_snapshot(self, label: str):
+        """Writes a tracemalloc snapshot and records its top allocating lines
+
+        Parameters
+        ----------
+        label : str
+            Label for the snapshot file e.g. page-10
+        """
+        if not tracemalloc.is_tracing():
+            return
+        snapshot = self.__snapshot()
+        snapshot.dump(os.path.join(self.output_folder, f"memory-{label}.snapshot"))
+        traced_bytes, _ = tracemalloc.get_traced_memory()
+        self.__snapshots.append({
+            "label": label,
+            "traced_bytes": traced_bytes,
+            "top_allocators": [
+                {"line": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}", "bytes": stat.size}
+                for stat in snapshot.statistics("lineno")[:self.__top_n]]
+        })
+
+    def __snapshot(self) -> tracemalloc.Snapshot:
+        """Takes a tracemalloc snapshot excluding the profiler's own allocations"""
+        return tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__)])
+
+    def __sample(self):
+        """Samples the profiled thread's stack until stopped"""
+        while not self.__stop.wait(self.sample_interval):
+            frame = sys._current_frames().get(self.__thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)})")
+                frame = frame.f_back
+            stage = self.__stage_stack[-1] if self.__stage_stack else "other"
+            self.__stacks[";".join([stage] + stack[::-1])] += 1
+
+
+def enable_profiling(output_folder: str, snapshot_every: int = 10) -> PipelineProfiler:
+    """Starts profiling the calling thread
+
+    Parameters
+    ----------
+    output_folder : str
+        The folder the profile files are written to
+    snapshot_every : int, optional
+        Number of results pages between memory snapshots, by default 10
+
+    Returns
+    -------
+    PipelineProfiler
+        The process profiler
+    """
+    global _profiler
+    disable_profiling()
+    _profiler = PipelineProfiler(output_folder, snapshot_every)
+    _profiler.start()
+    return _profiler
+
+
+def disable_profiling():
+    """Stops profiling and writes the profile files"""
+    global _profiler
+    if _profiler is not None:
+        profiler, _profiler = _profiler, None
+        profiler.stop()
+
+
+def get_profiler() -> PipelineProfiler:
+    """Returns the process profiler, or None if profiling is not enabled"""
+    return _profiler
+
+
+@contextmanager
+def stage(name: str):
+    """Attributes CPU and memory to a stage if profiling is enabled
+
+    Parameters
+    ----------
+    name : str
+        The stage name
+    """
+    profiler = _profiler
+    if profiler is None:
+        yield
+    else:
+        with profiler.stage(name):
+            yield
+
+
+def page_done():
+    """Counts a results page if profiling is enabled"""
+    if _profiler is not None:
+        _profiler.page_done()
@@ -0,0 +1,404 @@
+"""
+Per host politeness and flow control for page loads and image downloads.
+Each host has a token bucket limiting the request rate and an AIMD
+(additive increase, multiplicative decrease) controller limiting the
+requests in flight. While responses are fast and successful the rate and
+concurrency limits grow additively; a slow response, a timeout, a 429
+(Too Many Requests) or a 5xx response cuts both multiplicatively (at most
+once per cooldown, so a burst of failures backs off once) and a
+Retry-After pauses the host. The limits are exported as metrics.
+The limiters are process wide: Scraper and the storages call `request`,
+so page loads and image downloads from the same host share one limit.
+The concurrency limit only binds when several threads make requests, i.e.
+the daemon's scrapers; a pipeline run makes one request at a time, so only
+the rate limit paces it. Limiters are not shared between processes: each
+parallel_pipeline worker adapts its own share of the rate, and a worker
+backing off does not slow the others
+"""
+
+from contextlib import contextmanager, nullcontext
+from urllib.parse import urlsplit
+import logging
+import threading
+import time
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Outcomes of a request
+OK = "ok"
+SLOW = "slow"
+TIMEOUT = "timeout"
+THROTTLED = "throttled"
+SERVER_ERROR = "server_error"
+
+# Settings of limiters created from now on, see `configure`
+_settings = {
+    "rate": 2.0,
+    "burst": 4,
+    "min_rate": 0.2,
+    "max_rate": 10.0,
+    "rate_step": 0.1,
+    "concurrency": 2,
+    "max_concurrency": 8,
+    "decrease": 0.5,
+    "latency_target": 5.0,
+    "cooldown": 5.0
+}
+_enabled = True
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+class TokenBucket:
+    """
+    Allows `rate` requests per second on average, with bursts of up to `burst`
+
+    Attributes
+    ----------
+    rate : float
+        Tokens added per second
+    burst : float
+        Most tokens held
+    """
+
+    def __init__(self, rate: float, burst: float):
+        """
+        Parameters
+        ----------
+        rate : float
+            Tokens added per second
+        burst : float
+            Most tokens held, and the tokens held at the start
+        """
+        self.rate = rate
+        self.burst = burst
+        self.__tokens = burst
+        self.__updated = time.monotonic()
+        self.__paused_until = 0.0
+        self.__lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Takes a token, waiting for one if needed
+
+        Returns
+        -------
+        float
+            Seconds waited
+        """
+        waited = 0.0
+        while True:
+            with self.__lock:
+                now = time.monotonic()
+                self.__tokens = min(self.burst, self.__tokens + (now - self.__updated) * self.rate)
+                self.__updated = now
+                if now >= self.__paused_until and self.__tokens >= 1:
+                    self.__tokens -= 1
+                    return waited
+                wait = max(self.__paused_until - now, (1 - self.__tokens) / self.rate)
+            time.sleep(wait)
+            waited += wait
+
+    def pause(self, seconds: float):
+        """Gives no tokens for `seconds` e.g. as asked by a Retry-After header
+
+        Parameters
+        ----------
+        seconds : float
+            Seconds to pause for
+        """
+        with self.__lock:
+            self.__paused_until = max(self.__paused_until, time.monotonic() + seconds)
+            self.__tokens = 0
+
+
+class HostLimiter:
+    """
+    The token bucket and AIMD concurrency controller for one host
+
+    Attributes
+    ----------
+    host : str
+        The host name
+    limit : float
+        The most requests in flight (the integer part is used)
+    in_flight : int
+        The requests in flight
+    latency : float
+        Moving average of the successful response times, in seconds
+    """
+
+    def __init__(self,
+            host: str,
+            rate: float = 2.0,
+            burst: float = 4,
+            min_rate: float = 0.2,
+            max_rate: float = 10.0,
+            rate_step: float = 0.1,
+            concurrency: int = 2,
+            max_concurrency: int = 8,
+            decrease: float = 0.5,
+            latency_target: float = 5.0,
+            cooldown: float = 5.0):
+        """
+        Parameters
+        ----------
+        host : str
+            The host name
+        rate : float, optional
+            Requests per second to start at, by default 2
+        burst : float, optional
+            Requests allowed at once after an idle period, by default 4
+        min_rate : float, optional
+            The lowest rate backed off to, by default 0.2
+        max_rate : float, optional
+            The highest rate increased to, by default 10
+        rate_step : float, optional
+            Requests per second added after each healthy response, by default 0.1
+        concurrency : int, optional
+            Requests in flight to start at, by default 2
+        max_concurrency : int, optional
+            The most requests in flight increased to, by default 8
+        decrease : float, optional
+            Factor the limits are multiplied by when backing off, by default 0.5
+        latency_target : float, optional
+            Responses slower than this many seconds count as a slowdown, by default 5
+        cooldown : float, optional
+            Seconds after backing off before backing off again, by default 5
+        """
+        self.host = host
+        self.limit = float(concurrency)
+        self.in_flight = 0
+        self.latency = None
+        self.__bucket = TokenBucket(rate, burst)
+        self.__min_rate = min_rate
+        self.__max_rate = max_rate
+        self.__rate_step = rate_step
+        self.__max_concurrency = max_concurrency
+        self.__decrease = decrease
+        self.__latency_target = latency_target
+        self.__cooldown = cooldown
+        self.__last_backoff = -cooldown
+        self.__condition = threading.Condition()
+        self.__export()
+
+    @property
+    def rate(self) -> float:
+        """The requests per second allowed"""
+        return self.__bucket.rate
+
+    @contextmanager
+    def request(self):
+        """Context manager holding a concurrency slot and a token for one
+        request; the outcome is taken from the response time, or from any
+        exception raised (a timeout, or an HTTP error with a status code).
+        Call `record` on the yielded Request to report a status code
+
+        Yields
+        ------
+        Request
+            Records the outcome of the request
+        """
+        with self.__condition:
+            while self.in_flight >= int(self.limit):
+                self.__condition.wait()
+            self.in_flight += 1
+        metrics.IN_FLIGHT.labels(self.host).set(self.in_flight)
+        request = Request()
+        try:
+            self.__bucket.acquire()
+            start = time.perf_counter()
+            try:
+                yield request
+            except Exception as e:
+                request.record_exception(e)
+                raise
+            finally:
+                self.__done(request, time.perf_counter() - start)
+        finally:
+            with self.__condition:
+                self.in_flight -= 1
+                self.__condition.notify()
+            metrics.IN_FLIGHT.labels(self.host).set(self.in_flight)
+
+    def backoff(self, outcome: str, retry_after: float = None):
+        """Cuts the rate and concurrency limits, unless backed off within the cooldown
+
+        Parameters
+        ----------
+        outcome : str
+            SLOW, TIMEOUT, THROTTLED or SERVER_ERROR
+        retry_after : float, optional
+            Seconds the host asked to wait (Retry-After), by default None
+        """
+        metrics.BACKOFFS.labels(self.host, outcome).inc()
+        if retry_after is not None:
+            self.__bucket.pause(retry_after)
+        with self.__condition:
+            now = time.monotonic()
+            if now - self.__last_backoff < self.__cooldown:
+                return
+            self.__last_backoff = now
+            self.limit = max(1.0, self.limit * self.__decrease)
+            self.__bucket.rate = max(self.__min_rate, self.__bucket.rate * self.__decrease)
+        logger.warning(f"Backing off {self.host} after {outcome}: {self.rate:.2f} requests/s, "
+            f"{int(self.limit)} in flight", extra={"stage": "rate_limit"})
+        self.__export()
+
+    def __done(self, request: "Request", seconds: float):
+        """Adjusts the limits for the outcome of a request
+
+        Parameters
+        ----------
+        request : Request
+            The request
+        seconds : float
+            The response time
+        """
+        outcome = request.outcome
+        if outcome == OK and seconds > self.__latency_target:
+            outcome = SLOW
+        if outcome != OK:
+            self.backoff(outcome, request.retry_after)
+            return
+        with self.__condition:
+            self.latency = seconds if self.latency is None else 0.8 * self.latency + 0.2 * seconds
+            # One more slot per `limit` healthy responses
+            self.limit = min(float(self.__max_concurrency), self.limit + 1 / self.limit)
+            self.__bucket.rate = min(self.__max_rate, self.__bucket.rate + self.__rate_step)
+            self.__condition.notify()
+        self.__export()
+
+    def __export(self):
+        """Publishes the limits as metrics"""
+        metrics.RATE_LIMIT.labels(self.host).set(self.rate)
+        metrics.CONCURRENCY_LIMIT.labels(self.host).set(int(self.limit))
+
+
+class Request:
+    """
+    The outcome of a request made through a HostLimiter
+
+    Attributes
+    ----------
+    outcome : str
+        OK, TIMEOUT, THROTTLED or SERVER_ERROR
+    retry_after : float
+        Seconds the host asked to wait, or None
+    """
+
+    def __init__(self):
+        self.outcome = OK
+        self.retry_after = None
+
+    def record(self, status: int, retry_after: str = None):
+        """Records the HTTP status of the response
+
+        Parameters
+        ----------
+        status : int
+            The HTTP status code (None or 0 if unknown)
+        retry_after : str, optional
+            The Retry-After header, by default None
+        """
+        if status == 429:
+            self.outcome = THROTTLED
+        elif status is not None and status >= 500:
+            self.outcome = SERVER_ERROR
+        if retry_after is not None:
+            try:
+                self.retry_after = float(retry_after)
+            except ValueError:
+                # An HTTP date rather than seconds
+                self.retry_after = None
+
+    def record_exception(self, e: Exception):
+        """Records the outcome of a request which raised an exception:
+        a timeout, or an HTTP error with a status code
+
+        Parameters
+        ----------
+        e : Exception
+            The exception raised
+        """
+        if "Timeout" in type(e).__name__ or isinstance(e, TimeoutError):
+            self.outcome = TIMEOUT
+            return
+        # urllib HTTPError has code, requests HTTPError has response.status_code
+        response = getattr(e, "response", None)
+        status = getattr(e, "code", None) or getattr(response, "status_code", None)
+        headers = getattr(e, "headers", None) or getattr(response, "headers", None)
+        if isinstance(status, int):
+            self.record(status, headers.get("Retry-After") if headers is not None else None)
+
+
+def configure(enabled: bool = None, **settings):
+    """Sets the limits of the limiters created from now on, and
+    forgets existing ones, e.g. from the command line
+
+    Parameters
+    ----------
+    enabled : bool, optional
+        Limit requests (e.g. False for benchmarks against a local
+        server), by default unchanged
+    **settings
+        The keyword arguments of HostLimiter (other than host)
+    """
+    global _enabled
+    unknown = set(settings) - set(_settings)
+    if unknown:
+        raise ValueError(f"Unknown rate limit settings: {sorted(unknown)}")
+    with _limiters_lock:
+        if enabled is not None:
+            _enabled = enabled
+        _settings.update(settings)
+        _limiters.clear()
+
+
+def enabled() -> bool:
+    """Returns True if requests are limited"""
+    return _enabled
+
+
+def settings() -> dict:
+    """Returns the settings of new limiters"""
+    return dict(_settings)
+
+
+def get_limiter(url: str) -> HostLimiter:
+    """Returns the limiter for the host of a URL, creating it if needed
+
+    Parameters
+    ----------
+    url : str
+        The URL
+
+    Returns
+    -------
+    HostLimiter
+        The host's limiter
+    """
+    host = urlsplit(url).netloc or url
+    with _limiters_lock:
+        if host not in _limiters:
+            _limiters[host] = HostLimiter(host, **_settings)
+        return _limiters[host]
+
+
+def request(url: str):
+    """Context manager holding a slot and a token of the URL's host
+    for one request, see HostLimiter.request
+
+    Parameters
+    ----------
+    url : str
+        The URL requested
+
+    Returns
+    -------
+    ContextManager[Request]
+        Context manager yielding the Request to record a status code on
+    """
+    if not _enabled:
+        return nullcontext(Request())
+    return get_limiter(url).request()
@@ -0,0 +1,304 @@
+"""
+Retries and circuit breakers for the calls the pipeline makes to its
+dependencies: the browser (page loads), the file storage (local files or
+S3) and the database. A call raising a transient error (a timeout, a
+dropped connection, a 429 or 5xx response, a database disconnection) is
+retried with exponential backoff and full jitter; any other error is
+raised at once. Each dependency has a circuit breaker: after a run of
+transient failures it opens and calls fail fast with CircuitOpenError
+until it has been open for `reset_timeout` seconds, when one trial call
+is let through. Errors are classified by class name (and status code),
+so the optional libraries need not be imported.
+The breakers are process wide, like the rate limiters
+"""
+
+import logging
+import random
+import threading
+import time
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Dependencies
+BROWSER = "browser"
+STORAGE = "storage"
+DATABASE = "database"
+
+# Exception class names (in any library) of transient errors
+_TRANSIENT = {
+    # Python, urllib and requests
+    "ConnectionError", "TimeoutError", "URLError", "IncompleteRead",
+    "ConnectTimeout", "ReadTimeout", "ChunkedEncodingError",
+    # Selenium
+    "TimeoutException", "StaleElementReferenceException",
+    # botocore
+    "EndpointConnectionError", "ConnectionClosedError", "ReadTimeoutError",
+    # SQLAlchemy and psycopg2
+    "OperationalError", "DisconnectionError", "InterfaceError"
+}
+
+# S3 error codes which are worth retrying
+_TRANSIENT_CODES = {"Throttling", "ThrottlingException", "SlowDown", "RequestTimeout",
+    "InternalError", "ServiceUnavailable"}
+
+# Settings of the retries and breakers, see `configure`
+_settings = {
+    "attempts": 3,
+    "base_delay": 0.5,
+    "max_delay": 30.0,
+    "failure_threshold": 5,
+    "reset_timeout": 60.0
+}
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling a dependency whose circuit breaker is open"""
+
+
+class CircuitBreaker:
+    """
+    Fails calls to a dependency fast after a run of transient failures
+
+    Attributes
+    ----------
+    name : str
+        The dependency
+    failures : int
+        Transient failures since the last success
+    """
+
+    def __init__(self,
+            name: str,
+            failure_threshold: int = 5,
+            reset_timeout: float = 60.0):
+        """
+        Parameters
+        ----------
+        name : str
+            The dependency
+        failure_threshold : int, optional
+            Consecutive transient failures which open the breaker, by default 5
+        reset_timeout : float, optional
+            Seconds the breaker stays open before a trial call, by default 60
+        """
+        self.name = name
+        self.failures = 0
+        self.__failure_threshold = failure_threshold
+        self.__reset_timeout = reset_timeout
+        self.__opened = None
+        self.__trial = False
+        self.__lock = threading.Lock()
+        metrics.CIRCUIT_OPEN.labels(name).set(0)
+
+    @property
+    def is_open(self) -> bool:
+        """True while calls fail fast"""
+        return self.__opened is not None
+
+    def before(self):
+        """Checks a call can be made
+
+        Raises
+        ------
+        CircuitOpenError
+            If the breaker is open (and not ready for a trial call)
+        """
+        with self.__lock:
+            if self.__opened is None:
+                return
+            if not self.__trial and time.monotonic() - self.__opened >= self.__reset_timeout:
+                # Half open: let one call through to test the dependency
+                self.__trial = True
+                return
+        raise CircuitOpenError(f"The {self.name} circuit breaker is open after "
+            f"{self.failures} failures")
+
+    def success(self):
+        """Records a successful call, closing the breaker"""
+        with self.__lock:
+            reopened = self.__opened is not None
+            self.failures = 0
+            self.__opened = None
+            self.__trial = False
+        if reopened:
+            logger.info(f"Closed the {self.name} circuit breaker", extra={"stage": "retry"})
+            metrics.CIRCUIT_OPEN.labels(self.name).set(0)
+
+    def failure(self):
+        """Records a transient failure, opening the breaker after
+        `failure_threshold` in a row or when a trial call fails"""
+        with self.__lock:
+            self.failures += 1
+            if self.__opened is not None:
+                if not self.__trial:
+                    return
+                # The trial call failed: wait another reset_timeout
+                self.__trial = False
+            elif self.failures < self.__failure_threshold:
+                return
+            self.__opened = time.monotonic()
+        logger.error(f"Opened the {self.name} circuit breaker after {self.failures} failures",
+            extra={"stage": "retry"})
+        metrics.CIRCUIT_OPEN.labels(self.name).set(1)
+
+
+def root_cause(e: BaseException) -> BaseException:
+    """Returns the exception raised by the code which failed, rather
+    than the RuntimeError the log decorator wrapped it in
+
+    Parameters
+    ----------
+    e : BaseException
+        The exception caught
+
+    Returns
+    -------
+    BaseException
+        The original exception
+    """
+    while type(e).__name__ == "_LoggedError" and e.__cause__ is not None:
+        e = e.__cause__
+    return e
+
+
+def is_transient(e: BaseException) -> bool:
+    """Returns True if an error is worth retrying
+
+    Parameters
+    ----------
+    e : BaseException
+        The exception raised (or the log decorator's RuntimeError wrapping it)
+
+    Returns
+    -------
+    bool
+        True for timeouts, dropped connections, 429 and 5xx responses
+        and database disconnections
+    """
+    e = root_cause(e)
+    if isinstance(e, CircuitOpenError):
+        return False
+    # urllib HTTPError has code, requests HTTPError has response.status_code,
+    # botocore ClientError has a response dictionary
+    response = getattr(e, "response", None)
+    if isinstance(response, dict):
+        code = response.get("Error", {}).get("Code")
+        status = response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+        return code in _TRANSIENT_CODES or (isinstance(status, int) and status >= 500)
+    status = getattr(e, "code", None) or getattr(response, "status_code", None)
+    if isinstance(status, int):
+        return status == 429 or status >= 500
+    return any(cls.__name__ in _TRANSIENT for cls in type(e).__mro__)
+
+
+def configure(**settings):
+    """Sets the retries and breaker limits, forgetting the breakers'
+    state, e.g. from the command line
+
+    Parameters
+    ----------
+    **settings
+        attempts (calls including the first, 1 for no retries),
+        base_delay and max_delay (seconds), failure_threshold and reset_timeout
+    """
+    unknown = set(settings) - set(_settings)
+    if unknown:
+        raise ValueError(f"Unknown retry settings: {sorted(unknown)}")
+    with _breakers_lock:
+        _settings.update(settings)
+        _breakers.clear()
+
+
+def settings() -> dict:
+    """Returns the retries and breaker settings"""
+    return dict(_settings)
+
+
+def get_breaker(dependency: str) -> CircuitBreaker:
+    """Returns the circuit breaker of a dependency, creating it if needed
+
+    Parameters
+    ----------
+    dependency : str
+        BROWSER, STORAGE or DATABASE
+
+    Returns
+    -------
+    CircuitBreaker
+        The dependency's breaker
+    """
+    with _breakers_lock:
+        if dependency not in _breakers:
+            _breakers[dependency] = CircuitBreaker(
+                dependency, _settings["failure_threshold"], _settings["reset_timeout"])
+        return _breakers[dependency]
+
+
+def delay(attempt: int) -> float:
+    """Returns the seconds to wait before retrying: exponential
+    backoff with full jitter, so workers which failed together
+    do not retry together
+
+    Parameters
+    ----------
+    attempt : int
+        The attempt which failed, from 1
+
+    Returns
+    -------
+    float
+        Seconds to wait
+    """
+    return random.uniform(0, min(_settings["max_delay"], _settings["base_delay"] * 2 ** (attempt - 1)))
+
+
+def call(dependency: str, func, *args, **kwargs):
+    """Calls `func(*args, **kwargs)` through the dependency's circuit
+    breaker, retrying transient errors
+
+    Parameters
+    ----------
+    dependency : str
+        BROWSER, STORAGE or DATABASE
+    func : Callable
+        The call to make; it must be safe to repeat
+
+    Returns
+    -------
+    Any
+        The result of `func`
+
+    Raises
+    ------
+    CircuitOpenError
+        If the dependency's breaker is open
+    Exception
+        The error raised by the last attempt
+    """
+    breaker = get_breaker(dependency)
+    attempt = 1
+    while True:
+        breaker.before()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            if not is_transient(e):
+                # The dependency answered, e.g. the page has no recipe
+                breaker.success()
+                raise
+            breaker.failure()
+            if attempt >= _settings["attempts"] or breaker.is_open:
+                raise
+            wait = delay(attempt)
+            cause = root_cause(e)
+            logger.warning(f"Retrying {getattr(func, '__name__', dependency)} in {wait:.1f}s "
+                f"after {type(cause).__name__}: {cause}", extra={"stage": "retry"})
+            metrics.RETRIES.labels(dependency).inc()
+            time.sleep(wait)
+            attempt += 1
+            continue
+        breaker.success()
+        return result
@@ -0,0 +1,158 @@
+"""
+Opt-in tracing of pipeline spans (results pages, recipe pages, page loads,
+extraction, serialisation, image saves, DB inserts) in the Chrome trace event
+format, so a run can be opened in Perfetto or chrome://tracing.
+Tracing is process wide: instrumented code calls `span` which does nothing
+until `enable_tracing` is called
+"""
+
+import atexit
+from contextlib import contextmanager
+import json
+import os
+import threading
+import time
+
+_tracer = None
+
+
+class Tracer:
+    """
+    Writes complete ("X") trace events to a file as they finish, using
+    the JSON array format so memory stays flat on long runs and a trace
+    from a killed process can still be loaded
+
+    Attributes
+    ----------
+    path : str
+        The trace file
+    """
+
+    def __init__(self, path: str):
+        """
+        Parameters
+        ----------
+        path : str
+            The trace file to write
+        """
+        self.path = path
+        self.__pid = os.getpid()
+        self.__origin = time.perf_counter()
+        self.__lock = threading.Lock()
+        self.__named_threads = set()
+        self.__file = open(path, "w")
+        self.__file.write("[\n")
+
+    @contextmanager
+    def span(self, name: str, category: str = "pipeline", **args):
+        """Context manager which records a span
+
+        Parameters
+        ----------
+        name : str
+            The span name e.g. navigate
+        category : str, optional
+            The span category, by default "pipeline"
+        args
+            Details shown for the span e.g. url
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            self.__write({
+                "name": name,
+                "cat": category,
+                "ph": "X",
+                "ts": (start - self.__origin) * 1e6,
+                "dur": (end - start) * 1e6,
+                "args": args
+            })
+
+    def __write(self, event: dict):
+        """Writes an event, tagged with the process and thread IDs
+
+        Parameters
+        ----------
+        event : dict
+            The trace event
+        """
+        thread = threading.current_thread()
+        tid = threading.get_native_id()
+        event.update({"pid": self.__pid, "tid": tid})
+        with self.__lock:
+            if self.__file is None:
+                return
+            if tid not in self.__named_threads:
+                # Metadata event so the viewer shows thread names
+                self.__named_threads.add(tid)
+                self.__file.write(json.dumps({
+                    "name": "thread_name", "ph": "M", "pid": self.__pid, "tid": tid,
+                    "args": {"name": thread.name}}) + ",\n")
+            self.__file.write(json.dumps(event, default=str) + ",\n")
+
+    def close(self):
+        """Completes and closes the trace file"""
+        with self.__lock:
+            if self.__file is not None:
+                # Trailing event so the array is valid JSON
+                self.__file.write(json.dumps({
+                    "name": "trace_end", "ph": "i", "s": "g", "pid": self.__pid, "tid": 0,
+                    "ts": (time.perf_counter() - self.__origin) * 1e6}) + "\n]\n")
+                self.__file.close()
+                self.__file = None
+
+
+def enable_tracing(path: str) -> Tracer:
+    """Starts recording spans in this process
+
+    Parameters
+    ----------
+    path : str
+        The trace file to write
+
+    Returns
+    -------
+    Tracer
+        The process tracer
+    """
+    global _tracer
+    disable_tracing()
+    _tracer = Tracer(path)
+    atexit.register(disable_tracing)
+    return _tracer
+
+
+def disable_tracing():
+    """Stops recording spans and closes the trace file"""
+    global _tracer
+    if _tracer is not None:
+        _tracer.close()
+        _tracer = None
+
+
+def get_tracer() -> Tracer:
+    """Returns the process tracer, or None if tracing is not enabled"""
+    return _tracer
+
+
+@contextmanager
+def span(name: str, category: str = "pipeline", **args):
+    """Records a span if tracing is enabled
+
+    Parameters
+    ----------
+    name : str
+        The span name e.g. navigate
+    category : str, optional
+        The span category, by default "pipeline"
+    args
+        Details shown for the span e.g. url
+    """
+    tracer = _tracer
+    if tracer is None:
+        yield
+    else:
+        with tracer.span(name, category, **args):
+            yield
@@ -0,0 +1,338 @@
+"""
+Runs the pipeline in several worker processes, each with its own
+RecipeScraper (and Chrome), file storage and database connection.
+The results pages of a search are counted once by the coordinator and
+split between the workers (worker n of N scrapes pages n+1, n+1+N, ...),
+and the coordinator in the calling
+process shows one progress bar, forwards the workers' log records to the
+log file and their metrics to its /metrics, stops every worker when one
+fails and raises the failure.
+The host's rate limits are shared out between the workers, so together
+they request no faster than one process would at most; each worker adapts
+its share on its own (see rate_limit)
+"""
+
+from __future__ import annotations
+import logging
+import multiprocessing
+import queue
+import traceback
+from logging.handlers import QueueListener
+from typing import Callable
+from tqdm.auto import tqdm
+from package.utils.logger import log
+from package.utils import metrics
+from package.utils import page_cache
+from package.utils import rate_limit
+from package.utils import retry
+
+logger = logging.getLogger("parallel_pipeline")
+
+# Seconds to wait for an event before checking the workers are alive
+_POLL_SECONDS = 1.0
+
+
+class _WorkerFilter(logging.Filter):
+    """Adds the worker number to the log records of a worker process"""
+
+    def __init__(self, worker: int):
+        super().__init__()
+        self.worker = worker
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.worker = self.worker
+        return True
+
+
+def _send_metrics(events: multiprocessing.Queue, index: int):
+    """Sends the metric updates recorded by this worker to the coordinator"""
+    updates = metrics.take_updates()
+    if len(updates) > 0:
+        events.put(("metrics", index, updates))
+
+
+def _worker(
+        index: int,
+        workers: int,
+        search_term: str,
+        results_pages: int,
+        file_store_factory: Callable,
+        db_storage_factory: Callable,
+        website_url: str,
+        frontier_factory: Callable,
+        dead_letters_factory: Callable,
+        rate_limits: dict,
+        retry_settings: dict,
+        cache_settings: dict,
+        events: multiprocessing.Queue,
+        stop: multiprocessing.Event,
+        log_queue: multiprocessing.Queue):
+    """Scrapes this worker's share of the results pages, reporting progress
+    on the events queue as ("page", index, page number, items),
+    ("metrics", index, updates), ("done", index) or ("failed", index, traceback)
+
+    Parameters
+    ----------
+    index : int
+        The worker number, from 0
+    workers : int
+        Number of workers
+    search_term : str
+        The search words
+    results_pages : int
+        Number of results pages of the search, counted by the coordinator
+    file_store_factory : Callable
+        Returns a new Storage (called in the worker)
+    db_storage_factory : Callable
+        Returns a new DBStorage (called in the worker)
+    website_url : str
+        Scrape a copy of the site at another address, or None for the real site
+    frontier_factory : Callable
+        Returns a Frontier shared by the workers, or None
+    dead_letters_factory : Callable
+        Returns the DeadLetters shared by the workers, or None
+    rate_limits : dict
+        This worker's rate limiter settings (see rate_limit.configure)
+    retry_settings : dict
+        The retry and circuit breaker settings (see retry.configure)
+    cache_settings : dict
+        The page cache shared by the workers (see page_cache.activate), or None
+    events : multiprocessing.Queue
+        Progress events for the coordinator
+    stop : multiprocessing.Event
+        Set by the coordinator to stop the worker after its current page
+    log_queue : multiprocessing.Queue
+        Log records for the coordinator's log handlers
+    """
+    # Imported here so each spawned worker only loads Selenium once started
+    from package.utils.log_setup import StructuredQueueHandler
+    from recipe_scraper import RecipeScraper
+    import pipeline
+
+    root_logger = logging.getLogger()
+    for handler in root_logger.handlers[:]:
+        root_logger.removeHandler(handler)
+    handler = StructuredQueueHandler(log_queue)
+    handler.addFilter(_WorkerFilter(index))
+    root_logger.addHandler(handler)
+    root_logger.setLevel(logging.INFO)
+    rate_limit.configure(**rate_limits)
+    retry.configure(**retry_settings)
+    if cache_settings is not None:
+        page_cache.activate(**cache_settings)
+    metrics.forward_updates()
+
+    try:
+        file_store = file_store_factory()
+        db_storage = db_storage_factory()
+        frontier = None if frontier_factory is None else frontier_factory()
+        dead_letters = None if dead_letters_factory is None else dead_letters_factory()
+        rs = RecipeScraper(website_url=website_url)
+        try:
+            for page_num in range(1 + index, results_pages + 1, workers):
+                if stop.is_set():
+                    break
+                if frontier is not None and frontier.page_done(search_term, page_num):
+                    events.put(("page", index, page_num, 0))
+                    continue
+                items = pipeline.scrape_results_page(
+                    rs, search_term, page_num, file_store, db_storage,
+                    progress=False, frontier=frontier, dead_letters=dead_letters)
+                _send_metrics(events, index)
+                events.put(("page", index, page_num, items))
+        finally:
+            rs.quit()
+            if frontier is not None:
+                frontier.close()
+            if dead_letters is not None:
+                dead_letters.close()
+            page_cache.deactivate()
+    except BaseException:
+        _send_metrics(events, index)
+        events.put(("failed", index, traceback.format_exc()))
+        raise
+    _send_metrics(events, index)
+    events.put(("done", index))
+
+
+def _count_results_pages(
+        search_term: str,
+        num_pages: int,
+        website_url: str) -> int:
+    """Executes the search once to count its results pages, so the workers
+    do not each run it
+
+    Parameters
+    ----------
+    search_term : str
+        The search words
+    num_pages : int
+        Number of results pages to scrape
+    website_url : str
+        Scrape a copy of the site at another address, or None for the real site
+
+    Returns
+    -------
+    int
+        The number of results pages to split between the workers
+    """
+    # Imported here so Selenium is only loaded once a run starts
+    from recipe_scraper import RecipeScraper
+    rs = RecipeScraper(website_url=website_url)
+    try:
+        return rs.search_recipes(search_term, num_pages)
+    finally:
+        rs.quit()
+
+
+@log(my_logger=logger)
+def run_parallel_pipeline(
+        search_term: str,
+        num_pages: int,
+        file_store_factory: Callable,
+        db_storage_factory: Callable,
+        workers: int = 2,
+        website_url: str = None,
+        metrics_port: int = None,
+        shutdown_timeout: float = 30.0,
+        frontier_factory: Callable = None,
+        resume: bool = False,
+        dead_letters_factory: Callable = None) -> int:
+    """Runs the pipeline with the results pages split between worker processes
+
+    The factories are called in each worker to create its own storage
+    and database connection, so they must be picklable, e.g. module level
+    functions or functools.partial(DBStorage, db_url)
+
+    Parameters
+    ----------
+    search_term : str
+        The search words to be used to search for recipes
+    num_pages : int
+        Number of results pages to scrape
+    file_store_factory : Callable
+        Returns a new Storage; the coordinator also calls it to sync the manifest
+    db_storage_factory : Callable
+        Returns a new DBStorage
+    workers : int, optional
+        Number of worker processes, by default 2
+    website_url : str, optional
+        Scrape a copy of the site at another address e.g. a local mock, by default the real site
+    metrics_port : int, optional
+        Port to publish Prometheus metrics on (at /metrics), by default None
+    shutdown_timeout : float, optional
+        Seconds to wait for workers to finish their page once stopped
+        before they are terminated, by default 30
+    frontier_factory : Callable, optional
+        Returns a Frontier (on a file shared by the workers) recording the
+        pages and items processed, by default None
+    resume : bool, optional
+        Continue the crawl recorded in the frontier for this search rather
+        than starting again from page 1, by default False
+    dead_letters_factory : Callable, optional
+        Returns a DeadLetters (on a file shared by the workers) recording
+        the recipes which could not be scraped or stored, by default None
+
+    Returns
+    -------
+    int
+        The number of recipes scraped and saved
+
+    Raises
+    ------
+    RuntimeError
+        If a worker failed or exited unexpectedly
+    """
+    if workers < 1:
+        raise ValueError(f"workers must be at least 1, not {workers}")
+    if metrics_port is not None:
+        metrics.start_metrics_server(metrics_port)
+    results_pages = _count_results_pages(search_term, num_pages, website_url)
+    if frontier_factory is not None:
+        frontier = frontier_factory()
+        try:
+            if not resume:
+                frontier.reset(search_term)
+            # A resumed crawl keeps the number of pages first recorded
+            results_pages = frontier.begin(search_term, results_pages)
+        finally:
+            frontier.close()
+    # Each worker gets its share of the rates configured in this process,
+    # which it adapts without the others
+    rate_limits = rate_limit.settings()
+    for setting in ["rate", "min_rate", "max_rate", "rate_step"]:
+        rate_limits[setting] /= workers
+    rate_limits["enabled"] = rate_limit.enabled()
+
+    # Spawned rather than forked, as Chrome, database and
+    # logging threads do not survive a fork
+    context = multiprocessing.get_context("spawn")
+    events = context.Queue()
+    log_queue = context.Queue()
+    stop = context.Event()
+    listener = QueueListener(log_queue, *logging.getLogger().handlers, respect_handler_level=True)
+    listener.start()
+    processes = [
+        context.Process(
+            target=_worker,
+            args=(n, workers, search_term, results_pages, file_store_factory,
+                db_storage_factory, website_url, frontier_factory, dead_letters_factory, rate_limits,
+                retry.settings(), page_cache.settings(), events, stop, log_queue),
+            name=f"pipeline-worker-{n}")
+        for n in range(workers)]
+
+    failures = {}
+    finished = set()
+    items = 0
+    progress = tqdm(desc='Scraping progress', unit='page', total=results_pages)
+    try:
+        for process in processes:
+            process.start()
+        logger.info(f"Started {workers} workers", extra={"stage": "init", "search": search_term})
+        while len(finished) < workers:
+            try:
+                event = events.get(timeout=_POLL_SECONDS)
+            except queue.Empty:
+                # A worker killed (e.g. out of memory) cannot report itself
+                for n, process in enumerate(processes):
+                    if n not in finished and process.exitcode not in (None, 0):
+                        failures[n] = f"exited with code {process.exitcode}"
+                        finished.add(n)
+                        stop.set()
+                continue
+            kind, index = event[:2]
+            if kind == "page":
+                items += event[3]
+                progress.update()
+            elif kind == "metrics":
+                metrics.apply_updates(event[2])
+            elif kind == "done":
+                finished.add(index)
+            elif kind == "failed":
+                failures[index] = event[2]
+                finished.add(index)
+                # Stop the other workers after their current page
+                stop.set()
+    except KeyboardInterrupt:
+        stop.set()
+        raise
+    finally:
+        progress.close()
+        for process in processes:
+            if process.pid is not None:
+                process.join(shutdown_timeout)
+            if process.is_alive():
+                logger.warning(f"Terminating {process.name}", extra={"stage": "shutdown"})
+                process.terminate()
+                process.join()
+        listener.stop()
+
+    if len(failures) > 0:
+        for index, failure in sorted(failures.items()):
+            logger.error(f"Worker {index} failed: {failure}", extra={"stage": "worker", "worker": index})
+        raise RuntimeError(f"{len(failures)} of {workers} workers failed: workers {sorted(failures)}")
+    logger.info(f"Scraped {items} recipes with {workers} workers",
+        extra={"stage": "done", "search": search_term})
+    # Publish the index of stored records (if the storage keeps one)
+    file_store_factory().sync_manifest()
+    return items
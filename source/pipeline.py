@@ -1,15 +1,34 @@
+from __future__ import annotations
 import logging
+from typing import TYPE_CHECKING, Callable
 from package.storage.file_storage import Storage
-from package.storage.db_storage import DBStorage
+from package.storage import frontier as fr
+from package.storage.dead_letter import DeadLetters
 from recipe_scraper import RecipeScraper
+from package.scraper.locator_profiler import LocatorProfiler
 from tqdm.auto import tqdm
+import time
 import uuid
 from package.utils.logger import log
+from package.utils import metrics
+from package.utils import profiling
+from package.utils import retry
+from package.utils import tracing
 import logging
 
+if TYPE_CHECKING:
+    # Only for annotations, so a run only imports the database
+    # libraries (pandas, SQLAlchemy) when the caller creates a DBStorage
+    from package.storage.db_storage import DBStorage
+
 # Create a logger for pipeline log messages
 logger = logging.getLogger("pipeline")
 
+# Table recording the recipes listed by each search
+LINK_TABLE = "search_recipe"
+# Table recording the newest recipe listed by each search, for incremental crawls
+HIGH_WATER_TABLE = "search_high_water"
+
 @log(my_logger=logger)
 def save_file(storage: Storage,
         page_dict: dict,
@@ -30,12 +49,14 @@ def save_file(storage: Storage,
         folder,
         f"{page_dict['item_id']}"
         )
-    logger.info(f"Saved file: {page_dict['item_id']}")
+    logger.info(f"Saved file: {page_dict['item_id']}",
+        extra={"stage": "store_json", "item_id": page_dict['item_id']})
 
 @log(my_logger=logger)
 def save_images(storage: Storage,
         page_dict: dict,
-        folder: str):
+        folder: str,
+        skip_existing: bool = False):
     """Saves the images to a folder
 
     Parameters
@@ -46,21 +67,30 @@ def save_images(storage: Storage,
         A dictionary containing recipe data
     folder : str
         Folder name to construct key for the object storage
+    skip_existing : bool
+        Whether to skip images the storage already has
     """
     for url in page_dict["image_urls"]:
         # Get the file extension from the url
         file_ext = url.rsplit('?', 1)[-2].rsplit('.', 1)[-1]
-        storage.save_image(
-            url,
-            folder,
-            f"{page_dict['item_id']}.{file_ext}")
-        logger.info(f"Saved image: {page_dict['item_id']}.{file_ext}")
+        if skip_existing and storage.file_exists(folder, f"{page_dict['item_id']}.{file_ext}"):
+            continue
+        with metrics.time_stage("image_save"):
+            retry.call(retry.STORAGE, storage.save_image,
+                url,
+                folder,
+                f"{page_dict['item_id']}.{file_ext}")
+        logger.info(f"Saved image: {page_dict['item_id']}.{file_ext}",
+            extra={"stage": "store_image", "item_id": page_dict['item_id']})
 
 @log(my_logger=logger)
 def store_data_files(storage: Storage,
         page_data_list: list,
         search: str):
-    """Stores the data dictionaries in a single file
+    """Stores the data dictionaries in a single file, with their images.
+    Items already in the storage's manifest (saved by an earlier run whose
+    database insert failed) are left out of the file, but any of their
+    images that are missing are still saved
 
     Parameters
     ----------
@@ -71,19 +101,33 @@ def store_data_files(storage: Storage,
     search : str
         The search string used (for the file name)
     """
+    saved_ids = set()
+    if storage.manifest is not None:
+        saved_ids = {page_dict["item_id"] for page_dict in page_data_list
+            if storage.manifest.lookup(page_dict["item_id"]) is not None}
+        if len(saved_ids) > 0:
+            logger.info(f"Not saving {len(saved_ids)} items already saved by an earlier run.",
+                extra={"stage": "store", "search": search})
     if len(page_data_list) > 0:
 
-        storage.save_json_file(
-            page_data_list,
-            storage.data_folder,
-            f"{search}-{uuid.uuid4()}"
-            )
+        unsaved = [page_dict for page_dict in page_data_list
+            if page_dict["item_id"] not in saved_ids]
+        if len(unsaved) > 0:
+            with metrics.time_stage("json_write"):
+                retry.call(retry.STORAGE, storage.save_json_file,
+                    unsaved,
+                    storage.data_folder,
+                    f"{search}-{uuid.uuid4()}"
+                    )
 
         for page_dict in page_data_list:
             # save the files in the appropriate folder
             # save_file(storage, page_dict, storage.data_folder)
-            save_images(storage, page_dict, storage.images_folder)
-        logger.info(f"Saved all data and image files.")
+            # (an earlier run may have failed before saving all the images)
+            save_images(storage, page_dict, storage.images_folder,
+                skip_existing=page_dict["item_id"] in saved_ids)
+        logger.info(f"Saved all data and image files.",
+            extra={"stage": "store", "search": search})
 
 @log(my_logger=logger)
 def store_data_db(db_storage: DBStorage,
@@ -97,26 +141,369 @@ def store_data_db(db_storage: DBStorage,
     json_data : list
         A list of json strings
     """
-    db_storage.json_to_db(
-        json_data,
-        'recipe',
-        ['item_id', 'recipe_name', 'item_UUID','image_urls'],
-        [
-            ('ingredients', ['item_id', 'ingredient']),
-            ('method', ['item_id', 'method_step']),
-            ('planning_info', ['item_id', 'prep_stage']),
-            ('nutritional_info', ['item_id', 'nutritional_info'])
-        ],
-        ['item_id']
-    )
-    logger.info(f"Saved data to database for {len(json_data)} items.")
+    with metrics.time_stage("db_insert"):
+        retry.call(retry.DATABASE, db_storage.json_to_db,
+            json_data,
+            'recipe',
+            ['item_id', 'recipe_name', 'item_UUID','image_urls'],
+            [
+                ('ingredients', ['item_id', 'ingredient']),
+                ('method', ['item_id', 'method_step']),
+                ('planning_info', ['item_id', 'prep_stage']),
+                ('nutritional_info', ['item_id', 'nutritional_info'])
+            ],
+            ['item_id']
+        )
+    logger.info(f"Saved data to database for {len(json_data)} items.",
+        extra={"stage": "db_insert"})
+
+@log(my_logger=logger)
+def scrape_item(rs: RecipeScraper,
+        url: str,
+        search_term: str,
+        db_storage: DBStorage,
+        seen_ids: set = None) -> dict:
+    """Scrapes a recipe page, unless it is already stored in the database
+    (or has already been seen by the run, if the run tracks what it has seen)
+
+    Parameters
+    ----------
+    rs : RecipeScraper
+        The scraper
+    url : str
+        URL of the recipe page
+    search_term : str
+        The search words used to find the recipe
+    db_storage : DBStorage
+        A DBStorage instance
+    seen_ids : set, optional
+        IDs already processed in this run, e.g. by earlier searches of a
+        batch (updated with this item), by default None
+
+    Returns
+    -------
+    dict
+        The recipe data, or an empty dictionary if it was not scraped
+    """
+    page_dict = {}
+    # get the ID from the URL
+    item_id = url.rsplit('/', 1)[-1]
+    if seen_ids is not None:
+        if item_id in seen_ids:
+            # Listed by an earlier search of the batch
+            metrics.count_item("duplicate")
+            return page_dict
+        seen_ids.add(item_id)
+    start = time.perf_counter()
+    with tracing.span("recipe", url=url):
+        with metrics.time_stage("item_exists"):
+            exists = retry.call(retry.DATABASE, db_storage.item_exists, "recipe", "item_id", item_id)
+        if exists:
+            metrics.count_item("skipped")
+        else:
+            try:
+                page_dict = retry.call(retry.BROWSER, rs.get_page_data, url)
+            except RuntimeError:
+                metrics.count_item("error")
+                raise
+            metrics.count_item("scraped" if len(page_dict) != 0 else "empty")
+    logger.info(f"Scraped data from {url}.",
+        extra={"stage": "scrape", "item_id": item_id, "search": search_term,
+            "duration": time.perf_counter() - start})
+    return page_dict
+
+@log(my_logger=logger)
+def get_results_urls(rs: RecipeScraper,
+        search_term: str,
+        page_num: int,
+        db_storage: DBStorage,
+        frontier: fr.Frontier = None) -> list:
+    """Gets the recipe URLs listed on one page of search results,
+    recording them in the link table (and the frontier)
+
+    Parameters
+    ----------
+    rs : RecipeScraper
+        The scraper, with the search already executed
+    search_term : str
+        The search words used for the search
+    page_num : int
+        The results page number
+    db_storage : DBStorage
+        An instance of DBStorage initialised with a valid DB connection
+    frontier : Frontier, optional
+        Records the page and its items; for a page it has already visited
+        only the items which are not done are returned, by default None
+
+    Returns
+    -------
+    list
+        The URLs
+    """
+    if frontier is not None and frontier.page_visited(search_term, page_num):
+        # Resuming: only the items not done when the run stopped
+        urls = frontier.remaining(search_term, page_num)
+        logger.info(f"Resuming page {page_num} of search results with {len(urls)} items.",
+            extra={"stage": "results_page", "search": search_term})
+    else:
+        # Get urls per page of search results
+        start = time.perf_counter()
+        with metrics.time_stage("results_page"):
+            urls = retry.call(retry.BROWSER, rs.get_urls, search_term, page_num)
+        metrics.RESULTS_PAGES.inc()
+        logger.info(f"Retrieved urls for page {page_num} of search results.",
+            extra={"stage": "results_page", "search": search_term,
+                "duration": time.perf_counter() - start})
+        # Recorded for every recipe listed, including those already stored
+        retry.call(retry.DATABASE, db_storage.link_items,
+            LINK_TABLE, search_term, [url.rsplit('/', 1)[-1] for url in urls])
+        if frontier is not None:
+            frontier.add_page(search_term, page_num, urls)
+    return urls
+
+def give_up(search_term: str,
+        urls: list,
+        stage: str,
+        error: RuntimeError,
+        frontier: fr.Frontier = None,
+        dead_letters: DeadLetters = None):
+    """Records items which failed (after any retries) so the run can
+    continue, or raises the error if a dependency's circuit breaker is open
+
+    Parameters
+    ----------
+    search_term : str
+        The search words used for the search
+    urls : list
+        URLs of the items
+    stage : str
+        The stage which failed: scrape or store
+    error : RuntimeError
+        The error raised
+    frontier : Frontier, optional
+        Marks the items failed, by default None
+    dead_letters : DeadLetters, optional
+        Records the items, by default None
+
+    Raises
+    ------
+    RuntimeError
+        `error`, if a circuit breaker is open
+    """
+    cause = retry.root_cause(error)
+    if frontier is not None:
+        frontier.mark(search_term, urls, fr.FAILED, str(cause))
+        frontier.checkpoint()
+    if isinstance(cause, retry.CircuitOpenError):
+        # The dependency is down: stop rather than fail every item
+        raise error
+    logger.error(f"Giving up on {len(urls)} items after {type(cause).__name__} in {stage}: {cause}",
+        extra={"stage": stage, "search": search_term})
+    if dead_letters is not None:
+        dead_letters.record(search_term, urls, stage, cause)
+
+@log(my_logger=logger)
+def scrape_results_page(rs: RecipeScraper,
+        search_term: str,
+        page_num: int,
+        file_store: Storage,
+        db_storage: DBStorage,
+        seen_ids: set = None,
+        progress: bool = True,
+        frontier: fr.Frontier = None,
+        urls: list = None,
+        dead_letters: DeadLetters = None) -> int:
+    """Scrapes the recipes listed on one page of search results
+    and saves their files, images and database records
+
+    A recipe which cannot be scraped, or recipes which cannot be stored
+    (after any retries), are logged and recorded as dead letters (and as
+    failed in the frontier) and the rest of the page continues; if a
+    dependency's circuit breaker opens the error is raised, stopping the run
+
+    Parameters
+    ----------
+    rs : RecipeScraper
+        The scraper, with the search already executed
+    search_term : str
+        The search words used for the search
+    page_num : int
+        The results page number
+    file_store : Storage
+       An instance of a concrete Storage object
+    db_storage : DBStorage
+        An instance of DBStorage initialised with a valid DB connection
+    seen_ids : set, optional
+        IDs already processed in this run, e.g. by earlier searches of a
+        batch, by default None
+    progress : bool, optional
+        Show a progress bar for the recipes on the page, by default True
+    frontier : Frontier, optional
+        Records the state of the page and its items so the crawl can be
+        resumed; a page it has already visited is not fetched again and only
+        its items which are not done are scraped, by default None
+    urls : list, optional
+        The URLs from `get_results_urls`, if already fetched, by default None
+    dead_letters : DeadLetters, optional
+        Records the recipes given up on, by default None
+
+    Returns
+    -------
+    int
+        The number of recipes scraped and saved
+    """
+    with tracing.span("search_page", search=search_term, page_num=page_num):
+        if urls is None:
+            urls = get_results_urls(rs, search_term, page_num, db_storage, frontier)
+        rs.page_data = []
+        # URLs of the items in rs.page_data
+        scraped_urls = []
+        # Scrape pages for results page `page_num`
+        for url in tqdm(urls, desc = 'Scraping pages', disable=not progress):
+            if frontier is not None:
+                frontier.mark(search_term, [url], fr.IN_PROGRESS)
+            try:
+                page_dict = scrape_item(rs, url, search_term, db_storage, seen_ids)
+            except RuntimeError as e:
+                give_up(search_term, [url], "scrape", e, frontier, dead_letters)
+                continue
+            if len(page_dict) != 0:
+                rs.page_data.append(page_dict)
+                scraped_urls.append(url)
+            elif frontier is not None:
+                # Skipped, duplicate or nothing to store
+                frontier.mark(search_term, [url], fr.DONE)
+        if len(rs.page_data) > 0:
+            try:
+                store_data_files(file_store, rs.page_data, search_term)
+                store_data_db(db_storage, rs.page_data)
+            except RuntimeError as e:
+                give_up(search_term, scraped_urls, "store", e, frontier, dead_letters)
+                if seen_ids is not None:
+                    # Scraped again by a later search or run
+                    seen_ids.difference_update(url.rsplit('/', 1)[-1] for url in scraped_urls)
+                rs.page_data = []
+                scraped_urls = []
+            else:
+                logger.info(f"Saved files, images and uploaded data for {len(rs.page_data)} items.",
+                    extra={"stage": "store", "search": search_term})
+                if dead_letters is not None:
+                    # Stored now, after failing in an earlier run
+                    dead_letters.remove(search_term, scraped_urls)
+        if frontier is not None:
+            frontier.mark(search_term, scraped_urls, fr.DONE)
+            frontier.finish_page(search_term, page_num)
+    return len(rs.page_data)
+
+@log(my_logger=logger)
+def scrape_search(rs: RecipeScraper,
+        search_term: str,
+        num_pages: int,
+        file_store: Storage,
+        db_storage: DBStorage,
+        seen_ids: set = None,
+        frontier: fr.Frontier = None,
+        resume: bool = False,
+        incremental: bool = False,
+        dead_letters: DeadLetters = None) -> int:
+    """Runs a search and scrapes the recipes on its results pages
+
+    An incremental crawl (with the results listed newest first) stops after
+    the page listing the search's high-water mark (the newest recipe listed
+    by the last incremental crawl), or after a page on which every recipe is
+    already stored, then moves the mark to the newest recipe: the first listed
+    on page 1 (when it was first visited, if the crawl was resumed)
+
+    Parameters
+    ----------
+    rs : RecipeScraper
+        The scraper
+    search_term : str
+        The search words to be used to search for recipes
+    num_pages : int
+        Number of results pages to scrape (0 for every page)
+    file_store : Storage
+       An instance of a concrete Storage object
+    db_storage : DBStorage
+        An instance of DBStorage initialised with a valid DB connection
+    seen_ids : set, optional
+        IDs already processed by earlier searches of a batch
+        (updated with the IDs of this search), by default None
+    frontier : Frontier, optional
+        Records the results pages and items processed, by default None
+    resume : bool, optional
+        Continue the crawl recorded in `frontier` for this search, by default False
+    incremental : bool, optional
+        Only crawl the recipes added since the last incremental crawl;
+        the scraper must list results newest first, by default False
+    dead_letters : DeadLetters, optional
+        Records the recipes given up on, by default None
+
+    Returns
+    -------
+    int
+        The number of recipes scraped and saved
+    """
+    items = 0
+    high_water = db_storage.get_high_water(HIGH_WATER_TABLE, search_term) if incremental else None
+    newest = None
+    results_pages = rs.search_recipes(search_term, num_pages)
+    if frontier is not None:
+        if not resume:
+            frontier.reset(search_term)
+        # When resuming, the pages found by the first run
+        results_pages = frontier.begin(search_term, results_pages)
+    if results_pages > 0:
+        
+        logger.info(f"Executed search: {results_pages} pages if results",
+            extra={"stage": "search", "search": search_term})
+
+        for page_num in tqdm(range(1, results_pages + 1), desc = 'Scraping progress', leave=False):
+            if frontier is not None and frontier.page_done(search_term, page_num):
+                continue
+            if not incremental:
+                items += scrape_results_page(rs, search_term, page_num, file_store, db_storage, seen_ids,
+                    frontier=frontier, dead_letters=dead_letters)
+                profiling.page_done()
+                continue
+            urls = get_results_urls(rs, search_term, page_num, db_storage, frontier)
+            item_ids = [url.rsplit('/', 1)[-1] for url in urls]
+            if page_num == 1 and len(item_ids) > 0:
+                newest = item_ids[0]
+            # Checked before the page's recipes are stored
+            known = retry.call(retry.DATABASE, db_storage.existing_items, "recipe", "item_id", item_ids)
+            items += scrape_results_page(rs, search_term, page_num, file_store, db_storage, seen_ids,
+                frontier=frontier, urls=urls, dead_letters=dead_letters)
+            profiling.page_done()
+            if high_water in item_ids or (len(item_ids) > 0 and known.issuperset(item_ids)):
+                logger.info(f"Incremental crawl reached known recipes on page {page_num} of {results_pages}",
+                    extra={"stage": "search", "search": search_term})
+                break
+        if incremental and frontier is not None:
+            # Resuming, page 1 may be skipped or only list the items not
+            # done: the newest recipe is the first it listed when visited
+            newest = frontier.first_item(search_term, 1)
+        if newest is not None:
+            db_storage.set_high_water(HIGH_WATER_TABLE, search_term, newest)
+    if frontier is not None:
+        logger.info(f"Frontier item states: {frontier.counts(search_term)}",
+            extra={"stage": "frontier", "search": search_term})
+    return items
 
 @log(my_logger=logger)
 def run_pipeline(
         search_term: str, 
         num_pages: int, 
         file_store: Storage, 
-        db_storage: DBStorage):
+        db_storage: DBStorage,
+        metrics_port: int = None,
+        profile_locators: bool = False,
+        website_url: str = None,
+        frontier: fr.Frontier = None,
+        resume: bool = False,
+        incremental: bool = False,
+        dead_letters: DeadLetters = None,
+        rs: RecipeScraper = None) -> int:
     """The main routine to run all the necessary 
     tasks to scrape and save recipe data
 
@@ -130,6 +517,33 @@ def run_pipeline(
        An instance of a concrete Storage object
     db_storage : DBStorage
         An instance of DBStorage initialised with a valid DB connection
+    metrics_port : int, optional
+        Port to publish Prometheus metrics on (at /metrics), by default None
+    profile_locators : bool, optional
+        Record the cost of each Locator and log a report at the end, by default False
+    website_url : str, optional
+        Scrape a copy of the site at another address e.g. a local mock, by default the real site
+    frontier : Frontier, optional
+        Records the results pages and items processed, checkpointed as the
+        run goes, by default None
+    resume : bool, optional
+        Continue the crawl recorded in `frontier` for this search, skipping
+        the pages and items done and retrying failed items, rather than
+        starting again from page 1, by default False
+    incremental : bool, optional
+        List the results newest first and only crawl the recipes added
+        since the last incremental crawl of the search, by default False
+    dead_letters : DeadLetters, optional
+        Records the recipes which could not be scraped or stored (after
+        retries); the run continues past them, by default None
+    rs : RecipeScraper, optional
+        A scraper already started (e.g. kept warm by the daemon), which is
+        left running; by default a new one is started and quit
+
+    Returns
+    -------
+    int
+        The number of recipes scraped and saved
 
     Raises
     ------
@@ -137,36 +551,113 @@ def run_pipeline(
         RuntimeError excepion will be propagated up and raised to calling functions
     """
     try:
+        if metrics_port is not None:
+            metrics.start_metrics_server(metrics_port)
 
-        rs = RecipeScraper()
-        logger.info(f"Initialised the scraper class.")
-        results_pages = rs.search_recipes(search_term, num_pages)
-        if results_pages > 0:
-            
-            logger.info(f"Executed search: {results_pages} pages if results")
-
-            for page_num in tqdm(range(1, results_pages + 1), desc = 'Scraping progress', leave=False):
-                # Get urls per page of search results
-                urls = rs.get_urls(search_term, page_num)
-                logger.info(f"Retrieved urls for page {page_num} of search results.")
-                # Check list of urls is populated    
-                if len(urls) > 0:
-                    rs.page_data = []
-                    # Scrape pages for results page `page_num`
-                    for url in tqdm(urls, desc = 'Scraping pages'):
-                        # get the ID from the URL
-                        item_id = url.rsplit('/', 1)[-1]
-                        if not db_storage.item_exists("recipe", "item_id", item_id):
-                            page_dict = rs.get_page_data(url)
-                            if len(page_dict) != 0:
-                                rs.page_data.append(page_dict)
-                        logger.info(f"Scraped data from {url}.")
-                    if len(rs.page_data) > 0:
-                        store_data_files(file_store, rs.page_data, search_term)
-                        # json_data = get_json_data(file_store, f"{file_store.root_folder}/{search_term}")
-                        store_data_db(db_storage, rs.page_data)
-                        logger.info(f"Saved files, images and uploaded data for {len(rs.page_data)} items.")
-        rs.quit()
+        profiler = None
+        own_scraper = rs is None
+        if own_scraper:
+            profiler = LocatorProfiler() if profile_locators else None
+            rs = RecipeScraper(profiler, website_url, newest_first=incremental)
+            logger.info(f"Initialised the scraper class.", extra={"stage": "init"})
+        else:
+            rs.newest_first = incremental
+        try:
+            items = scrape_search(rs, search_term, num_pages, file_store, db_storage, None, frontier, resume,
+                incremental, dead_letters)
+        finally:
+            # A scraper passed in is left running, even if the run fails
+            if own_scraper:
+                rs.quit()
+        if profiler is not None:
+            logger.info(f"Locator profile:\n{profiler.format_report()}", extra={"stage": "profile"})
+        # Publish the index of stored records (if the storage keeps one)
+        file_store.sync_manifest()
+        return items
     except RuntimeError as e:
        logger.exception(f"Exception raised in {__name__}. exception: {str(e)}")
        raise e
+
+@log(my_logger=logger)
+def run_batch_pipeline(
+        search_terms: list,
+        num_pages: int,
+        file_store_factory: Callable,
+        db_storage: DBStorage,
+        metrics_port: int = None,
+        profile_locators: bool = False,
+        website_url: str = None,
+        frontier: fr.Frontier = None,
+        resume: bool = False,
+        incremental: bool = False,
+        dead_letters: DeadLetters = None) -> dict:
+    """Runs several searches with one scraper and database connection.
+    A recipe listed by more than one search is only loaded and stored for
+    the first, as the IDs seen are shared across the searches; the link
+    table records every search which listed it
+
+    Parameters
+    ----------
+    search_terms : list
+        The searches, in the order to run them
+    num_pages : int
+        Number of results pages to scrape for each search (0 for every page)
+    file_store_factory : Callable
+        Called with a search to create the Storage its recipes are saved to
+        (e.g. a folder per search)
+    db_storage : DBStorage
+        An instance of DBStorage initialised with a valid DB connection
+    metrics_port : int, optional
+        Port to publish Prometheus metrics on (at /metrics), by default None
+    profile_locators : bool, optional
+        Record the cost of each Locator and log a report at the end, by default False
+    website_url : str, optional
+        Scrape a copy of the site at another address e.g. a local mock, by default the real site
+    frontier : Frontier, optional
+        Records the results pages and items processed for each search, by default None
+    resume : bool, optional
+        Continue the crawls recorded in `frontier`, by default False
+    incremental : bool, optional
+        Only crawl the recipes added since the last incremental crawl
+        of each search, by default False
+    dead_letters : DeadLetters, optional
+        Records the recipes given up on, by default None
+
+    Returns
+    -------
+    dict
+        The number of recipes scraped and saved, by search
+
+    Raises
+    ------
+    RuntimeError
+        RuntimeError excepion will be propagated up and raised to calling functions
+    """
+    if metrics_port is not None:
+        metrics.start_metrics_server(metrics_port)
+    profiler = LocatorProfiler() if profile_locators else None
+    rs = RecipeScraper(profiler, website_url, newest_first=incremental)
+    logger.info(f"Initialised the scraper class.", extra={"stage": "init"})
+    items = {}
+    # IDs already processed by any search of the batch
+    seen_ids = set()
+    file_store = None
+    try:
+        for search_term in dict.fromkeys(search_terms):
+            file_store = file_store_factory(search_term)
+            items[search_term] = scrape_search(
+                rs, search_term, num_pages, file_store, db_storage, seen_ids, frontier, resume,
+                incremental, dead_letters)
+            logger.info(f"Scraped {items[search_term]} recipes for search {search_term}",
+                extra={"stage": "batch", "search": search_term})
+    finally:
+        rs.quit()
+    logger.info(f"Batch of {len(items)} searches listed {len(seen_ids)} distinct recipes, "
+        f"scraped {sum(items.values())}", extra={"stage": "batch"})
+    if profiler is not None:
+        logger.info(f"Locator profile:\n{profiler.format_report()}", extra={"stage": "profile"})
+    # Publish the index of stored records (if the storage keeps one),
+    # which the searches' storage share
+    if file_store is not None:
+        file_store.sync_manifest()
+    return items
@@ -1,5 +1,5 @@
 from selenium.webdriver.common.by import By
-from source.package.scraper.scraper import Locator
+from package.scraper.scraper import Locator
 
 """
 This file defines constant values to be used in the recipe scraper class
@@ -11,7 +11,10 @@ WEBSITE_URL = "https://www.bbcgoodfood.com/"
 # Template string to be used to generate URL for running a search
 SEARCH_URL_TEMPLATE = "https://www.bbcgoodfood.com/search?q=$searchwords"
 # Template string to be used to generate URL for each page of search results
-RESULTS_URL_TEMPLATE = "https://www.bbcgoodfood.com/search/recipes/page/$pagenum/?q=$searchwords&sort=-relevance"
+RESULTS_URL_TEMPLATE = "https://www.bbcgoodfood.com/search/recipes/page/$pagenum/?q=$searchwords&sort=$sort"
+# Orders of the search results
+SORT_RELEVANCE = "-relevance"
+SORT_NEWEST = "-date"
 # Div container which is displayed when page is not found on the site
 ERROR_PAGE_DIV_LOC = Locator(By.XPATH, "//div[(@class='template-error__content')]")
 
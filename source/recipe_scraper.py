@@ -1,9 +1,14 @@
 from package.scraper.scraper import Scraper
+from package.scraper.locator_profiler import LocatorProfiler
 from string import Template
+from typing import Callable, Iterator
 import uuid
 import recipe_constants as rc
 import logging
 from package.utils.logger import log_class
+from package.utils import metrics
+from package.utils import page_cache
+from package.utils import retry
 
 @log_class
 class RecipeScraper(Scraper):
@@ -19,10 +24,31 @@ class RecipeScraper(Scraper):
     ----------
     page_data : list
         A list of dictionaries populated by the web scraper
+    newest_first : bool
+        List the search results newest first rather than by relevance
 
     """
 
-    def __init__(self):
+    def __init__(self,
+            profiler: LocatorProfiler = None,
+            website_url: str = None,
+            newest_first: bool = False,
+            session_limits: dict = None):
+        """
+        Parameters
+        ----------
+        profiler : LocatorProfiler, optional
+            Records the cost of each Locator in recipe_constants, by default None
+        website_url : str, optional
+            Serve the site from another address e.g. a local copy of saved pages
+            (with the same paths), by default rc.WEBSITE_URL
+        newest_first : bool, optional
+            List the search results newest first rather than by relevance, by default False
+        session_limits : dict, optional
+            Scraper's max_pages, max_rss_mb and page_load_timeout, for
+            recycling the browser session, by default Scraper's defaults
+        """
+        website_url = rc.WEBSITE_URL if website_url is None else website_url
 
         self.page_data = []
 
@@ -30,15 +56,22 @@ class RecipeScraper(Scraper):
         # https://www.bbcgoodfood.com/search?q=chicken
         # Multiple word searches should be separated by plus
 
-        self.__search_template = rc.SEARCH_URL_TEMPLATE
+        self.__search_template = rc.SEARCH_URL_TEMPLATE.replace(rc.WEBSITE_URL, website_url)
         # Set results template based on 
         # https://www.bbcgoodfood.com/search/recipes/page/2/?q=chicken&sort=-relevance
         # Multiple word searches should be separated by plus
-        self.__results_template = rc.RESULTS_URL_TEMPLATE
+        self.__results_template = rc.RESULTS_URL_TEMPLATE.replace(rc.WEBSITE_URL, website_url)
+        self.newest_first = newest_first
+
+        if profiler is not None:
+            # Report Locators by their recipe_constants names
+            profiler.name_locators(rc)
 
         # initialise with the base website
-        super().__init__(rc.WEBSITE_URL)
-        self.dismiss_popup(rc.ACCEPT_BUTTON_LOC)
+        super().__init__(website_url, profiler, **(session_limits or {}))
+        if not page_cache.offline():
+            # Offline the home page is not loaded, so there is no popup
+            self.dismiss_popup(rc.ACCEPT_BUTTON_LOC)
 
     def get_num_pages(self, num_pages: int) -> int:
         """Gets the number of results pages using the navigation control
@@ -84,7 +117,8 @@ class RecipeScraper(Scraper):
         """        
         page_urls = []
         # Sets the URL for results pages by page num
-        results_mappings = {'pagenum': page_num, 'searchwords': keyword_search}
+        results_mappings = {'pagenum': page_num, 'searchwords': keyword_search,
+            'sort': rc.SORT_NEWEST if self.newest_first else rc.SORT_RELEVANCE}
         results_page = Template(self.__results_template).substitute(**results_mappings)
         # Get the links from the recipe cards in search results   
         if self.go_to_page_url(results_page, rc.ERROR_PAGE_DIV_LOC):
@@ -100,46 +134,61 @@ class RecipeScraper(Scraper):
         url : str
             URL of the page to scrape
 
+        Returns
+        -------
+        dict
+            Dictionary of the data scraped from the page,
+            or an empty dictionary if the page was not found
+        """
+        page_dict = {}
+        # go to the URL
+        with metrics.time_stage("page_load"):
+            page_found = self.go_to_page_url(url, rc.ERROR_PAGE_DIV_LOC)
+        if page_found:
+            # populate dictionary from the page
+            # Dictionary which provides the structure for the output dictionary
+            # key = output dictionary key
+            # value = locator details for output dictionary values
+            with metrics.time_stage("extract"):
+                page_dict = self.__extract_page(url)
+        else:
+            self.logger.warning(f"Page not found: {url}",
+                extra={"stage": "scrape", "item_id": url.rsplit('/', 1)[-1]})
+        return page_dict
+
+    def __extract_page(self, url: str) -> dict:
+        """Extracts the recipe data from the current page
+
+        Parameters
+        ----------
+        url : str
+            URL of the page being scraped
+
         Returns
         -------
         dict
             Dictionary of the data scraped from the page
         """
-        try:
-            page_dict = {}
-            # go to the URL
-            if self.go_to_page_url(url, rc.ERROR_PAGE_DIV_LOC):                
-                # populate dictionary from the page
-                # Dictionary which provides the structure for the output dictionary
-                # key = output dictionary key
-                # value = locator details for output dictionary values
-                page_dict = {
-                    "recipe_name": self.get_element_text(rc.RECIPE_NAME_LOC),
-                    "ingredients": self.get_elements_list("ingredient", rc.INGREDIENTS_LOC),
-                    "method": self.get_elements_dict(
-                        rc.METHOD_STEPS_LOC,
-                        method_step=rc.METHOD_STEP_KEY_LOC, 
-                        method_instructions=rc.METHOD_STEP_DETAIL),
-                    "nutritional_info":  self.get_elements_dict(
-                        rc.NUTRITIONAL_LIST_LOC, 
-                        nutritional_info=rc.NUTRITIONAL_INFO_LOC, 
-                        nutritional_value=rc.NUTRITIONAL_VALUE_LOC),
-                    "planning_info":  self.get_elements_dict(
-                        rc.PLANNING_LIST_LOC, 
-                        prep_stage=rc.PLANNING_LIST_TASK, 
-                        prep_time=rc.PLANNING_LIST_TIME)
-                }
-                page_dict.update({"item_id": url.rsplit('/', 1)[-1]})
-                page_dict.update({"item_UUID": uuid.uuid4()})
-                page_dict.update({"image_urls": self.get_image_url(rc.IMAGES_LOC)})
-                return page_dict
-            else:
-                logging.warning(f"Page not found: {url}")
-        except RuntimeError as e:
-            print(f"Error scraping page {url} {e.args[0]}")
-        finally:
-            # return the dictionary
-            return page_dict
+        page_dict = {
+            "recipe_name": self.get_element_text(rc.RECIPE_NAME_LOC),
+            "ingredients": self.get_elements_list("ingredient", rc.INGREDIENTS_LOC),
+            "method": self.get_elements_dict(
+                rc.METHOD_STEPS_LOC,
+                method_step=rc.METHOD_STEP_KEY_LOC, 
+                method_instructions=rc.METHOD_STEP_DETAIL),
+            "nutritional_info":  self.get_elements_dict(
+                rc.NUTRITIONAL_LIST_LOC, 
+                nutritional_info=rc.NUTRITIONAL_INFO_LOC, 
+                nutritional_value=rc.NUTRITIONAL_VALUE_LOC),
+            "planning_info":  self.get_elements_dict(
+                rc.PLANNING_LIST_LOC, 
+                prep_stage=rc.PLANNING_LIST_TASK, 
+                prep_time=rc.PLANNING_LIST_TIME)
+        }
+        page_dict.update({"item_id": url.rsplit('/', 1)[-1]})
+        page_dict.update({"item_UUID": uuid.uuid4()})
+        page_dict.update({"image_urls": self.get_image_url(rc.IMAGES_LOC)})
+        return page_dict
 
     def search_recipes(
             self,
@@ -162,3 +211,68 @@ class RecipeScraper(Scraper):
             return self.get_num_pages(num_pages)
         else:
             return 0
+
+    def iter_urls(
+            self,
+            keyword_search: str,
+            num_pages: int,
+            url_filter: Callable[[Iterator[str]], Iterator[str]] = None) -> Iterator[str]:
+        """Executes a recipe search and yields the recipe URLs listed,
+        reading each results page only when the URLs before it have
+        been consumed
+
+        Parameters
+        ----------
+        keyword_search : str
+            The keywords to search for recipes, multiple words should be concatenated with +
+        num_pages : int
+            Number of results pages to read (0 for every page)
+        url_filter : Callable[[Iterator[str]], Iterator[str]], optional
+            Stage the URLs are passed through, e.g. streaming.filter_new, by default None
+
+        Yields
+        ------
+        str
+            Recipe URLs, in the order listed
+        """
+        def urls() -> Iterator[str]:
+            results_pages = self.search_recipes(keyword_search, num_pages)
+            for page_num in range(1, results_pages + 1):
+                page_urls = retry.call(retry.BROWSER, self.get_urls, keyword_search, page_num)
+                metrics.RESULTS_PAGES.inc()
+                if len(page_urls) == 0:
+                    # Past the last page of results
+                    return
+                yield from page_urls
+        yield from urls() if url_filter is None else url_filter(urls())
+
+    def iter_recipes(
+            self,
+            keyword_search: str,
+            num_pages: int,
+            url_filter: Callable[[Iterator[str]], Iterator[str]] = None) -> Iterator[dict]:
+        """Executes a recipe search and yields the data of each recipe as it
+        is scraped, so only one recipe is held at a time however many pages
+        are read. Recipe pages which cannot be found are skipped; errors
+        (after retries) are raised, ending the iteration (streaming.scrape
+        carries on past them)
+
+        Parameters
+        ----------
+        keyword_search : str
+            The keywords to search for recipes, multiple words should be concatenated with +
+        num_pages : int
+            Number of results pages to read (0 for every page)
+        url_filter : Callable[[Iterator[str]], Iterator[str]], optional
+            Stage the URLs are passed through before the recipes are
+            loaded, e.g. to skip recipes already stored, by default None
+
+        Yields
+        ------
+        dict
+            Dictionary of the data scraped from a recipe page
+        """
+        for url in self.iter_urls(keyword_search, num_pages, url_filter):
+            page_dict = retry.call(retry.BROWSER, self.get_page_data, url)
+            if len(page_dict) != 0:
+                yield page_dict
@@ -0,0 +1,211 @@
+"""
+Composable stages for running the pipeline as a stream, e.g. embedded
+in another job without run_pipeline. Each stage takes an iterator and
+returns one, holding at most one batch of items, so memory stays flat
+however many pages are crawled:
+
+    urls = rs.iter_urls("chicken", 0, url_filter=lambda urls: filter_new(urls, db_storage))
+    recipes = scrape(rs, urls, "chicken")
+    for page_dict in load(store(recipes, file_store, "chicken"), db_storage):
+        ...
+
+Nothing is loaded, scraped or stored until the last stage is iterated
+(`consume` iterates it to the end)
+"""
+
+from __future__ import annotations
+from itertools import islice
+from typing import TYPE_CHECKING, Iterable, Iterator
+from package.storage.file_storage import Storage
+from package.storage.dead_letter import DeadLetters
+from package.utils import metrics
+from package.utils import retry
+from package.utils import tracing
+import pipeline
+
+if TYPE_CHECKING:
+    from package.storage.db_storage import DBStorage
+    from recipe_scraper import RecipeScraper
+
+
+def batched(items: Iterable, size: int) -> Iterator[list]:
+    """Yields lists of up to `size` items
+
+    Parameters
+    ----------
+    items : Iterable
+        The items
+    size : int
+        The most items in a list
+
+    Yields
+    ------
+    list
+        The next items
+    """
+    if size < 1:
+        raise ValueError(f"size must be at least 1, not {size}")
+    items = iter(items)
+    while True:
+        batch = list(islice(items, size))
+        if len(batch) == 0:
+            return
+        yield batch
+
+
+def filter_new(
+        urls: Iterable[str],
+        db_storage: DBStorage,
+        seen_ids: set = None,
+        batch_size: int = 50) -> Iterator[str]:
+    """Passes on the recipe URLs not already seen in the stream
+    and not already stored, checking the database a batch at a time
+
+    Parameters
+    ----------
+    urls : Iterable[str]
+        Recipe URLs
+    db_storage : DBStorage
+        An instance of DBStorage initialised with a valid DB connection
+    seen_ids : set, optional
+        IDs already processed (updated with the IDs passed on), by default a new set
+    batch_size : int, optional
+        URLs checked against the database at a time, by default 50
+
+    Yields
+    ------
+    str
+        URLs of recipes to scrape
+    """
+    seen_ids = set() if seen_ids is None else seen_ids
+    for batch in batched(urls, batch_size):
+        ids = [url.rsplit('/', 1)[-1] for url in batch]
+        known = retry.call(retry.DATABASE, db_storage.existing_items, "recipe", "item_id", ids)
+        for url, item_id in zip(batch, ids):
+            if item_id in seen_ids:
+                metrics.count_item("duplicate")
+            elif item_id in known:
+                seen_ids.add(item_id)
+                metrics.count_item("skipped")
+            else:
+                seen_ids.add(item_id)
+                yield url
+
+
+def scrape(
+        rs: RecipeScraper,
+        urls: Iterable[str],
+        search_term: str,
+        dead_letters: DeadLetters = None) -> Iterator[dict]:
+    """Scrapes each recipe URL, passing on the recipes found. A recipe
+    which cannot be scraped (after retries) is logged and recorded as a
+    dead letter and the stream continues, unless a circuit breaker is open
+
+    Parameters
+    ----------
+    rs : RecipeScraper
+        The scraper
+    urls : Iterable[str]
+        Recipe URLs e.g. from `RecipeScraper.iter_urls`
+    search_term : str
+        The search words which listed the recipes
+    dead_letters : DeadLetters, optional
+        Records the recipes given up on, by default None
+
+    Yields
+    ------
+    dict
+        Dictionary of the data scraped from a recipe page
+    """
+    for url in urls:
+        try:
+            with tracing.span("recipe", url=url):
+                page_dict = retry.call(retry.BROWSER, rs.get_page_data, url)
+        except RuntimeError as e:
+            metrics.count_item("error")
+            pipeline.give_up(search_term, [url], "scrape", e, dead_letters=dead_letters)
+            continue
+        metrics.count_item("scraped" if len(page_dict) != 0 else "empty")
+        if len(page_dict) != 0:
+            yield page_dict
+
+
+def store(
+        recipes: Iterable[dict],
+        file_store: Storage,
+        search_term: str,
+        batch_size: int = 24) -> Iterator[dict]:
+    """Saves the recipes to a data file (one per batch) and their images,
+    passing each recipe on once its batch is saved
+
+    Parameters
+    ----------
+    recipes : Iterable[dict]
+        Recipe dictionaries
+    file_store : Storage
+       An instance of a concrete Storage object
+    search_term : str
+        The search words (for the file names)
+    batch_size : int, optional
+        Recipes saved to each data file, by default 24
+
+    Yields
+    ------
+    dict
+        The recipes saved
+
+    Raises
+    ------
+    RuntimeError
+        If a batch cannot be saved (after retries)
+    """
+    for batch in batched(recipes, batch_size):
+        pipeline.store_data_files(file_store, batch, search_term)
+        yield from batch
+
+
+def load(
+        recipes: Iterable[dict],
+        db_storage: DBStorage,
+        batch_size: int = 24) -> Iterator[dict]:
+    """Inserts the recipes into the database a batch at a time,
+    passing each recipe on once its batch is inserted
+
+    Parameters
+    ----------
+    recipes : Iterable[dict]
+        Recipe dictionaries
+    db_storage : DBStorage
+        An instance of DBStorage initialised with a valid DB connection
+    batch_size : int, optional
+        Recipes inserted at a time, by default 24
+
+    Yields
+    ------
+    dict
+        The recipes inserted
+
+    Raises
+    ------
+    RuntimeError
+        If a batch cannot be inserted (after retries)
+    """
+    for batch in batched(recipes, batch_size):
+        pipeline.store_data_db(db_storage, batch)
+        yield from batch
+
+
+def consume(recipes: Iterable[dict]) -> int:
+    """Runs a stream to the end
+
+    Parameters
+    ----------
+    recipes : Iterable[dict]
+        The last stage of the stream
+
+    Returns
+    -------
+    int
+        The number of recipes which came out of the stream
+    """
+    return sum(1 for _ in recipes)
@@ -0,0 +1,69 @@
+from benchmarks.fixture_server import FixtureServer, resolve_fixture
+from benchmarks import mock_site, run
+import pytest
+import os
+import urllib.error
+import urllib.request
+
+def test_resolve_fixture():
+    assert resolve_fixture("/search?q=chicken").endswith("search.html")
+    assert resolve_fixture("/search/recipes/page/2/?q=chicken&sort=-relevance").endswith("results-page-2.html")
+    assert resolve_fixture("/recipes/chicken-pie").endswith(os.path.join("recipes", "chicken-pie.html"))
+    assert resolve_fixture("/search/recipes/page/99/?q=chicken") is None
+    assert resolve_fixture("/recipes/not-a-recipe") is None
+
+def test_fixture_server():
+    with FixtureServer() as server:
+        with urllib.request.urlopen(f"{server.url}recipes/chicken-pie") as response:
+            assert b"<h1 class=\"heading-1\">Chicken pie</h1>" in response.read()
+        with pytest.raises(urllib.error.HTTPError) as e:
+            urllib.request.urlopen(f"{server.url}recipes/not-a-recipe")
+        assert e.value.code == 404
+        assert server.requests == 2
+
+def test_run_benchmarks():
+    results = run.run_benchmarks(["serialize", "file_storage_write"], repeat=3)
+    assert results["metadata"]["repeat"] == 3
+    for name in ["serialize", "file_storage_write"]:
+        result = results["results"][name]
+        assert result["runs"] == 3
+        assert result["items_per_run"] == run.RECORDS_PER_PAGE
+        assert result["min_ms"] <= result["p50_ms"] <= result["max_ms"]
+
+def test_compare():
+    baseline = {"results": {"serialize": {"p50_ms": 10.0}, "extract": {"skipped": "no Chrome"}}}
+    results = {"results": {"serialize": {"p50_ms": 13.0}, "extract": {"p50_ms": 5.0}}}
+    rows = run.compare(results, baseline, threshold=0.2)
+    assert len(rows) == 1
+    assert rows[0]["benchmark"] == "serialize"
+    assert rows[0]["regression"]
+
+def test_mock_site_pages():
+    assert mock_site.recipe_page("chicken-recipe-7") == mock_site.recipe_page("chicken-recipe-7")
+    page = mock_site.results_page("chicken pie", 2, 10, 25)
+    assert page.count("standard-card-new__description") == 10
+    assert 'href="/recipes/chicken-pie-recipe-10"' in page
+    assert mock_site.results_page("chicken pie", 3, 10, 25).count("standard-card-new__description") == 5
+    assert mock_site.results_page("chicken pie", 4, 10, 25) is None
+
+def test_mock_site_errors():
+    site = mock_site.MockSite(total_results=10, throttle_rate=0.5, error_rate=0.5)
+    statuses = [site.respond("/recipes/chicken-recipe-1")[0] for _ in range(50)]
+    assert set(statuses) == {429, 500}
+    assert site.stats == {"requests": 50, "errors": statuses.count(500), "throttled": statuses.count(429)}
+    site = mock_site.MockSite(total_results=10)
+    assert site.respond("/search/recipes/page/2/?q=chicken")[0] == 404
+    assert site.respond("/images/chicken-recipe-1.jpg?quality=90")[1] == "image/jpeg"
+
+def test_backends_imported_lazily():
+    times = run.import_times("package.storage.s3_storage")
+    assert "package.storage.s3_storage" in times
+    for module in ["boto3", "requests"]:
+        assert module not in times
+    # The HTTP archive defers them, but prometheus_client (for the
+    # metrics) imports them itself when it is installed
+    if "prometheus_client" not in times:
+        for module in ["urllib.request", "http.server"]:
+            assert module not in times
+    with pytest.raises(run.SkipBenchmark):
+        run.import_times("package.storage.not_a_module")
@@ -0,0 +1,92 @@
+from source.package.storage.compaction import Compactor, iter_compacted
+from source.package.storage.file_storage import FileStorage
+from source.package.storage.manifest import Manifest
+import pytest
+import os
+import shutil
+
+@pytest.fixture
+def root_folder() -> str:
+    folder = "./test_compaction"
+    yield folder
+    if os.path.exists(folder):
+        shutil.rmtree(folder)
+
+@pytest.fixture
+def test_fs(root_folder: str) -> FileStorage:
+    data_folder = f"{root_folder}/test_data"
+    tf = FileStorage(
+        root_folder,
+        data_folder,
+        f"{data_folder}/images",
+        Manifest(f"{root_folder}/manifest.sqlite"))
+    # Three small batches, recipe-2 is re-scraped in the last one
+    for batch, names in enumerate([["recipe-1", "recipe-2"], ["recipe-3"], ["recipe-2", "recipe-4"]]):
+        tf.save_json_file(
+            [{"item_id": name, "batch": batch} for name in names],
+            data_folder,
+            f"test-batch{batch}")
+    yield tf
+    tf.manifest.close()
+
+def test_compaction(test_fs: FileStorage, root_folder: str):
+    summary = Compactor(
+        test_fs,
+        test_fs.data_folder,
+        f"{root_folder}/journal.sqlite",
+        records_per_file=3).run()
+    assert summary == {"sources": 3, "records": 4, "files": 2}
+    # Source files are replaced by the compacted files
+    assert list(test_fs.list_files(test_fs.data_folder, "json")) == []
+    compacted = sorted(test_fs.list_files(f"{test_fs.data_folder}/compacted", "gz"))
+    records = [r for file in compacted for r in iter_compacted(test_fs, file)]
+    assert sorted(r["item_id"] for r in records) == ["recipe-1", "recipe-2", "recipe-3", "recipe-4"]
+    # The latest record wins, and the manifest points at the compacted copy
+    assert test_fs.read_item("recipe-2") == {"item_id": "recipe-2", "batch": 2}
+    assert test_fs.manifest.lookup("recipe-3")["object_key"].endswith(".jsonl.gz")
+
+def test_compaction_resumes(test_fs: FileStorage, root_folder: str, monkeypatch: pytest.MonkeyPatch):
+    journal = f"{root_folder}/journal.sqlite"
+    saved = []
+    save_bytes = test_fs.save_bytes
+
+    def failing_save_bytes(data, folder, file):
+        # Interrupt the run after the first compacted file
+        if len(saved) == 1:
+            raise OSError("disk full")
+        saved.append(file)
+        save_bytes(data, folder, file)
+
+    monkeypatch.setattr(test_fs, "save_bytes", failing_save_bytes)
+    with pytest.raises(RuntimeError):
+        Compactor(test_fs, test_fs.data_folder, journal, records_per_file=2).run()
+    monkeypatch.undo()
+
+    compactor = Compactor(test_fs, test_fs.data_folder, journal, records_per_file=2)
+    assert compactor.phase() == "write"
+    assert compactor.run() == {"sources": 3, "records": 4, "files": 2}
+    assert sorted(e["item_id"] for e in test_fs.manifest.entries()) == ["recipe-1", "recipe-2", "recipe-3", "recipe-4"]
+
+def test_compaction_keeps_scrape_times(test_fs: FileStorage, root_folder: str):
+    entries = test_fs.manifest.entries()
+    before = sorted(e["item_id"] for e in test_fs.manifest.since(0))
+    latest = max(e["scrape_time"] for e in entries)
+    assert test_fs.manifest.since(latest) == []
+    Compactor(test_fs, test_fs.data_folder, f"{root_folder}/journal.sqlite").run()
+    # Compacted records are not new
+    assert test_fs.manifest.since(latest) == []
+    assert sorted(e["item_id"] for e in test_fs.manifest.since(0)) == before
+
+def test_legacy_files_ranked_by_modified_time(root_folder: str):
+    data_folder = f"{root_folder}/legacy"
+    tf = FileStorage(root_folder, data_folder, f"{data_folder}/images")
+    # Saved before there was a manifest
+    for name in ["a", "b"]:
+        tf.save_json_file([{"item_id": "recipe-1", "file": name}], data_folder, name)
+    # The file listed first was written last, so its record wins
+    listed = list(tf.list_files(data_folder, "json"))
+    for mtime, file in [(2000, listed[0]), (1000, listed[1])]:
+        os.utime(file, (mtime, mtime))
+    Compactor(tf, data_folder, f"{root_folder}/journal.sqlite").run()
+    compacted = list(tf.list_files(f"{data_folder}/compacted", "gz"))
+    assert [r["file"] for r in iter_compacted(tf, compacted[0])] == [os.path.basename(listed[0])[:-len(".json")]]
@@ -0,0 +1,113 @@
+import json
+import os
+import sys
+import threading
+import time
+import types
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer
+import pytest
+
+# daemon imports the package as `package` (run from source/)
+SOURCE_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "source")
+if SOURCE_FOLDER not in sys.path:
+    sys.path.insert(0, SOURCE_FOLDER)
+
+daemon = pytest.importorskip("daemon")
+
+class FakeScraper:
+    def quit(self):
+        pass
+
+@pytest.fixture
+def pool() -> daemon.Daemon:
+    return daemon.Daemon(lambda search: search, None)
+
+@pytest.fixture
+def api(pool: daemon.Daemon) -> str:
+    # The API without starting the scrapers
+    server = ThreadingHTTPServer(("127.0.0.1", 0), daemon._handler(pool))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+def _request(url: str, body: dict = None) -> tuple:
+    data = None if body is None else json.dumps(body).encode("utf-8")
+    try:
+        with urllib.request.urlopen(url, data) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+def test_submit_validated(pool: daemon.Daemon):
+    job = pool.submit(" chicken curry ", 2)
+    assert job["search"] == "chicken_curry" and job["state"] == daemon.QUEUED
+    for search, pages in [("", 1), (None, 1), ("pear", -1), ("pear", "2"), ("pear", True)]:
+        with pytest.raises(ValueError):
+            pool.submit(search, pages)
+    # Without a frontier there is nothing to resume
+    with pytest.raises(ValueError):
+        pool.submit("pear", resume=True)
+    assert pool.status()["queued"] == 1
+
+def test_api(api: str):
+    status, job = _request(f"{api}/jobs", {"search": "pear", "pages": 0})
+    assert status == 202
+    assert _request(f"{api}/jobs/{job['id']}") == (200, job)
+    assert _request(f"{api}/jobs")[1] == [job]
+    assert _request(f"{api}/status")[1]["queued"] == 1
+    assert _request(f"{api}/jobs", {"search": "pear", "pages": False})[0] == 400
+    assert _request(f"{api}/jobs", {"pages": 1})[0] == 400
+    assert _request(f"{api}/jobs/unknown")[0] == 404
+    assert _request(f"{api}/unknown")[0] == 404
+
+def test_jobs_for_a_search_run_in_turn(pool: daemon.Daemon, monkeypatch: pytest.MonkeyPatch):
+    running = {}
+    overlaps = []
+    lock = threading.Lock()
+
+    def run_pipeline(search, *args, **kwargs):
+        with lock:
+            running[search] = running.get(search, 0) + 1
+            overlaps.append(running[search])
+        time.sleep(0.05)
+        with lock:
+            running[search] -= 1
+        return 1
+
+    monkeypatch.setitem(sys.modules, "pipeline", types.SimpleNamespace(run_pipeline=run_pipeline))
+    jobs = [pool.submit(search) for search in ["pear", "pear", "apple", "pear"]]
+    workers = [threading.Thread(target=pool._Daemon__work, args=(FakeScraper(),)) for _ in range(3)]
+    for worker in workers:
+        worker.start()
+    deadline = time.monotonic() + 10
+    while pool.status()["done"] < len(jobs) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    for _ in workers:
+        pool._Daemon__queue.put(None)
+    for worker in workers:
+        worker.join()
+    assert max(overlaps) == 1
+    assert all(pool.job(job["id"])["items"] == 1 for job in jobs)
+
+def test_started_scrapers_quit_when_one_fails(monkeypatch: pytest.MonkeyPatch):
+    started = []
+
+    class Scraper(FakeScraper):
+        def __init__(self, **kwargs):
+            if len(started) == 2:
+                raise RuntimeError("Chrome failed to start")
+            started.append(self)
+            self.quit_called = False
+
+        def quit(self):
+            self.quit_called = True
+
+    monkeypatch.setitem(sys.modules, "recipe_scraper", types.SimpleNamespace(RecipeScraper=Scraper))
+    pool = daemon.Daemon(lambda search: search, None, scrapers=3)
+    with pytest.raises(RuntimeError):
+        pool.start()
+    assert len(started) == 2 and all(rs.quit_called for rs in started)
@@ -0,0 +1,39 @@
+import pytest
+
+pytest.importorskip("sqlalchemy")
+from sqlalchemy import create_engine, text
+from source.package.storage.db_storage import DBStorage
+
+@pytest.fixture
+def db_url(tmp_path) -> str:
+    # SQLite stands in for Postgres
+    return f"sqlite:///{tmp_path / 'dcp.db'}"
+
+def test_link_items_recorded_once(db_url: str):
+    db = DBStorage(db_url)
+    db.link_items("search_recipe", "chicken", ["chicken-curry", "chicken-pie", "chicken-curry"])
+    db.link_items("search_recipe", "curry", ["chicken-curry", "lamb-curry"])
+    # The same search on a later run
+    db.link_items("search_recipe", "chicken", ["chicken-curry"])
+    with create_engine(db_url).connect() as conn:
+        rows = conn.execute(text(
+            "SELECT search, item_id FROM search_recipe ORDER BY search, item_id")).fetchall()
+    assert [tuple(row) for row in rows] == [
+        ("chicken", "chicken-curry"), ("chicken", "chicken-pie"),
+        ("curry", "chicken-curry"), ("curry", "lamb-curry")]
+
+def test_existing_items(db_url: str):
+    db = DBStorage(db_url)
+    # No table yet
+    assert db.existing_items("recipe_ids", "item_id", ["pear-tart"]) == set()
+    db.link_items("recipe_ids", "pear", ["pear-tart", "pear-crumble"])
+    assert db.existing_items("recipe_ids", "item_id", ["pear-tart", "apple-pie"]) == {"pear-tart"}
+
+def test_high_water(db_url: str):
+    db = DBStorage(db_url)
+    assert db.get_high_water("search_high_water", "pear") is None
+    db.set_high_water("search_high_water", "pear", "pear-tart")
+    db.set_high_water("search_high_water", "pear", "pear-crumble")
+    db.set_high_water("search_high_water", "apple", "apple-pie")
+    assert db.get_high_water("search_high_water", "pear") == "pear-crumble"
+    assert db.get_high_water("search_high_water", "apple") == "apple-pie"
@@ -0,0 +1,26 @@
+from source.package.storage.dead_letter import DeadLetters
+import pytest
+
+SEARCH = "pear"
+URLS = [f"https://www.bbcgoodfood.com/recipes/pear-{n}" for n in range(3)]
+
+@pytest.fixture
+def dead_letters(tmp_path) -> DeadLetters:
+    dead_letters = DeadLetters(str(tmp_path / "dead_letters.sqlite"))
+    yield dead_letters
+    dead_letters.close()
+
+def test_attempts_counted(dead_letters: DeadLetters):
+    dead_letters.record(SEARCH, URLS[:2], "scrape", KeyError("recipe_name"))
+    dead_letters.record(SEARCH, URLS[:1], "store", ConnectionError("Connection reset"))
+    items = {item["url"]: item for item in dead_letters.items(SEARCH)}
+    assert items[URLS[0]]["attempts"] == 2
+    assert items[URLS[0]]["stage"] == "store"
+    assert items[URLS[0]]["error_type"] == "ConnectionError"
+    assert items[URLS[1]]["attempts"] == 1
+    assert dead_letters.items("apple") == []
+
+def test_removed_once_stored(dead_letters: DeadLetters):
+    dead_letters.record(SEARCH, URLS, "scrape", TimeoutError())
+    dead_letters.remove(SEARCH, URLS[1:])
+    assert [item["url"] for item in dead_letters.items()] == URLS[:1]
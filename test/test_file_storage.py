@@ -73,10 +73,41 @@ def test_list_files(test_fs: FileStorage,
                 f"{data_folder}/test_file2.json", 
                 f"{data_folder}/test_file3.json"
                 ]
-    files = test_fs.list_files(data_folder)
+    files = list(test_fs.list_files(data_folder))
     assert sorted(expected_files) == sorted(files) and len(files) == 3
 
+def test_list_missing_folder(test_fs: FileStorage,
+        data_folder: str):
+    files = test_fs.list_files(f"{data_folder}/missing")
+    # Raised while listing, as the decorator's RuntimeError
+    with pytest.raises(RuntimeError) as exc_info:
+        list(files)
+    assert isinstance(exc_info.value.__cause__, FileNotFoundError)
+
 def test_read_json_file(test_fs: FileStorage,
         data_folder: str):
     file = test_fs.read_json_file(f"{data_folder}/test_file1.json")
     assert file
+
+def test_sharded_layout(root_folder: str):
+    sharded_root = f"{root_folder}_sharded"
+    sharded_fs = FileStorage(
+        sharded_root,
+        f"{sharded_root}/test_data",
+        f"{sharded_root}/test_data/images",
+        shard_depth=2)
+    try:
+        sharded_fs.save_json_file({"key1": "value1"}, sharded_fs.data_folder, "test_file1")
+        sharded_fs.save_bytes(b"not really a jpeg", sharded_fs.images_folder, "panda.jpg")
+        path = sharded_fs.resolve_path(sharded_fs.data_folder, "test_file1.json")
+        # Saved two hash prefix directories down
+        assert os.path.exists(path) and path.count("/") == sharded_fs.data_folder.count("/") + 3
+        # Listing finds files in shard directories, but not in other sub folders
+        assert list(sharded_fs.list_files(sharded_fs.data_folder, "json")) == [path]
+        assert list(sharded_fs.list_files(sharded_fs.images_folder)) == [
+            sharded_fs.resolve_path(sharded_fs.images_folder, "panda.jpg")]
+        assert sharded_fs.read_json_file(path) == {"key1": "value1"}
+        assert sharded_fs.file_exists(sharded_fs.images_folder, "panda.jpg")
+        assert not sharded_fs.file_exists(sharded_fs.images_folder, "pear.jpg")
+    finally:
+        shutil.rmtree(sharded_root)
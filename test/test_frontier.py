@@ -0,0 +1,79 @@
+from source.package.storage import frontier as fr
+import pytest
+
+SEARCH = "pear"
+PAGE_1 = [f"https://www.bbcgoodfood.com/recipes/pear-{n}" for n in range(3)]
+PAGE_2 = [f"https://www.bbcgoodfood.com/recipes/pear-{n}" for n in range(3, 5)]
+
+@pytest.fixture
+def frontier_path(tmp_path) -> str:
+    return str(tmp_path / "frontier.sqlite")
+
+@pytest.fixture
+def frontier(frontier_path: str) -> fr.Frontier:
+    frontier = fr.Frontier(frontier_path, checkpoint_every=2)
+    yield frontier
+    frontier.close()
+
+def test_begin_keeps_first_page_count(frontier: fr.Frontier):
+    assert frontier.begin(SEARCH, 5) == 5
+    # Resuming after the site found more results
+    assert frontier.begin(SEARCH, 7) == 5
+    frontier.reset(SEARCH)
+    assert frontier.begin(SEARCH, 7) == 7
+
+def test_page_done_when_all_items_done(frontier: fr.Frontier):
+    frontier.add_page(SEARCH, 1, PAGE_1)
+    assert frontier.page_visited(SEARCH, 1)
+    assert not frontier.page_visited(SEARCH, 2)
+    frontier.mark(SEARCH, PAGE_1[:2], fr.DONE)
+    frontier.finish_page(SEARCH, 1)
+    assert not frontier.page_done(SEARCH, 1)
+    assert frontier.remaining(SEARCH, 1) == PAGE_1[2:]
+    frontier.mark(SEARCH, PAGE_1[2:], fr.DONE)
+    frontier.finish_page(SEARCH, 1)
+    assert frontier.page_done(SEARCH, 1)
+    assert frontier.remaining(SEARCH, 1) == []
+
+def test_url_listed_twice_keeps_state(frontier: fr.Frontier):
+    frontier.add_page(SEARCH, 1, PAGE_1)
+    frontier.mark(SEARCH, PAGE_1, fr.DONE)
+    frontier.add_page(SEARCH, 2, PAGE_1[:1] + PAGE_2)
+    assert frontier.remaining(SEARCH, 2) == PAGE_2
+    assert frontier.counts(SEARCH) == {fr.DONE: 3, fr.PENDING: 2}
+
+def test_first_item(frontier: fr.Frontier):
+    assert frontier.first_item(SEARCH, 1) is None
+    frontier.add_page(SEARCH, 1, PAGE_1)
+    frontier.mark(SEARCH, PAGE_1[:1], fr.DONE)
+    # Whatever the state of the items
+    assert frontier.first_item(SEARCH, 1) == "pear-0"
+    assert frontier.first_item(SEARCH, 2) is None
+
+def test_resume_after_crash(frontier_path: str):
+    frontier = fr.Frontier(frontier_path, checkpoint_every=2)
+    frontier.begin(SEARCH, 2)
+    frontier.add_page(SEARCH, 1, PAGE_1)
+    frontier.mark(SEARCH, PAGE_1[:1], fr.DONE)
+    frontier.mark(SEARCH, PAGE_1[1:2], fr.FAILED, "Timed out")
+    frontier.mark(SEARCH, PAGE_1[2:], fr.IN_PROGRESS)
+    # Stops without closing: the change after the checkpoint is lost
+    resumed = fr.Frontier(frontier_path)
+    assert resumed.begin(SEARCH, 2) == 2
+    assert resumed.page_visited(SEARCH, 1)
+    assert resumed.remaining(SEARCH, 1) == PAGE_1[1:]
+    assert resumed.failed(SEARCH) == [
+        {"url": PAGE_1[1], "page_num": 1, "attempts": 0, "error": "Timed out"}]
+    resumed.close()
+
+def test_attempts_counted(frontier: fr.Frontier):
+    frontier.add_page(SEARCH, 1, PAGE_1)
+    for state in [fr.IN_PROGRESS, fr.FAILED, fr.IN_PROGRESS]:
+        frontier.mark(SEARCH, PAGE_1[:1], state, "Timed out" if state == fr.FAILED else None)
+    frontier.mark(SEARCH, PAGE_1[:1], fr.FAILED, "Not found")
+    assert frontier.failed(SEARCH)[0]["attempts"] == 2
+    assert frontier.failed(SEARCH)[0]["error"] == "Not found"
+
+def test_unknown_state(frontier: fr.Frontier):
+    with pytest.raises(ValueError):
+        frontier.mark(SEARCH, PAGE_1, "lost")
@@ -0,0 +1,55 @@
+from source.package.utils import http_archive
+from source.package.storage.file_storage import FileStorage
+from benchmarks.fixture_server import FixtureServer
+import pytest
+import os
+import time
+import urllib.request
+
+@pytest.fixture
+def archive_path(tmp_path) -> str:
+    yield str(tmp_path / "archive.sqlite")
+    http_archive.deactivate()
+
+def test_record_and_lookup(archive_path: str):
+    archive = http_archive.HttpArchive(archive_path)
+    body = b"<html>" + b"chicken " * 100000 + b"</html>"
+    archive.record("https://www.bbcgoodfood.com/search?q=chicken", body, content_type="text/html")
+    assert archive.lookup("https://www.bbcgoodfood.com/search?q=chicken") == (200, "text/html", body)
+    assert archive.lookup_path("/search?q=chicken")[2] == body
+    assert archive.lookup("https://www.bbcgoodfood.com/search?q=pear") is None
+    archive.close()
+    # Stored compressed
+    assert os.path.getsize(archive_path) < len(body)
+
+def test_inactive_by_default():
+    assert not http_archive.active()
+    assert http_archive.browser_url("https://www.bbcgoodfood.com/") == "https://www.bbcgoodfood.com/"
+
+def test_record_then_replay(archive_path: str, tmp_path):
+    with FixtureServer() as server:
+        image_url = f"{server.url}images/chicken-pie.jpg?quality=90"
+        http_archive.activate(archive_path, http_archive.RECORD)
+        recorded = http_archive.fetch(image_url)
+        http_archive.record_page("https://www.bbcgoodfood.com/recipes/chicken-pie", "<html>pie</html>")
+        http_archive.deactivate()
+
+    http_archive.activate(archive_path, http_archive.REPLAY, latency=0.05)
+    start = time.perf_counter()
+    assert http_archive.fetch(image_url) == recorded
+    assert time.perf_counter() - start >= 0.05
+    with pytest.raises(http_archive.ArchiveMissError):
+        http_archive.fetch("https://images.example.com/missing.jpg")
+
+    # Pages are served to the browser from a local server by path
+    url = http_archive.browser_url("https://www.bbcgoodfood.com/recipes/chicken-pie")
+    assert url.startswith("http://127.0.0.1:")
+    assert http_archive.browser_url(url) == url
+    with urllib.request.urlopen(url) as response:
+        assert response.read() == b"<html>pie</html>"
+
+    # Storage image downloads are replayed too
+    fs = FileStorage(str(tmp_path), str(tmp_path / "data"), str(tmp_path / "images"))
+    fs.save_image(image_url, fs.images_folder, "chicken-pie.jpg")
+    with open(tmp_path / "images" / "chicken-pie.jpg", "rb") as f:
+        assert f.read() == recorded
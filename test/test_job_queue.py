@@ -0,0 +1,89 @@
+import pytest
+import time
+
+pytest.importorskip("sqlalchemy")
+from source.package.storage import job_queue as jq
+
+SEARCH = "pear"
+
+@pytest.fixture
+def queue(tmp_path) -> jq.JobQueue:
+    # SQLite stands in for the shared Postgres database
+    return jq.JobQueue(f"sqlite:///{tmp_path / 'queue.db'}", lease_seconds=60, max_attempts=2)
+
+def test_jobs_queued_once(queue: jq.JobQueue):
+    assert queue.enqueue(SEARCH, jq.RESULTS_PAGE, [1, 2]) == 2
+    # A second worker given the same search
+    assert queue.enqueue(SEARCH, jq.RESULTS_PAGE, [1, 2, 3]) == 1
+    assert queue.counts(SEARCH) == {jq.PENDING: 3}
+
+def test_claims_do_not_overlap(queue: jq.JobQueue):
+    queue.enqueue(SEARCH, jq.RESULTS_PAGE, [1, 2, 3])
+    first = queue.claim(SEARCH, "worker-1", 2)
+    second = queue.claim(SEARCH, "worker-2", 2)
+    assert [job["key"] for job in first] == ["1", "2"]
+    assert [job["key"] for job in second] == ["3"]
+    assert queue.claim(SEARCH, "worker-3", 2) == []
+
+def test_recipes_claimed_first(queue: jq.JobQueue):
+    queue.enqueue(SEARCH, jq.RESULTS_PAGE, [2])
+    queue.enqueue(SEARCH, jq.RECIPE, ["https://www.bbcgoodfood.com/recipes/pear-tart"])
+    assert [job["kind"] for job in queue.claim(SEARCH, "worker-1", 1)] == [jq.RECIPE]
+
+def test_complete_needs_lease(queue: jq.JobQueue):
+    queue.enqueue(SEARCH, jq.RESULTS_PAGE, [1])
+    jobs = queue.claim(SEARCH, "worker-1")
+    assert queue.complete(SEARCH, jobs, "worker-2") == 0
+    assert queue.complete(SEARCH, jobs, "worker-1") == 1
+    assert queue.counts(SEARCH) == {jq.DONE: 1}
+    assert queue.outstanding(SEARCH) == 0
+
+def test_failed_jobs_retried_then_failed(queue: jq.JobQueue):
+    queue.enqueue(SEARCH, jq.RESULTS_PAGE, [1])
+    queue.fail(SEARCH, queue.claim(SEARCH, "worker-1"), "worker-1", "Timed out")
+    jobs = queue.claim(SEARCH, "worker-2")
+    assert jobs[0]["attempts"] == 2
+    queue.fail(SEARCH, jobs, "worker-2", "Timed out")
+    assert queue.claim(SEARCH, "worker-1") == []
+    assert queue.failed(SEARCH) == [
+        {"kind": jq.RESULTS_PAGE, "key": "1", "attempts": 2, "error": "Timed out"}]
+
+def test_expired_lease_requeued(tmp_path):
+    queue = jq.JobQueue(f"sqlite:///{tmp_path / 'queue.db'}", lease_seconds=0.1)
+    queue.enqueue(SEARCH, jq.RESULTS_PAGE, [1])
+    lost = queue.claim(SEARCH, "worker-1")
+    time.sleep(0.2)
+    jobs = queue.claim(SEARCH, "worker-2")
+    assert [job["key"] for job in jobs] == ["1"]
+    # The first worker no longer holds the job
+    assert queue.renew(SEARCH, lost, "worker-1") == 0
+    assert queue.complete(SEARCH, jobs, "worker-2") == 1
+
+def test_finished_run_begun_again(queue: jq.JobQueue):
+    queue.enqueue(SEARCH, jq.RESULTS_PAGE, [1, 2])
+    jobs = queue.claim(SEARCH, "worker-1", 1)
+    # Joins the run in progress
+    assert not queue.begin(SEARCH)
+    assert queue.counts(SEARCH) == {jq.PENDING: 1, jq.LEASED: 1}
+    queue.complete(SEARCH, jobs, "worker-1")
+    queue.fail(SEARCH, queue.claim(SEARCH, "worker-1"), "worker-1", "Timed out")
+    queue.fail(SEARCH, queue.claim(SEARCH, "worker-1"), "worker-1", "Timed out")
+    # The next scheduled run crawls the search again
+    assert queue.begin(SEARCH)
+    assert queue.enqueue(SEARCH, jq.RESULTS_PAGE, [1, 2]) == 2
+
+def test_reset(queue: jq.JobQueue):
+    queue.enqueue(SEARCH, jq.RESULTS_PAGE, [1])
+    queue.enqueue("apple", jq.RESULTS_PAGE, [1])
+    queue.reset(SEARCH)
+    assert queue.counts(SEARCH) == {}
+    assert queue.counts("apple") == {jq.PENDING: 1}
+
+def test_batch_of_both_kinds_updated(queue: jq.JobQueue):
+    queue.enqueue(SEARCH, jq.RESULTS_PAGE, [1, 2])
+    queue.enqueue(SEARCH, jq.RECIPE, ["https://www.bbcgoodfood.com/recipes/pear-tart"])
+    jobs = queue.claim(SEARCH, "worker-1")
+    assert queue.renew(SEARCH, jobs, "worker-1") == 3
+    assert queue.complete(SEARCH, jobs[:2], "worker-1") == 2
+    assert queue.counts(SEARCH) == {jq.DONE: 2, jq.LEASED: 1}
+    assert queue.renew(SEARCH, [], "worker-1") == 0
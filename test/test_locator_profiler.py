@@ -0,0 +1,40 @@
+from source.package.scraper.locator_profiler import LocatorProfiler
+from types import SimpleNamespace
+import pytest
+
+class FakeLocator:
+    def __init__(self, locate_by: str, locate_value: str):
+        self.locate_by = locate_by
+        self.locate_value = locate_value
+
+    def __iter__(self):
+        yield from [self.locate_by, self.locate_value]
+
+@pytest.fixture
+def constants() -> SimpleNamespace:
+    return SimpleNamespace(
+        RECIPE_NAME_LOC=FakeLocator("xpath", "//h1"),
+        IMAGES_LOC=FakeLocator("xpath", "//img"))
+
+def test_named_locators(constants: SimpleNamespace):
+    profiler = LocatorProfiler()
+    profiler.name_locators(constants)
+    assert profiler.name_of(constants.RECIPE_NAME_LOC) == "RECIPE_NAME_LOC"
+    assert profiler.name_of(("xpath", "//div")) == "xpath=//div"
+
+def test_report(constants: SimpleNamespace):
+    profiler = LocatorProfiler()
+    profiler.name_locators(constants)
+    for count in [1, 0]:
+        with profiler.measure(constants.IMAGES_LOC) as measurement:
+            measurement.count = count
+    with pytest.raises(ValueError):
+        with profiler.measure(constants.RECIPE_NAME_LOC):
+            raise ValueError("no such element")
+
+    report = {row["locator"]: row for row in profiler.report()}
+    assert report["IMAGES_LOC"]["calls"] == 2
+    assert report["IMAGES_LOC"]["miss_rate"] == 0.5
+    assert report["IMAGES_LOC"]["mean_elements"] == 0.5
+    assert report["RECIPE_NAME_LOC"]["error_rate"] == 1
+    assert "IMAGES_LOC" in profiler.format_report()
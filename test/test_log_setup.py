@@ -0,0 +1,41 @@
+from source.package.utils.log_setup import configure_logging
+import pytest
+import json
+import logging
+import os
+
+@pytest.fixture
+def log_file(tmp_path) -> str:
+    root_logger = logging.getLogger()
+    handlers, level = root_logger.handlers[:], root_logger.level
+    yield str(tmp_path / "test.log")
+    for handler in root_logger.handlers[:]:
+        root_logger.removeHandler(handler)
+    for handler in handlers:
+        root_logger.addHandler(handler)
+    root_logger.setLevel(level)
+
+def test_structured_json_lines(log_file: str):
+    listener = configure_logging(log_file)
+    logger = logging.getLogger("test_log_setup")
+    logger.info("Scraped %s", "pear-tart", extra={"stage": "scrape", "item_id": "pear-tart", "duration": 0.5})
+    try:
+        raise ValueError("bad page")
+    except ValueError:
+        logger.exception("Failed")
+    listener.stop()
+
+    with open(log_file) as logs:
+        lines = [json.loads(line) for line in logs]
+    assert lines[0]["message"] == "Scraped pear-tart"
+    assert (lines[0]["stage"], lines[0]["item_id"], lines[0]["duration"]) == ("scrape", "pear-tart", 0.5)
+    assert "ValueError: bad page" in lines[1]["exception"]
+
+def test_rotation(log_file: str):
+    listener = configure_logging(log_file, max_bytes=500, backup_count=2)
+    logger = logging.getLogger("test_log_setup")
+    for idx in range(50):
+        logger.info(f"message {idx}")
+    listener.stop()
+    assert os.path.exists(f"{log_file}.1") and os.path.exists(f"{log_file}.2")
+    assert not os.path.exists(f"{log_file}.3")
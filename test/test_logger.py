@@ -0,0 +1,82 @@
+from source.package.utils.logger import log, log_class
+import pytest
+import logging
+
+class Counted:
+    """An argument which counts how often it is formatted"""
+    reprs = 0
+
+    def __repr__(self):
+        Counted.reprs += 1
+        return "Counted()"
+
+class Base:
+    def base_method(self, value):
+        return value
+
+@log_class
+class Decorated(Base):
+    logger = logging.getLogger("test_logger")
+
+    def get_value(self, value):
+        return value
+
+    def fail(self):
+        raise ValueError("failed")
+
+    def fail_nested(self):
+        return self.fail()
+
+    def _private(self):
+        return "private"
+
+def test_class_identity():
+    obj = Decorated()
+    assert type(obj) is Decorated
+    assert isinstance(obj, Decorated) and isinstance(obj, Base)
+
+def test_methods_wrapped_once():
+    # Wrapped at decoration time, not on each attribute access
+    assert Decorated.get_value is Decorated.get_value
+    assert Decorated.get_value.__wrapped__.__name__ == "get_value"
+    assert Decorated.base_method.__wrapped__ is Base.base_method
+    assert not hasattr(Decorated._private, "__wrapped__")
+
+def test_no_repr_when_debug_disabled(caplog: pytest.LogCaptureFixture):
+    Counted.reprs = 0
+    with caplog.at_level(logging.INFO, logger="test_logger"):
+        Decorated().get_value(Counted())
+    assert Counted.reprs == 0
+    with caplog.at_level(logging.DEBUG, logger="test_logger"):
+        Decorated().get_value(Counted())
+    assert Counted.reprs == 1
+    assert "get_value called with args" in caplog.text
+
+def test_exception_logged_once(caplog: pytest.LogCaptureFixture):
+    with pytest.raises(RuntimeError) as exc_info:
+        Decorated().fail_nested()
+    assert isinstance(exc_info.value.__cause__, ValueError)
+    assert caplog.text.count("Exception raised in") == 1
+
+def test_log_function():
+    @log
+    def add(a, b):
+        return a + b
+
+    assert add(1, 2) == 3
+    with pytest.raises(RuntimeError):
+        add(1, "2")
+
+def test_generator_errors_wrapped(caplog: pytest.LogCaptureFixture):
+    @log
+    def numbers():
+        yield 1
+        raise ValueError("failed")
+
+    items = numbers()
+    assert next(items) == 1
+    # Raised while iterating, not when called
+    with pytest.raises(RuntimeError) as exc_info:
+        next(items)
+    assert isinstance(exc_info.value.__cause__, ValueError)
+    assert caplog.text.count("Exception raised in numbers") == 1
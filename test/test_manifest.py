@@ -0,0 +1,93 @@
+from source.package.storage.file_storage import FileStorage
+from source.package.storage.manifest import Manifest
+import pytest
+import os
+import shutil
+import time
+
+@pytest.fixture(scope="module")
+def root_folder() -> str:
+    return "./test_manifest"
+
+@pytest.fixture(scope="module")
+def data_folder(root_folder: str) -> str:
+    return f"{root_folder}/test_data"
+
+@pytest.fixture(scope="module")
+def test_fs(root_folder: str, data_folder: str) -> FileStorage:
+    tf = FileStorage(
+        root_folder,
+        data_folder,
+        f"{data_folder}/images",
+        Manifest(f"{root_folder}/manifest.sqlite"))
+    yield tf
+    tf.manifest.close()
+    if os.path.exists(root_folder):
+        shutil.rmtree(root_folder)
+
+@pytest.fixture(scope="module")
+def saved_at(test_fs: FileStorage, data_folder: str) -> float:
+    start = time.time()
+    test_fs.save_json_file(
+        [{"item_id": "recipe-1", "recipe_name": "Pear tart"},
+        {"item_id": "recipe-2", "recipe_name": "Poached pears"}],
+        data_folder,
+        "pear-batch1")
+    return start
+
+def test_saved_file_is_valid_json(test_fs: FileStorage,
+        data_folder: str,
+        saved_at: float):
+    records = test_fs.read_json_file(f"{data_folder}/pear-batch1.json")
+    assert [r["item_id"] for r in records] == ["recipe-1", "recipe-2"]
+
+def test_lookup(test_fs: FileStorage,
+        data_folder: str,
+        saved_at: float):
+    entry = test_fs.manifest.lookup("recipe-2")
+    assert entry["object_key"] == f"{data_folder}/pear-batch1.json"
+    assert test_fs.manifest.lookup("not-there") is None
+
+def test_read_item(test_fs: FileStorage,
+        saved_at: float):
+    assert test_fs.read_item("recipe-2") == {"item_id": "recipe-2", "recipe_name": "Poached pears"}
+
+def test_latest_entry_wins(test_fs: FileStorage,
+        data_folder: str,
+        saved_at: float):
+    test_fs.save_json_file(
+        [{"item_id": "recipe-1", "recipe_name": "Pear and almond tart"}],
+        data_folder,
+        "pear-batch2")
+    assert test_fs.read_item("recipe-1")["recipe_name"] == "Pear and almond tart"
+    entries = test_fs.manifest.entries(data_folder)
+    assert sorted(e["item_id"] for e in entries) == ["recipe-1", "recipe-2"]
+
+def test_since(test_fs: FileStorage,
+        saved_at: float):
+    assert len(test_fs.manifest.since(saved_at - 1)) == 2
+    assert test_fs.manifest.since(time.time() + 1) == []
+
+def test_merge(test_fs: FileStorage,
+        root_folder: str,
+        saved_at: float):
+    other = Manifest(f"{root_folder}/other.sqlite")
+    other.record("recipe-3", "elsewhere/batch.json", 2, 10, "abc")
+    other.close()
+    test_fs.manifest.merge(f"{root_folder}/other.sqlite")
+    test_fs.manifest.merge(f"{root_folder}/other.sqlite")
+    assert len(test_fs.manifest.entries("elsewhere/")) == 1
+
+def test_newest_entry_wins_when_merged_out_of_order(root_folder: str):
+    manifest = Manifest(f"{root_folder}/out_of_order.sqlite")
+    other = Manifest(f"{root_folder}/older.sqlite")
+    try:
+        manifest.record("recipe-4", "newer/batch.json", 0, 10, "new", scrape_time=200)
+        # Saved earlier by another writer, but merged in afterwards
+        other.record("recipe-4", "older/batch.json", 0, 10, "old", scrape_time=100)
+        other.close()
+        manifest.merge(f"{root_folder}/older.sqlite")
+        assert manifest.lookup("recipe-4")["object_key"] == "newer/batch.json"
+        assert [e["object_key"] for e in manifest.entries()] == ["newer/batch.json"]
+    finally:
+        manifest.close()
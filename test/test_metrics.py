@@ -0,0 +1,40 @@
+from source.package.utils import metrics
+import pytest
+
+prometheus_client = pytest.importorskip("prometheus_client")
+
+def _value(name: str, **labels) -> float:
+    return prometheus_client.REGISTRY.get_sample_value(name, labels) or 0.0
+
+def test_updates_not_recorded_by_default():
+    metrics.count_item("scraped")
+    assert metrics.take_updates() == []
+
+def test_worker_updates_applied():
+    metrics.forward_updates()
+    try:
+        metrics.count_item("empty")
+        with metrics.time_stage("extract"):
+            pass
+        metrics.RESULTS_PAGES.inc()
+        # Gauges are not forwarded
+        metrics.BROWSER_RSS.set(1024)
+        updates = metrics.take_updates()
+    finally:
+        metrics.forward_updates(False)
+    assert [(name, labels, method) for name, labels, method, _ in updates] == [
+        ("dcp_items_total", ("empty",), "inc"),
+        ("dcp_stage_duration_seconds", ("extract",), "observe"),
+        ("dcp_results_pages_total", (), "inc")]
+    assert metrics.take_updates() == []
+    items = _value("dcp_items_total", outcome="empty")
+    observed = _value("dcp_stage_duration_seconds_count", stage="extract")
+    # In the coordinator
+    metrics.apply_updates(updates)
+    assert _value("dcp_items_total", outcome="empty") == items + 1
+    assert _value("dcp_stage_duration_seconds_count", stage="extract") == observed + 1
+
+def test_registered_metric_reused():
+    # e.g. this module imported again as source.package.utils.metrics
+    items = metrics._metric("Counter", "dcp_items_total", "Recipe items processed by outcome", ["outcome"])
+    assert items.metric is metrics.ITEMS.metric
@@ -0,0 +1,86 @@
+from source.package.utils import page_cache
+import pytest
+import os
+import random
+import time
+import zlib
+import urllib.request
+
+URL = "https://www.bbcgoodfood.com/recipes/pear-tart"
+
+@pytest.fixture
+def cache_path(tmp_path) -> str:
+    yield str(tmp_path / "pages.sqlite")
+    page_cache.deactivate()
+
+def _page(n: int) -> str:
+    # Random text, so pages do not compress to nothing
+    words = random.Random(n).choices(["pear", "tart", "sugar", "butter", "flour"], k=20000)
+    return f"<html><head><title>{n}</title></head><body>{' '.join(words)}</body></html>"
+
+def test_put_and_get(cache_path: str):
+    cache = page_cache.PageCache(cache_path)
+    page = "<html>" + "pear " * 100000 + "</html>"
+    cache.put(URL, page)
+    assert cache.get(URL) == page
+    assert cache.get("https://www.bbcgoodfood.com/recipes/apple-pie") is None
+    assert cache.urls() == [URL]
+    cache.close()
+    # Stored compressed
+    assert os.path.getsize(cache_path) < len(page)
+
+def test_expired_pages_removed(cache_path: str):
+    cache = page_cache.PageCache(cache_path, ttl=0.05)
+    cache.put(URL, "<html>tart</html>")
+    assert cache.get(URL) is not None
+    time.sleep(0.1)
+    assert cache.get(URL) is None
+    assert cache.urls() == []
+    cache.close()
+
+def test_least_recently_used_evicted(cache_path: str):
+    size = len(zlib.compress(_page(0).encode()))
+    cache = page_cache.PageCache(cache_path, max_mb=2.5 * size / 2**20)
+    cache.put(f"{URL}-0", _page(0))
+    cache.put(f"{URL}-1", _page(1))
+    # Used, so page 1 is evicted rather than page 0
+    time.sleep(0.01)
+    assert cache.get(f"{URL}-0") is not None
+    cache.put(f"{URL}-2", _page(2))
+    assert cache.urls() == [f"{URL}-0", f"{URL}-2"]
+    assert cache.size() <= cache.max_bytes
+    cache.close()
+
+def test_pages(cache_path: str):
+    cache = page_cache.PageCache(cache_path)
+    cache.put(URL, "<html>tart</html>")
+    cache.put("https://www.bbcgoodfood.com/search?q=pear", "<html>results</html>")
+    assert list(cache.pages("https://www.bbcgoodfood.com/recipes/")) == [(URL, "<html>tart</html>")]
+    assert len(list(cache.pages())) == 2
+    cache.close()
+
+def test_inactive_by_default():
+    assert not page_cache.active()
+    assert page_cache.browser_url(URL) is None
+    page_cache.store(URL, "<html>tart</html>")
+
+def test_replay(cache_path: str):
+    page_cache.activate(cache_path)
+    assert page_cache.browser_url(URL) is None
+    page_cache.store(URL, "<html><head><title>Pear tart</title></head><body>tart</body></html>")
+    local_url = page_cache.browser_url(URL)
+    assert local_url.startswith("http://127.0.0.1:")
+    with urllib.request.urlopen(local_url) as response:
+        body = response.read().decode()
+    # Links resolve to the web site and nothing is fetched
+    assert f'<head><base href="{URL}">' in body
+    assert "Content-Security-Policy" in body
+    assert body.endswith("<title>Pear tart</title></head><body>tart</body></html>")
+
+def test_offline(cache_path: str):
+    page_cache.activate(cache_path, offline=True)
+    assert page_cache.settings()["offline"]
+    # Pages are not cached, and missing pages are errors
+    page_cache.store(URL, "<html>tart</html>")
+    with pytest.raises(page_cache.PageCacheMissError):
+        page_cache.browser_url(URL)
@@ -0,0 +1,38 @@
+import os
+import sys
+import pytest
+
+# pipeline imports the package as `package` (run from source/)
+SOURCE_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "source")
+if SOURCE_FOLDER not in sys.path:
+    sys.path.insert(0, SOURCE_FOLDER)
+
+# The pipeline imports Selenium (through recipe_scraper) and tqdm
+pipeline = pytest.importorskip("pipeline")
+
+class FailingScraper:
+    def __init__(self, *args, **kwargs):
+        self.newest_first = kwargs.get("newest_first", False)
+        self.quit_calls = 0
+        FailingScraper.started.append(self)
+
+    def search_recipes(self, search_term: str, num_pages: int) -> int:
+        raise RuntimeError("Chrome crashed")
+
+    def quit(self):
+        self.quit_calls += 1
+
+def test_failed_run_quits_its_scraper(monkeypatch: pytest.MonkeyPatch):
+    FailingScraper.started = []
+    monkeypatch.setattr(pipeline, "RecipeScraper", FailingScraper)
+    with pytest.raises(RuntimeError):
+        pipeline.run_pipeline("pear", 1, None, None)
+    assert [rs.quit_calls for rs in FailingScraper.started] == [1]
+
+def test_failed_run_leaves_scraper_passed_in():
+    FailingScraper.started = []
+    rs = FailingScraper()
+    with pytest.raises(RuntimeError):
+        pipeline.run_pipeline("pear", 1, None, None, rs=rs)
+    # Kept warm, e.g. by the daemon
+    assert rs.quit_calls == 0
@@ -0,0 +1,50 @@
+from source.package.utils import profiling
+import pytest
+import json
+import os
+import pstats
+import time
+
+@pytest.fixture
+def profile_folder(tmp_path) -> str:
+    yield str(tmp_path / "profile")
+    profiling.disable_profiling()
+
+def test_stage_is_noop_when_disabled():
+    assert profiling.get_profiler() is None
+    with profiling.stage("extract"):
+        pass
+    profiling.page_done()
+
+def test_profile_files_written(profile_folder: str):
+    profiling.enable_profiling(profile_folder, snapshot_every=2)
+    kept = []
+    for _ in range(4):
+        with profiling.stage("extract"):
+            kept.append(bytearray(256 * 1024))
+            time.sleep(0.03)
+        with profiling.stage("json_write"):
+            kept.append(bytes(16))
+        profiling.page_done()
+    profiling.disable_profiling()
+
+    files = os.listdir(profile_folder)
+    for name in ["cpu.pstats", "cpu.collapsed", "memory_report.json", "memory_report.txt",
+            "memory-page-2.snapshot", "memory-page-4.snapshot", "memory-final.snapshot"]:
+        assert name in files
+    assert pstats.Stats(os.path.join(profile_folder, "cpu.pstats")).total_calls > 0
+
+    with open(os.path.join(profile_folder, "cpu.collapsed")) as f:
+        stages = {line.split(";", 1)[0] for line in f}
+    assert "extract" in stages
+
+    with open(os.path.join(profile_folder, "memory_report.json")) as f:
+        report = json.load(f)
+    assert report["pages"] == 4
+    assert list(report["stages"])[0] == "extract"
+    extract = report["stages"]["extract"]
+    assert extract["calls"] == 4
+    assert extract["net_bytes"] >= 4 * 256 * 1024
+    # Allocator detail recorded for the stage call after the page 2 snapshot
+    assert any("test_profiling.py:" in a["line"] for a in extract["top_allocators"])
+    assert [s["label"] for s in report["snapshots"]] == ["page-2", "page-4", "final"]
@@ -0,0 +1,103 @@
+from source.package.utils import rate_limit
+from urllib.error import HTTPError
+import pytest
+import threading
+import time
+
+URL = "https://www.bbcgoodfood.com/recipes/pear-tart"
+
+@pytest.fixture
+def limiter() -> rate_limit.HostLimiter:
+    return rate_limit.HostLimiter("www.bbcgoodfood.com", rate=50.0, burst=1,
+        concurrency=2, max_concurrency=3, max_rate=52.0, rate_step=1.0,
+        latency_target=0.5, cooldown=60.0)
+
+@pytest.fixture
+def settings():
+    saved = rate_limit.settings()
+    yield
+    rate_limit.configure(enabled=True, **saved)
+
+def test_token_bucket_paces_requests():
+    bucket = rate_limit.TokenBucket(rate=20.0, burst=2)
+    start = time.monotonic()
+    # The burst, then one token per 50ms
+    waits = [bucket.acquire() for _ in range(4)]
+    assert waits[:2] == [0.0, 0.0]
+    assert time.monotonic() - start >= 0.09
+
+def test_token_bucket_pause():
+    bucket = rate_limit.TokenBucket(rate=100.0, burst=5)
+    bucket.pause(0.1)
+    assert bucket.acquire() >= 0.09
+
+def test_healthy_responses_increase_limits(limiter: rate_limit.HostLimiter):
+    for _ in range(4):
+        with limiter.request():
+            pass
+    assert limiter.rate == 52.0
+    assert limiter.limit == 3.0
+    assert limiter.in_flight == 0
+    assert limiter.latency is not None
+
+def test_backoff_once_per_cooldown(limiter: rate_limit.HostLimiter):
+    with limiter.request() as req:
+        req.record(429, "0")
+    assert limiter.rate == 25.0
+    assert limiter.limit == 1.0
+    # A burst of failures only backs off once
+    with limiter.request() as req:
+        req.record(503)
+    assert limiter.rate == 25.0
+
+def test_slow_response_backs_off(limiter: rate_limit.HostLimiter):
+    with limiter.request():
+        time.sleep(0.6)
+    assert limiter.rate == 25.0
+
+def test_exception_classified(limiter: rate_limit.HostLimiter):
+    with pytest.raises(HTTPError):
+        with limiter.request():
+            raise HTTPError(URL, 500, "Server Error", {}, None)
+    assert limiter.limit == 1.0
+
+def test_concurrency_limited(limiter: rate_limit.HostLimiter):
+    peak = []
+    def fetch():
+        with limiter.request():
+            peak.append(limiter.in_flight)
+            time.sleep(0.05)
+    threads = [threading.Thread(target=fetch) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert max(peak) <= 3
+    assert limiter.in_flight == 0
+
+def test_record():
+    req = rate_limit.Request()
+    req.record(200)
+    assert req.outcome == rate_limit.OK
+    req.record(429, "Wed, 21 Oct 2026 07:28:00 GMT")
+    assert req.outcome == rate_limit.THROTTLED
+    assert req.retry_after is None
+    req = rate_limit.Request()
+    req.record_exception(TimeoutError())
+    assert req.outcome == rate_limit.TIMEOUT
+
+def test_limiter_per_host(settings):
+    rate_limit.configure(rate=5.0)
+    limiter = rate_limit.get_limiter(URL)
+    assert rate_limit.get_limiter("https://www.bbcgoodfood.com/search?q=pear") is limiter
+    assert rate_limit.get_limiter("http://127.0.0.1:8000/search") is not limiter
+    assert limiter.rate == 5.0
+    with pytest.raises(ValueError):
+        rate_limit.configure(speed=5.0)
+
+def test_disabled(settings):
+    rate_limit.configure(enabled=False)
+    with rate_limit.request(URL) as req:
+        req.record(429)
+    rate_limit.configure(enabled=True)
+    assert rate_limit.get_limiter(URL).rate == rate_limit.settings()["rate"]
@@ -0,0 +1,76 @@
+from source.package.utils import retry
+from source.package.utils.logger import log
+from urllib.error import HTTPError
+import pytest
+
+URL = "https://www.bbcgoodfood.com/recipes/pear-tart"
+
+class TimeoutException(Exception):
+    """Stands in for selenium's TimeoutException"""
+
+class OperationalError(Exception):
+    """Stands in for SQLAlchemy's OperationalError"""
+
+class ClientError(Exception):
+    """Stands in for botocore's ClientError"""
+    def __init__(self, code: str, status: int):
+        self.response = {"Error": {"Code": code}, "ResponseMetadata": {"HTTPStatusCode": status}}
+
+@pytest.fixture(autouse=True)
+def settings():
+    saved = retry.settings()
+    retry.configure(base_delay=0.0, failure_threshold=3, reset_timeout=60.0)
+    yield
+    retry.configure(**saved)
+
+@log
+def flaky(failures: list):
+    # Raises each error in turn, then returns
+    if failures:
+        raise failures.pop(0)
+    return "ok"
+
+@pytest.mark.parametrize("error, transient", [
+    (TimeoutException(), True),
+    (OperationalError(), True),
+    (ConnectionResetError(), True),
+    (HTTPError(URL, 503, "Service Unavailable", {}, None), True),
+    (HTTPError(URL, 429, "Too Many Requests", {}, None), True),
+    (HTTPError(URL, 404, "Not Found", {}, None), False),
+    (ClientError("SlowDown", 503), True),
+    (ClientError("AccessDenied", 403), False),
+    (KeyError("item_id"), False)])
+def test_is_transient(error: Exception, transient: bool):
+    assert retry.is_transient(error) == transient
+
+def test_transient_errors_retried():
+    assert retry.call(retry.BROWSER, flaky, [TimeoutException(), TimeoutException()]) == "ok"
+    assert retry.get_breaker(retry.BROWSER).failures == 0
+
+def test_last_error_raised():
+    with pytest.raises(RuntimeError) as e:
+        retry.call(retry.BROWSER, flaky, [TimeoutException()] * 3)
+    assert isinstance(retry.root_cause(e.value), TimeoutException)
+
+def test_permanent_error_not_retried():
+    failures = [KeyError("item_id"), TimeoutException()]
+    with pytest.raises(RuntimeError):
+        retry.call(retry.BROWSER, flaky, failures)
+    assert len(failures) == 1
+
+def test_breaker_opens_and_closes(monkeypatch):
+    retry.configure(attempts=1, failure_threshold=2)
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            retry.call(retry.DATABASE, flaky, [OperationalError()])
+    breaker = retry.get_breaker(retry.DATABASE)
+    assert breaker.is_open
+    with pytest.raises(retry.CircuitOpenError):
+        retry.call(retry.DATABASE, flaky, [])
+    # Other dependencies are unaffected
+    assert retry.call(retry.STORAGE, flaky, []) == "ok"
+    # After the reset timeout one trial call is let through
+    now = retry.time.monotonic()
+    monkeypatch.setattr(retry.time, "monotonic", lambda: now + 61)
+    assert retry.call(retry.DATABASE, flaky, []) == "ok"
+    assert not breaker.is_open
@@ -31,10 +31,12 @@ def test_s3(root_folder: str, data_folder: str, images_folder: str) -> S3Storage
 def test_constructor(test_s3: S3Storage,
         root_folder: str):
     # Will be initislaied in the fixture
+    # The bucket is resolved (or created) on first use
+    test_s3._S3Storage__bucket
     # Check bucket created
     bucket_exists = False
-    for bucket in test_s3._S3Storage__s3resource.buckets.all():
-        if root_folder in bucket.name:
+    for bucket in test_s3._S3Storage__s3client.list_buckets()['Buckets']:
+        if root_folder in bucket['Name']:
             bucket_exists = True
             break
     assert bucket_exists
@@ -51,8 +53,8 @@ def test_save_json_file(test_s3: S3Storage,
         data_folder,
         "test_file1")
     try:
-        test_s3._S3Storage__s3resource.Object(
-            test_s3._S3Storage__bucket_name, f"{data_folder}/test_file1.json").load()
+        test_s3._S3Storage__s3client.head_object(
+            Bucket=test_s3._S3Storage__bucket, Key=f"{data_folder}/test_file1.json")
     except botocore.exceptions.ClientError as e:
         file_saved = False
     else:
@@ -64,7 +66,7 @@ def test_save_image(test_s3: S3Storage,
     url = "https://upload.wikimedia.org/wikipedia/commons/thumb/0/0f/Grosser_Panda.JPG/330px-Grosser_Panda.JPG"
     test_s3.save_image(url, images_folder, "panda.jpg")
     try:
-        test_s3._S3Storage__s3resource.Object(test_s3._S3Storage__bucket_name, f"{images_folder}/panda.jpg").load()
+        test_s3._S3Storage__s3client.head_object(Bucket=test_s3._S3Storage__bucket, Key=f"{images_folder}/panda.jpg")
     except botocore.exceptions.ClientError as e:
         file_saved = False
     else:
@@ -91,10 +93,85 @@ def test_list_files(test_s3: S3Storage,
                 f"{data_folder}/test_file2.json", 
                 f"{data_folder}/test_file3.json"
                 ]
-    files = test_s3.list_files(data_folder)
+    files = list(test_s3.list_files(data_folder))
     assert sorted(expected_files) == sorted(files) and len(files) == 3
 
 def test_read_json_file(test_s3: S3Storage,
         data_folder: str):
     file = test_s3.read_json_file(f"{data_folder}/test_file1.json")
     assert file
+
+def test_stale_cached_bucket(test_s3: S3Storage,
+        root_folder: str,
+        data_folder: str,
+        images_folder: str,
+        tmp_path,
+        monkeypatch: pytest.MonkeyPatch):
+    from source.package.storage import s3_storage
+    cache_file = tmp_path / "s3_buckets.json"
+    # A bucket which has been deleted since it was cached
+    cache_file.write_text('{"%s": "%sdeleted"}' % (root_folder, root_folder))
+    monkeypatch.setattr(s3_storage, "BUCKET_CACHE_FILE", str(cache_file))
+    s3 = S3Storage(None, None, None, root_folder, data_folder, images_folder)
+    assert s3._S3Storage__bucket == test_s3._S3Storage__bucket
+    assert root_folder + "deleted" not in cache_file.read_text()
+
+def test_list_files_errors_wrapped(test_s3: S3Storage,
+        data_folder: str):
+    s3 = S3Storage(None, None, None, "unused", data_folder, "images",
+        bucket_name=f"{test_s3._S3Storage__bucket}-missing")
+    with pytest.raises(RuntimeError):
+        list(s3.list_files(data_folder))
+
+def test_manifests_of_writers_merged(test_s3: S3Storage,
+        root_folder: str,
+        data_folder: str,
+        images_folder: str,
+        tmp_path):
+    from source.package.storage import s3_storage
+    from source.package.storage.manifest import Manifest
+    bucket = test_s3._S3Storage__bucket
+    for worker in ["worker-1", "worker-2"]:
+        # Writers syncing in turn do not overwrite each other's entries
+        s3 = S3Storage(None, None, None, root_folder, data_folder, images_folder,
+            Manifest(str(tmp_path / f"{worker}.sqlite")), bucket)
+        s3.save_json_file([{"item_id": f"{worker}-pear"}], data_folder, f"{worker}-file")
+        s3.sync_manifest()
+    s3 = S3Storage(None, None, None, root_folder, data_folder, images_folder,
+        Manifest(str(tmp_path / "reader.sqlite")), bucket)
+    # Fetched on first use, even with the bucket given
+    assert s3._S3Storage__bucket == bucket
+    assert s3.manifest.lookup("worker-1-pear") is not None
+    assert s3.manifest.lookup("worker-2-pear") is not None
+    # The objects merged are replaced by one
+    listed = s3_storage.get_s3_client().list_objects_v2(Bucket=bucket, Prefix=s3_storage.MANIFEST_PREFIX)
+    assert len(listed["Contents"]) == 1
+    s3.sync_manifest()
+    listed = s3_storage.get_s3_client().list_objects_v2(Bucket=bucket, Prefix=s3_storage.MANIFEST_PREFIX)
+    assert len(listed["Contents"]) == 1
+
+def test_shared_manifest_fetched_once(test_s3: S3Storage,
+        root_folder: str,
+        images_folder: str,
+        tmp_path,
+        monkeypatch: pytest.MonkeyPatch):
+    from source.package.storage.manifest import Manifest
+    bucket = test_s3._S3Storage__bucket
+    writer = S3Storage(None, None, None, root_folder, "pear", images_folder,
+        Manifest(str(tmp_path / "writer.sqlite")), bucket)
+    writer.save_json_file([{"item_id": "writer-pear"}], "pear", "writer-file")
+    writer.sync_manifest()
+    manifest = Manifest(str(tmp_path / "shared.sqlite"))
+    merged = []
+    monkeypatch.setattr(manifest, "merge", merged.append)
+    # The storage of each search of a batch
+    for search in ["pear", "apple"]:
+        s3 = S3Storage(None, None, None, root_folder, search, images_folder, manifest, bucket)
+        assert s3._S3Storage__bucket == bucket
+    fetched = len(merged)
+    assert fetched > 0
+    # Synced by the last search of the batch
+    s3.sync_manifest()
+    s3 = S3Storage(None, None, None, root_folder, "plum", images_folder, manifest, bucket)
+    assert s3._S3Storage__bucket == bucket
+    assert len(merged) == fetched
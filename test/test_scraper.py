@@ -6,6 +6,7 @@ from source.package.scraper.scraper import Scraper
 from selenium.webdriver.common.by import By
 from selenium.common.exceptions import NoSuchElementException
 from selenium.webdriver.remote.webelement import WebElement
+from benchmarks.fixture_server import FixtureServer
 
 # TODO Add Docstring
 
@@ -15,6 +16,12 @@ def test_scraper() -> Scraper:
     yield ts
     ts.quit()
 
+@pytest.fixture(scope="module")
+def fixture_site() -> str:
+    # The saved pages of the benchmarks, served locally
+    with FixtureServer() as server:
+        yield server.url
+
 def test_constructor():
     ts = Scraper("https://www.propertypal.com/")
     assert ts._Scraper__driver.session_id
@@ -174,3 +181,28 @@ def test_invalid_dict_val(test_scraper: Scraper):
 def test_invalid_url(test_scraper: Scraper):
     with pytest.raises(RuntimeError):
         assert not test_scraper.go_to_page_url("https://www.this_is_not_a_valid_url.com", None)
+
+def test_recycle_keeps_cookies(fixture_site: str):
+    ts = Scraper(fixture_site, max_pages=2)
+    ts._Scraper__driver.add_cookie({"name": "consent", "value": "yes"})
+    session_id = ts._Scraper__driver.session_id
+    ts.go_to_page_url(f"{fixture_site}recipes/chicken-curry", None)
+    # The page limit is reached before the next page load
+    ts.go_to_page_url(f"{fixture_site}recipes/chicken-pie", None)
+    assert ts._Scraper__driver.session_id != session_id
+    assert ts.recycles == 1
+    assert ts._Scraper__driver.get_cookie("consent")["value"] == "yes"
+    ts.quit()
+
+def test_crashed_session_recovered(fixture_site: str):
+    ts = Scraper(fixture_site)
+    # The browser exits without the scraper knowing
+    ts._Scraper__driver.quit()
+    assert ts.go_to_page_url(f"{fixture_site}recipes/chicken-curry", None)
+    assert ts.recycles == 1
+    ts.quit()
+
+def test_process_tree_rss():
+    import os
+    from source.package.scraper.scraper import _process_tree_rss
+    assert _process_tree_rss(os.getpid()) > 0
@@ -0,0 +1,117 @@
+import os
+import sys
+import pytest
+
+# streaming imports the package as `package` (run from source/)
+SOURCE_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "source")
+if SOURCE_FOLDER not in sys.path:
+    sys.path.insert(0, SOURCE_FOLDER)
+
+# The pipeline imports Selenium (through recipe_scraper) and tqdm
+streaming = pytest.importorskip("streaming")
+from package.storage.dead_letter import DeadLetters
+
+URLS = [f"https://www.bbcgoodfood.com/recipes/pear-{n}" for n in range(5)]
+
+def _recipe(url: str) -> dict:
+    return {"item_id": url.rsplit('/', 1)[-1], "image_urls": []}
+
+class FakeDB:
+    def __init__(self, stored: set = ()):
+        self.stored = set(stored)
+        self.checks = []
+        self.inserts = []
+
+    def existing_items(self, table: str, column: str, ids: list) -> set:
+        self.checks.append(list(ids))
+        return self.stored & set(ids)
+
+    def json_to_db(self, json_data: list, *args):
+        self.inserts.append([page_dict["item_id"] for page_dict in json_data])
+
+class FakeManifest:
+    def __init__(self, saved: set):
+        self.saved = saved
+
+    def lookup(self, item_id: str) -> dict:
+        return {"item_id": item_id} if item_id in self.saved else None
+
+class FakeStorage:
+    data_folder = "data"
+    images_folder = "data/images"
+
+    def __init__(self, manifest: FakeManifest = None, images: set = ()):
+        self.manifest = manifest
+        self.files = []
+        self.images = set(images)
+
+    def save_json_file(self, page_data: list, folder: str, file: str):
+        self.files.append([page_dict["item_id"] for page_dict in page_data])
+
+    def save_image(self, url: str, folder: str, file: str):
+        self.images.add(file)
+
+    def file_exists(self, folder: str, file: str) -> bool:
+        return file in self.images
+
+class FakeScraper:
+    def get_page_data(self, url: str) -> dict:
+        if url == URLS[1]:
+            raise RuntimeError("No recipe name")
+        return {} if url == URLS[2] else _recipe(url)
+
+def test_batched():
+    assert list(streaming.batched(range(5), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(streaming.batched([], 2)) == []
+    with pytest.raises(ValueError):
+        list(streaming.batched(range(5), 0))
+
+def test_filter_new():
+    db = FakeDB(stored={"pear-0"})
+    seen_ids = {"pear-3"}
+    urls = list(streaming.filter_new(URLS + URLS[1:2], db, seen_ids, batch_size=4))
+    # Stored, seen before and listed twice are dropped
+    assert urls == [URLS[1], URLS[2], URLS[4]]
+    assert [len(ids) for ids in db.checks] == [4, 2]
+    assert seen_ids == {f"pear-{n}" for n in range(5)}
+
+def test_scrape_skips_failures(tmp_path):
+    dead_letters = DeadLetters(str(tmp_path / "dead_letters.sqlite"))
+    try:
+        recipes = list(streaming.scrape(FakeScraper(), URLS[:4], "pear", dead_letters))
+        assert [page_dict["item_id"] for page_dict in recipes] == ["pear-0", "pear-3"]
+        assert [item["url"] for item in dead_letters.items("pear")] == [URLS[1]]
+    finally:
+        dead_letters.close()
+
+def test_store_and_load_batches():
+    file_store = FakeStorage()
+    db = FakeDB()
+    stream = streaming.load(
+        streaming.store((_recipe(url) for url in URLS), file_store, "pear", batch_size=2),
+        db, batch_size=3)
+    # Nothing runs until the stream is read
+    assert file_store.files == [] and db.inserts == []
+    assert streaming.consume(stream) == 5
+    assert file_store.files == [["pear-0", "pear-1"], ["pear-2", "pear-3"], ["pear-4"]]
+    assert db.inserts == [["pear-0", "pear-1", "pear-2"], ["pear-3", "pear-4"]]
+
+def test_items_saved_by_earlier_run_not_saved_again():
+    # The database insert failed after the data file was saved
+    file_store = FakeStorage(FakeManifest({"pear-1"}))
+    db = FakeDB()
+    assert streaming.consume(streaming.load(
+        streaming.store((_recipe(url) for url in URLS[:3]), file_store, "pear"), db)) == 3
+    assert file_store.files == [["pear-0", "pear-2"]]
+    assert db.inserts == [["pear-0", "pear-1", "pear-2"]]
+
+def test_missing_images_saved_for_earlier_run():
+    # The earlier run failed after saving the data file and one image
+    file_store = FakeStorage(FakeManifest({"pear-1"}), images={"pear-1.jpg"})
+    recipe = dict(_recipe(URLS[1]), image_urls=[
+        "https://images.example/pear-1.jpg?w=1", "https://images.example/pear-1.png?w=1"])
+    saved = []
+    file_store.save_image = lambda url, folder, file: saved.append(file)
+    assert streaming.consume(streaming.store(iter([recipe]), file_store, "pear")) == 1
+    assert file_store.files == []
+    assert saved == ["pear-1.png"]
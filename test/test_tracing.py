@@ -0,0 +1,40 @@
+from source.package.utils import tracing
+import pytest
+import json
+
+@pytest.fixture
+def trace_file(tmp_path) -> str:
+    yield str(tmp_path / "trace.json")
+    tracing.disable_tracing()
+
+def test_span_is_noop_when_disabled():
+    assert tracing.get_tracer() is None
+    with tracing.span("recipe", url="https://example.com"):
+        pass
+
+def test_spans_written_as_trace_events(trace_file: str):
+    tracing.enable_tracing(trace_file)
+    with tracing.span("search_page", search="chicken", page_num=1):
+        with tracing.span("page_load", "stage"):
+            pass
+    tracing.disable_tracing()
+    with open(trace_file) as f:
+        events = json.load(f)
+    spans = [e for e in events if e["ph"] == "X"]
+    assert [e["name"] for e in spans] == ["page_load", "search_page"]
+    outer, inner = spans[1], spans[0]
+    assert outer["args"] == {"search": "chicken", "page_num": 1}
+    assert inner["cat"] == "stage"
+    assert outer["ts"] <= inner["ts"]
+    assert inner["ts"] + inner["dur"] <= outer["ts"] + outer["dur"]
+    assert any(e["ph"] == "M" and e["name"] == "thread_name" for e in events)
+
+def test_exception_still_recorded(trace_file: str):
+    tracing.enable_tracing(trace_file)
+    with pytest.raises(ValueError):
+        with tracing.span("extract"):
+            raise ValueError("bad page")
+    tracing.disable_tracing()
+    with open(trace_file) as f:
+        events = json.load(f)
+    assert [e["name"] for e in events if e["ph"] == "X"] == ["extract"]